@@ -12,9 +12,9 @@ from utils.utils import make_grid, save_image
 from tqdm import tqdm
 import cv2
 
-from pytorch_gan_metrics.utils import get_inception_score_from_directory
 
 from utils.torch_fid_score import get_fid
+from utils.class_metrics import ClassMetrics
 
 from torch.utils.data import DataLoader
 
@@ -401,29 +401,32 @@ def save_samples(args, train_loader, fid_stat, epoch, gen_net: nn.Module, lstm:
     return 0
 
 def images_IS_by_categories(args, test_loader, fid_stat, epoch, gen_net: nn.Module, lstm: nn.Module, writer_dict, clean_dir=True):
+    """IS and FID of every label of the test set, in one pass of Inception over the generated images.
+
+    The FID of a label is computed against the real images the loader pairs
+    with its EEG. Returns {label: (IS, IS_std, FID)}.
+    """
     # eval mode
     gen_net.eval()
+    class_metrics = ClassMetrics(num_classes=40)
     with torch.no_grad():
-        for i, (eeg, label, imgs) in enumerate(test_loader):
+        for i, (eeg, label, imgs) in enumerate(tqdm(test_loader, desc='IS by categories')):
             rec = lstm(eeg.cpu(), return_eeg_repr=True)                 #MODIFICA: EEG E LSTM SU CPU PER L'EXP DI STL
             rec = rec.cuda()                                            #MODIFICA: REC VIENE SPOSTATO SU GPU PER L'EXP DI STL
             z = torch.normal(mean=0, std=1, size=rec.shape).cuda()      #MODIFICA: RIGA UTILIZZATA E AGGIUNTA PER L'EXP DI STL
             rec_z = torch.cat((rec,z), dim=-1)                          #MODIFICA: RIGA UTILIZZATA E AGGIUNTA PER L'EXP DI STL
             sample_img = gen_net(rec_z, epoch)                          #MODIFICA: RIGA UTILIZZATA E AGGIUNTA PER L'EXP DI STL
-
-            for j, x in enumerate(sample_img):
-                isExist = os.path.exists(f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{label[j]}')
-                if isExist == True:
-                    save_image(x, f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{label[j]}/sampled_image_{j}_{epoch}.png', nrow=10, normalize=True, scale_each=True)
-                else:
-                    os.makedirs(f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{label[j]}', exist_ok=True)
-                    save_image(x, f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{label[j]}/sampled_image_{j}_{epoch}.png', nrow=10, normalize=True, scale_each=True)  
-
-        for z in range(40):
-            assert os.path.exists(f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{z}')
-            IS, IS_std = get_inception_score_from_directory(f'/home/d.sorge/eeg_visual_classification/eeg_visual_classification_original/TransGAN-master/output_stl_Categories/outputLabel{z}')
-            print("Inception Score Category outputLabel", z, ":", IS)
-    return 0
+            class_metrics.update(label, sample_img, imgs)
+
+    results = class_metrics.results()
+    writer = writer_dict['writer'] if writer_dict else None
+    for z, (IS, IS_std, fid) in results.items():
+        print("Inception Score Category outputLabel", z, ":", IS, "FID:", fid)
+        if writer:
+            writer.add_scalar(f'Inception_score_by_category/{z}', IS, epoch)
+            if fid is not None:
+                writer.add_scalar(f'FID_score_by_category/{z}', fid, epoch)
+    return results
 
 def get_topk_arch_hidden(args, controller, gen_net, prev_archs, prev_hiddens):
     """
@@ -24,6 +24,10 @@ class AdamW(Optimizer):
         amsgrad (boolean, optional): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and Beyond`_
             (default: False)
+        foreach (boolean, optional): update all the parameters of a group with
+            multi-tensor (torch._foreach_*) kernels instead of a per-parameter
+            loop; the state layout is the same either way (default: None, use
+            them when available)
 
     .. _Adam\: A Method for Stochastic Optimization:
         https://arxiv.org/abs/1412.6980
@@ -34,7 +38,7 @@ class AdamW(Optimizer):
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=1e-2, amsgrad=False):
+                 weight_decay=1e-2, amsgrad=False, foreach=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -43,14 +47,18 @@ class AdamW(Optimizer):
             raise ValueError("Invalid beta parameter at index 0: {}".format(betas[0]))
         if not 0.0 <= betas[1] < 1.0:
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
+        if foreach is None:
+            foreach = hasattr(torch, '_foreach_addcdiv_')
         defaults = dict(lr=lr, betas=betas, eps=eps,
-                        weight_decay=weight_decay, amsgrad=amsgrad)
+                        weight_decay=weight_decay, amsgrad=amsgrad, foreach=foreach)
         super(AdamW, self).__init__(params, defaults)
 
     def __setstate__(self, state):
         super(AdamW, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('amsgrad', False)
+            # optimizers pickled (or state dicts saved) before foreach was a group option
+            group.setdefault('foreach', hasattr(torch, '_foreach_addcdiv_'))
 
     def step(self, closure=None):
         """Performs a single optimization step.
@@ -64,6 +72,9 @@ class AdamW(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if group['foreach']:
+                self._step_foreach(group)
+                continue
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -81,14 +92,7 @@ class AdamW(Optimizer):
 
                 # State initialization
                 if len(state) == 0:
-                    state['step'] = 0
-                    # Exponential moving average of gradient values
-                    state['exp_avg'] = torch.zeros_like(p.data)
-                    # Exponential moving average of squared gradient values
-                    state['exp_avg_sq'] = torch.zeros_like(p.data)
-                    if amsgrad:
-                        # Maintains max of all exp. moving avg. of sq. grad. values
-                        state['max_exp_avg_sq'] = torch.zeros_like(p.data)
+                    self._init_state(state, p, amsgrad)
 
                 exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
                 if amsgrad:
@@ -100,8 +104,8 @@ class AdamW(Optimizer):
                 bias_correction2 = 1 - beta2 ** state['step']
 
                 # Decay the first and second moment running average coefficient
-                exp_avg.mul_(beta1).add_(1 - beta1, grad)
-                exp_avg_sq.mul_(beta2).addcmul_(1 - beta2, grad, grad)
+                exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
                 if amsgrad:
                     # Maintains the maximum of all 2nd moment running avg. till now
                     torch.max(max_exp_avg_sq, exp_avg_sq, out=max_exp_avg_sq)
@@ -112,6 +116,64 @@ class AdamW(Optimizer):
 
                 step_size = group['lr'] / bias_correction1
 
-                p.data.addcdiv_(-step_size, exp_avg, denom)
+                p.data.addcdiv_(exp_avg, denom, value=-step_size)
 
         return loss
+
+    @staticmethod
+    def _init_state(state, p, amsgrad):
+        state['step'] = 0
+        # Exponential moving average of gradient values
+        state['exp_avg'] = torch.zeros_like(p.data)
+        # Exponential moving average of squared gradient values
+        state['exp_avg_sq'] = torch.zeros_like(p.data)
+        if amsgrad:
+            # Maintains max of all exp. moving avg. of sq. grad. values
+            state['max_exp_avg_sq'] = torch.zeros_like(p.data)
+
+    @torch.no_grad()
+    def _step_foreach(self, group):
+        """The update of `step` for all the parameters of `group` with multi-tensor kernels."""
+        amsgrad = group['amsgrad']
+        beta1, beta2 = group['betas']
+        # parameters are bucketed by step count, which sets the bias corrections
+        buckets = dict()
+        for p in group['params']:
+            if p.grad is None:
+                continue
+            if p.grad.is_sparse:
+                raise RuntimeError('Adam does not support sparse gradients, please consider SparseAdam instead')
+            state = self.state[p]
+            if len(state) == 0:
+                self._init_state(state, p, amsgrad)
+            state['step'] += 1
+            buckets.setdefault(state['step'], []).append(p)
+
+        for step, params in buckets.items():
+            states = [self.state[p] for p in params]
+            grads = [p.grad for p in params]
+            exp_avgs = [state['exp_avg'] for state in states]
+            exp_avg_sqs = [state['exp_avg_sq'] for state in states]
+            bias_correction1 = 1 - beta1 ** step
+            bias_correction2 = 1 - beta2 ** step
+
+            # Perform stepweight decay
+            torch._foreach_mul_(params, 1 - group['lr'] * group['weight_decay'])
+
+            # Decay the first and second moment running average coefficient
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, 1 - beta2)
+            if amsgrad:
+                max_exp_avg_sqs = [state['max_exp_avg_sq'] for state in states]
+                for max_exp_avg_sq, exp_avg_sq in zip(max_exp_avg_sqs, exp_avg_sqs):
+                    torch.max(max_exp_avg_sq, exp_avg_sq, out=max_exp_avg_sq)
+                denom = torch._foreach_sqrt(max_exp_avg_sqs)
+            else:
+                denom = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_div_(denom, math.sqrt(bias_correction2))
+            torch._foreach_add_(denom, group['eps'])
+
+            step_size = group['lr'] / bias_correction1
+            torch._foreach_addcdiv_(params, exp_avgs, denom, -step_size)
@@ -0,0 +1,41 @@
+import sys
+
+import cfg
+
+# configuration of example.sbatch (64x64 EEG-conditioned generator)
+EXAMPLE_ARGS = [
+    '-gen_bs', '16',
+    '-dis_bs', '16',
+    '--dataset', 'eegdataset',
+    '--bottom_width', '8',
+    '--img_size', '64',
+    '--gen_model', 'ViT_custom_local544444_256_rp',
+    '--dis_model', 'ViT_custom_scale2',
+    '--g_window_size', '16',
+    '--d_window_size', '16',
+    '--g_norm', 'pn',
+    '--df_dim', '384',
+    '--d_depth', '3',
+    '--g_depth', '5,4,2,2',
+    '--latent_dim', '56320',
+    '--gf_dim', '256',
+    '--loss', 'wgangp-eps',
+    '--phi', '1',
+    '--n_critic', '4',
+    '--patch_size', '2',
+    '--diff_aug', 'filter,translation,erase_ratio,color,hue',
+    '--ema', '0.995',
+]
+
+
+def example_args(argv=None):
+    """cfg arguments of example.sbatch, overridden by `argv` (default: sys.argv)."""
+    argv = sys.argv[1:] if argv is None else argv
+    return cfg.parse_args(EXAMPLE_ARGS + list(argv))
+
+
+def build_nets(args, device='cpu'):
+    import models_search
+    gen_net = getattr(models_search, args.gen_model).Generator(args=args).to(device)
+    dis_net = getattr(models_search, args.dis_model).Discriminator(args=args).to(device)
+    return gen_net, dis_net
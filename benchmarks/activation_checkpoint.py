@@ -0,0 +1,114 @@
+"""Activation memory and step time of a generator step with `--g_checkpoint` / `--d_checkpoint`.
+
+    python -m benchmarks.activation_checkpoint [cfg overrides, e.g. -gen_bs 32 --latent_proj factorized]
+
+On CUDA the peak allocated memory of the step is reported, otherwise the bytes
+of the tensors autograd keeps for backward (parameters excluded). Those are
+counted with saved tensor hooks, torch >= 1.10; with the pinned torch 1.7 the
+memory is only reported on CUDA and the CPU run gives the step time alone.
+"""
+import time
+
+import torch
+
+from benchmarks import example_args, build_nets
+
+
+# torch.autograd.graph.saved_tensors_hooks is only in torch >= 1.10
+HAS_SAVED_TENSORS_HOOKS = hasattr(getattr(torch.autograd, 'graph', None), 'saved_tensors_hooks')
+
+
+def _storage(t):
+    # (data_ptr, nbytes) of the storage of `t`, Tensor.untyped_storage is only in torch >= 2.0
+    if hasattr(t, 'untyped_storage'):
+        storage = t.untyped_storage()
+        return storage.data_ptr(), storage.nbytes()
+    storage = t.storage()
+    return storage.data_ptr(), storage.size() * storage.element_size()
+
+
+class SavedBytes(object):
+    """Sums the distinct storages saved for backward inside the context."""
+    def __init__(self, exclude=()):
+        self.storages = dict()
+        exclude = {_storage(p)[0] for p in exclude}
+
+        def pack(t):
+            data_ptr, nbytes = _storage(t)
+            if data_ptr not in exclude:
+                self.storages[data_ptr] = nbytes
+            return t
+        self.hooks = torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t)
+
+    def __enter__(self):
+        self.hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.hooks.__exit__(*exc)
+
+    @property
+    def nbytes(self):
+        return sum(self.storages.values())
+
+
+def set_checkpoint(gen_net, dis_net, gen, dis):
+    for m in gen_net.modules():
+        if isinstance(getattr(m, 'use_checkpoint', None), bool):
+            m.use_checkpoint = gen
+    dis_net.use_checkpoint = [dis] * len(dis_net.use_checkpoint)
+
+
+def step(gen_net, dis_net, eeg):
+    dis_net(gen_net(eeg, 0)).mean().backward()
+
+
+def measure(gen_net, dis_net, eeg, iters=5):
+    params = list(gen_net.parameters()) + list(dis_net.parameters())
+    for p in params:
+        p.grad = None
+    if eeg.is_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        step(gen_net, dis_net, eeg)
+        torch.cuda.synchronize()
+        memory = torch.cuda.max_memory_allocated() - base
+    elif HAS_SAVED_TENSORS_HOOKS:
+        with SavedBytes(exclude=params) as saved:
+            step(gen_net, dis_net, eeg)
+        memory = saved.nbytes
+    else:
+        memory = float('nan')
+    sync = torch.cuda.synchronize if eeg.is_cuda else (lambda: None)
+    sync()
+    start = time.time()
+    for _ in range(iters):
+        step(gen_net, dis_net, eeg)
+    sync()
+    return memory, (time.time() - start) / iters * 1000
+
+
+def main():
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    args = example_args()
+    gen_net, dis_net = build_nets(args, device)
+    gen_net.train()
+    dis_net.train()
+    eeg = torch.randn(args.gen_batch_size, args.latent_dim, device=device)
+    label = 'peak MiB' if device.type == 'cuda' else 'saved MiB'
+    print(f'batch {args.gen_batch_size}, {args.gen_model} / {args.dis_model}')
+    if device.type != 'cuda' and not HAS_SAVED_TENSORS_HOOKS:
+        print(f'torch {torch.__version__} has no saved tensor hooks (>= 1.10): the memory needs CUDA, '
+              f'only the step time is measured')
+    print(f'{"G ckpt":<8}{"D ckpt":<8}{label:>12}{"saved":>10}{"step (ms)":>12}')
+    reference = None
+    for gen, dis in ((False, False), (True, False), (False, True), (True, True)):
+        set_checkpoint(gen_net, dis_net, gen, dis)
+        memory, ms = measure(gen_net, dis_net, eeg)
+        reference = memory if reference is None else reference
+        print(f'{str(gen):<8}{str(dis):<8}{memory / 2 ** 20:12.1f}{1 - memory / reference:10.1%}{ms:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Step time of adamw.AdamW with the per-parameter loop and with foreach kernels, on the G and D parameters.
+
+    python -m benchmarks.adamw_step [cfg overrides, e.g. --latent_proj factorized]
+"""
+import time
+
+import torch
+
+from adamw import AdamW
+from benchmarks import example_args, build_nets
+
+
+def step_time(params, foreach, iters=20):
+    optimizer = AdamW(params, 1e-4, weight_decay=1e-3, foreach=foreach)
+    sync = torch.cuda.synchronize if params[0].is_cuda else (lambda: None)
+    optimizer.step()
+    sync()
+    start = time.time()
+    for _ in range(iters):
+        optimizer.step()
+    sync()
+    return (time.time() - start) / iters * 1000
+
+
+def main():
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    args = example_args()
+    for name, net in zip(('gen_net', 'dis_net'), build_nets(args, device)):
+        params = [p for p in net.parameters() if p.requires_grad]
+        for p in params:
+            p.grad = torch.randn_like(p)
+        loop, foreach = step_time(params, False), step_time(params, True)
+        print(f'{name}: {len(params)} tensors, {sum(p.numel() for p in params) / 1e6:.1f}M params, '
+              f'loop {loop:.2f} ms, foreach {foreach:.2f} ms ({loop / foreach:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Iterations/s of CPU data-parallel training (`--cpu_procs`) from 1 to N gloo processes on this machine.
+
+    python -m benchmarks.cpu_scaling [--max_procs N] [--iters 5] [cfg overrides, e.g. -dis_bs 32 --intra_op_threads 4]
+
+Every process is pinned to its core group like train_derived.py does and
+trains on dis_batch_size / N samples of the same global batch (a D step and a
+G step, both through DistributedDataParallel), so it/s is comparable between
+the process counts.
+"""
+import argparse
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from adamw import AdamW
+from benchmarks import example_args, build_nets
+from functions import setup_cpu_worker
+
+
+def worker(rank, nprocs, argv, iters, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(29600 + nprocs)
+    args = example_args(argv)
+    threads = setup_cpu_worker(rank, nprocs, args.intra_op_threads)
+    dist.init_process_group('gloo', rank=rank, world_size=nprocs)
+    batch_size = max(1, args.dis_batch_size // nprocs)
+
+    torch.manual_seed(0)
+    gen_net, dis_net = build_nets(args)
+    gen_net = torch.nn.parallel.DistributedDataParallel(gen_net, find_unused_parameters=not args.static_graph)
+    dis_net = torch.nn.parallel.DistributedDataParallel(dis_net, find_unused_parameters=not args.static_graph)
+    gen_optimizer = AdamW(gen_net.parameters(), args.g_lr, weight_decay=args.wd)
+    dis_optimizer = AdamW(dis_net.parameters(), args.d_lr, weight_decay=args.wd)
+    eeg = torch.randn(batch_size, args.latent_dim)
+    real_imgs = torch.randn(batch_size, 3, args.img_size, args.img_size)
+
+    def step():
+        with torch.no_grad():
+            fake_imgs = gen_net(eeg, 0)
+        d_loss = -torch.mean(dis_net(real_imgs)) + torch.mean(dis_net(fake_imgs))
+        d_loss.backward()
+        dis_optimizer.step()
+        dis_optimizer.zero_grad()
+        g_loss = -torch.mean(dis_net(gen_net(eeg, 0)))
+        g_loss.backward()
+        gen_optimizer.step()
+        gen_optimizer.zero_grad()
+        dis_optimizer.zero_grad()
+
+    step()
+    dist.barrier()
+    start = time.time()
+    for _ in range(iters):
+        step()
+    dist.barrier()
+    if rank == 0:
+        results.put((threads, iters / (time.time() - start)))
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_procs', type=int, default=None, help='default: the available cores')
+    parser.add_argument('--iters', type=int, default=5)
+    opt, argv = parser.parse_known_args()
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    max_procs = opt.max_procs or cores
+    counts = sorted({n for n in (1, 2, 4, 8, 16, 32, 64, max_procs) if n <= max_procs})
+    args = example_args(argv)
+
+    print(f'{cores} cores, global batch {args.dis_batch_size}, {args.gen_model} / {args.dis_model}')
+    print(f'{"procs":>6}{"threads":>9}{"it/s":>10}{"img/s":>10}{"speedup":>9}{"efficiency":>12}')
+    results = mp.get_context('spawn').SimpleQueue()
+    base = None
+    for nprocs in counts:
+        mp.spawn(worker, args=(nprocs, argv, opt.iters, results), nprocs=nprocs)
+        threads, it_s = results.get()
+        base = base or it_s
+        print(f'{nprocs:6d}{threads:9d}{it_s:10.2f}{it_s * args.dis_batch_size:10.1f}'
+              f'{it_s / base:9.2f}{it_s / base / nprocs:12.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Gradient accumulation under DDP with the all-reduce on every micro-step vs. only on the last (`ddp_sync`).
+
+    python -m benchmarks.ddp_accumulation [--world_size 2] [cfg overrides, e.g. --accumulated_times 4 -dis_bs 4]
+
+Runs the discriminator on CPU with the gloo backend. For both modes it counts
+the all-reduced buckets and times an optimizer step; it also checks that the
+accumulated gradients match the all-reduced mean of the local ones. The buckets
+are counted with a DDP communication hook, the public API of torch >= 1.8;
+with the pinned torch 1.7 only the time and the gradient check are reported.
+"""
+import argparse
+import os
+import time
+from copy import deepcopy
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from benchmarks import example_args, build_nets
+from torch_utils.misc import ddp_sync
+
+
+def accumulate(dis_net, batches, sync_every_step):
+    for i, x in enumerate(batches):
+        with ddp_sync(dis_net, sync_every_step or i == len(batches) - 1):
+            dis_net(x).mean().backward()
+
+
+def worker(rank, world_size, argv):
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', '29512')
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, torch.get_num_threads() // world_size))
+    # no augmentation, so that the DDP and the reference passes see the same inputs
+    args = example_args(argv + ['--diff_aug', 'None'])
+
+    torch.manual_seed(0)
+    _, reference = build_nets(args)
+    dis_net = torch.nn.parallel.DistributedDataParallel(deepcopy(reference), find_unused_parameters=True)
+    buckets = [0]
+    # DistributedDataParallel.register_comm_hook and default_hooks.allreduce_hook(state, bucket) are torch >= 1.8
+    count_buckets = hasattr(dis_net, 'register_comm_hook')
+    if count_buckets:
+        from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+
+        def count_allreduce(state, bucket):
+            buckets[0] += 1
+            return default_hooks.allreduce_hook(state, bucket)
+        dis_net.register_comm_hook(None, count_allreduce)
+    elif rank == 0:
+        print(f'torch {torch.__version__} has no DDP communication hooks (>= 1.8): the buckets are not counted')
+
+    torch.manual_seed(rank + 1)
+    batches = [torch.randn(args.dis_batch_size, 3, args.img_size, args.img_size)
+               for _ in range(args.accumulated_times)]
+
+    # reference: local accumulation, then one explicit all-reduce
+    for x in batches:
+        reference(x).mean().backward()
+    for p in reference.parameters():
+        if p.grad is not None:
+            dist.all_reduce(p.grad)
+            p.grad /= world_size
+
+    for sync_every_step in (True, False):
+        for p in dis_net.parameters():
+            p.grad = None
+        buckets[0] = 0
+        dist.barrier()
+        start = time.time()
+        accumulate(dis_net, batches, sync_every_step)
+        dist.barrier()
+        elapsed = (time.time() - start) * 1000
+        diff = max((p.grad - q.grad).abs().max().item()
+                   for p, q in zip(dis_net.module.parameters(), reference.parameters()) if q.grad is not None)
+        if rank == 0:
+            mode = 'every micro-step' if sync_every_step else 'last micro-step'
+            count = f'{buckets[0]:4d}' if count_buckets else f'{"-":>4}'
+            print(f'all-reduce on {mode:<16} {count} buckets {elapsed:10.1f} ms  max |grad diff| {diff:.2e}')
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--world_size', type=int, default=2)
+    opt, argv = parser.parse_known_args()
+    argv = argv or ['--accumulated_times', '4', '-dis_bs', '4']
+    print(f'gloo, {opt.world_size} processes, cfg overrides {argv}')
+    mp.spawn(worker, args=(opt.world_size, argv), nprocs=opt.world_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Size, reconstruction error and load time of utils.ema_archive vs. a full EMA copy per epoch.
+
+    python -m benchmarks.ema_archive [--epochs 10] [--steps 20] [cfg overrides, e.g. --latent_proj lowrank]
+
+Between two "epochs" the generator takes `steps` AdamW steps on random
+gradients and the EMA follows with --ema, so the deltas are of the size of
+real training (small lr, EMA smoothing) rather than of random weights. The
+archives are given the live EMA state dict, which the following epochs keep
+updating, and every epoch is rebuilt and compared with a copy taken when it
+was archived. Sizes are those of the files on disk.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from adamw import AdamW
+from benchmarks import example_args, build_nets
+from functions import GeneratorEMA
+from utils.ema_archive import EMAArchive, PRECISIONS
+
+
+def ema_epochs(args, epochs, steps):
+    """(live EMA state dict, copy of it) per epoch, the live one is updated by the next epoch like in training"""
+    gen_net, _ = build_nets(args)
+    ema = GeneratorEMA(gen_net)
+    optimizer = AdamW(gen_net.parameters(), args.g_lr, weight_decay=args.wd)
+    for _ in range(epochs):
+        for _ in range(steps):
+            for p in gen_net.parameters():
+                p.grad = torch.randn_like(p)
+            optimizer.step()
+            ema.update(gen_net, args.ema)
+        state_dict = ema.state_dict()
+        yield state_dict, {k: v.clone() for k, v in state_dict.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--steps', type=int, default=20)
+    opt, argv = parser.parse_known_args()
+    args = example_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archives = {precision: EMAArchive(os.path.join(tmp, precision), precision) for precision in PRECISIONS}
+        snapshots, full = [], 0
+        for epoch, (live, snapshot) in enumerate(ema_epochs(args, opt.epochs, opt.steps), 1):
+            # the archives get the live state dict of the EMA, as in train_derived.py
+            for archive in archives.values():
+                archive.append(epoch, live)
+            path = os.path.join(tmp, f'ema_{epoch}.pth')
+            torch.save(snapshot, path)
+            full += os.path.getsize(path)
+            snapshots.append(snapshot)
+
+        print(f'{len(snapshots)} epochs, per-epoch EMA saves {full / 2 ** 20:.1f} MiB on disk')
+        print(f'{"deltas":<8}{"MiB":>10}{"ratio":>8}{"max |err|":>12}{"load last (ms)":>16}')
+        for precision, archive in archives.items():
+            reader = EMAArchive(archive.directory)
+            err = 0.
+            for epoch, snapshot in enumerate(snapshots, 1):
+                rebuilt = reader.load(epoch)
+                err = max([err] + [(rebuilt[k] - v.float()).abs().max().item()
+                                   for k, v in snapshot.items() if v.is_floating_point()])
+            reader = EMAArchive(archive.directory)
+            start = time.time()
+            reader.load()
+            ms = (time.time() - start) * 1000
+            size = archive.nbytes()
+            print(f'{precision:<8}{size / 2 ** 20:10.1f}{full / size:8.1f}{err:12.2e}{ms:16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Time and peak memory of KID and precision/recall of utils.feature_metrics, per block size.
+
+    python -m benchmarks.feature_metrics [--num_gen 10000] [--num_real 2000] [--device cuda]
+
+The features are random non-negative 2048-d vectors, like Inception pool
+features; the generated ones are shifted, so the metrics are away from their
+ideal values. Precision/recall should not depend on the block size, only time
+and memory should.
+"""
+import argparse
+import time
+
+import torch
+
+from utils.feature_metrics import kernel_inception_distance, precision_recall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_gen', type=int, default=10000)
+    parser.add_argument('--num_real', type=int, default=2000)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt = parser.parse_args()
+    device = torch.device(opt.device)
+
+    g = torch.Generator().manual_seed(0)
+    real = torch.randn(opt.num_real, 2048, generator=g).relu()
+    gen = (torch.randn(opt.num_gen, 2048, generator=g) + 0.1).relu()
+    cuda = device.type == 'cuda'
+
+    def timed(fn, *args, **kwargs):
+        if cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.time()
+        value = fn(*args, **kwargs)
+        if cuda:
+            torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2 ** 20 if cuda else float('nan')
+        return value, time.time() - start, peak
+
+    print(f'{opt.num_gen} generated, {opt.num_real} real features on {device}')
+    (kid, kid_std), seconds, peak = timed(kernel_inception_distance, gen, real, device=device)
+    print(f'KID {kid:.5f} +- {kid_std:.5f}: {seconds:.2f} s, peak {peak:.0f} MiB')
+    print(f'{"block":>6}{"precision":>11}{"recall":>9}{"sec":>8}{"MiB":>8}')
+    for batch_size in (250, 1000, 4000):
+        (precision, recall), seconds, peak = timed(precision_recall, gen, real, batch_size=batch_size, device=device)
+        print(f'{batch_size:6d}{precision:11.4f}{recall:9.4f}{seconds:8.2f}{peak:8.0f}')
+
+
+if __name__ == '__main__':
+    main()
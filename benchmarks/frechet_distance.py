@@ -0,0 +1,91 @@
+"""Frechet distance of utils.fid_stats (eigenvalues) vs. scipy sqrtm and Newton-Schulz, time and agreement.
+
+    python -m benchmarks.frechet_distance [--dim 2048] [--num_images 10000 1000] [--stats a.npz b.npz]
+
+Without --stats the statistics are those of random non-negative features, like
+the pool features of Inception; fewer images than dimensions give the singular
+covariances of small evaluation sets.
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+import torch
+from scipy import linalg
+
+from utils.fid_stats import frechet_distance
+from utils.torch_fid_score import sqrt_newton_schulz
+
+
+def scipy_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
+    # utils.fid_score.calculate_frechet_distance, without its tensorflow import
+    diff = mu1 - mu2
+    covmean, _ = linalg.sqrtm(sigma1.dot(sigma2), disp=False)
+    if not np.isfinite(covmean).all():
+        offset = np.eye(sigma1.shape[0]) * eps
+        covmean = linalg.sqrtm((sigma1 + offset).dot(sigma2 + offset))
+    return float(diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * np.trace(covmean.real))
+
+
+def newton_schulz_frechet_distance(mu1, sigma1, mu2, sigma2, device):
+    mu1, sigma1, mu2, sigma2 = (torch.as_tensor(t).to(device, torch.float32) for t in (mu1, sigma1, mu2, sigma2))
+    covmean = sqrt_newton_schulz(sigma1.mm(sigma2).unsqueeze(0), 50).squeeze()
+    diff = mu1 - mu2
+    return float(diff.dot(diff) + sigma1.trace() + sigma2.trace() - 2 * covmean.trace())
+
+
+def random_stats(dim, num_images, seed):
+    g = np.random.RandomState(seed)
+    mixing = g.randn(dim, dim) / np.sqrt(dim)
+    features = np.maximum(g.randn(num_images, dim).dot(mixing) + g.rand(dim), 0)
+    return features.mean(0), np.cov(features, rowvar=False)
+
+
+def timed(fn, *args):
+    start = time.time()
+    value = fn(*args)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return value, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--num_images', type=int, nargs='+', default=[10000, 1000])
+    parser.add_argument('--stats', type=str, nargs=2, default=None, help='two .npz files with mu and sigma')
+    opt = parser.parse_args()
+
+    if opt.stats:
+        cases = [tuple(np.load(p)[k] for p in opt.stats for k in ('mu', 'sigma'))]
+        names = [' / '.join(opt.stats)]
+    else:
+        cases, names = [], []
+        for n in opt.num_images:
+            cases.append(random_stats(opt.dim, n, 0) + random_stats(opt.dim, n, 1))
+            names.append(f'{n} images of {opt.dim}-d features')
+
+    methods = [('scipy sqrtm', scipy_frechet_distance),
+               ('eigh float64 cpu', lambda *s: frechet_distance(*s, device='cpu'))]
+    if torch.cuda.is_available():
+        methods += [('eigh float64 cuda', lambda *s: frechet_distance(*s, device='cuda')),
+                    ('eigh float32 cuda', lambda *s: frechet_distance(*s, device='cuda', dtype=torch.float32)),
+                    ('newton-schulz cuda', lambda *s: newton_schulz_frechet_distance(*s, 'cuda'))]
+    else:
+        methods += [('newton-schulz cpu', lambda *s: newton_schulz_frechet_distance(*s, 'cpu'))]
+
+    for name, stats in zip(names, cases):
+        print(name)
+        print(f'{"":>20}{"FID":>14}{"|diff|":>12}{"sec":>8}')
+        reference = None
+        for method, fn in methods:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                fid, seconds = timed(fn, *stats)
+            reference = fid if reference is None else reference
+            print(f'{method:>20}{fid:14.6f}{abs(fid - reference):12.2e}{seconds:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Throughput of utils.torch_inception_score on generator output, per Inception batch size.
+
+    python -m benchmarks.inception_score [--num_images 2000] [--device cpu] [cfg overrides]
+
+Also checks that scoring the [-1, 1] tensors directly gives the score of the
+same images as uint8 pixels, the input of utils.inception_score.get_inception_score.
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks import example_args, build_nets
+from utils.torch_inception_score import InceptionScore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_images', type=int, default=2000)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    opt, argv = parser.parse_known_args()
+    device = torch.device(opt.device)
+    args = example_args(argv)
+    gen_net, _ = build_nets(args, device)
+    gen_net.eval()
+    with torch.no_grad():
+        imgs = torch.cat([gen_net(torch.randn(args.eval_batch_size, args.latent_dim, device=device), 0)
+                          for _ in range(-(-opt.num_images // args.eval_batch_size))])[:opt.num_images]
+    sync = torch.cuda.synchronize if device.type == 'cuda' else (lambda: None)
+
+    print(f'{imgs.size(0)} images of {imgs.size(-1)}x{imgs.size(-1)} on {device}')
+    print(f'{"batch":>6}{"img/s":>10}{"IS":>10}')
+    for batch_size in (50, 100, 200):
+        engine = InceptionScore(device=device, batch_size=batch_size)
+        engine.update(imgs[:batch_size])
+        engine.reset()
+        sync()
+        start = time.time()
+        engine.update(imgs)
+        mean, _ = engine.score()
+        print(f'{batch_size:6d}{imgs.size(0) / (time.time() - start):10.1f}{mean:10.3f}')
+
+    pixels = (imgs * 127.5 + 127.5).clamp(0, 255).round().to(torch.uint8)
+    engine.reset()
+    engine.update(pixels, pixels=True)
+    print(f'uint8 pixels: IS {engine.score()[0]:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Parameters, FLOPs and latency of the generator input projections (`--latent_proj`).
+
+    python -m benchmarks.latent_projection [cfg overrides, e.g. --latent_rank 128]
+"""
+import sys
+import time
+
+import torch
+
+from benchmarks import example_args
+from models_search.ViT_helper import latent_projection
+
+
+def _macs(args, num_tokens, dim):
+    # multiply-accumulates per sample
+    if args.latent_proj == 'dense':
+        return args.latent_dim * num_tokens * dim
+    if args.latent_proj == 'lowrank':
+        return args.latent_rank * (args.latent_dim + num_tokens * dim)
+    time_steps = args.latent_dim // args.eeg_channels
+    return args.eeg_channels * time_steps * num_tokens + num_tokens * args.eeg_channels * dim
+
+
+def _latency(module, x, iters=20):
+    sync = torch.cuda.synchronize if x.is_cuda else (lambda: None)
+    for _ in range(3):
+        module(x).sum().backward()
+    sync()
+    start = time.time()
+    for _ in range(iters):
+        module(x).sum().backward()
+    sync()
+    return (time.time() - start) / iters * 1000
+
+
+def main():
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f'{"latent_proj":<12}{"params (M)":>12}{"MiB (fp32)":>12}{"GMAC/sample":>14}{"fwd+bwd (ms)":>14}')
+    for latent_proj in ('dense', 'lowrank', 'factorized'):
+        args = example_args(['--latent_proj', latent_proj] + sys.argv[1:])
+        num_tokens, dim = args.bottom_width ** 2, args.gf_dim
+        module = latent_projection(args, num_tokens, dim).to(device)
+        x = torch.randn(args.gen_batch_size, args.latent_dim, device=device)
+        params = sum(p.numel() for p in module.parameters())
+        print(f'{latent_proj:<12}{params / 1e6:12.2f}{params * 4 / 2 ** 20:12.1f}'
+              f'{_macs(args, num_tokens, dim) / 1e9:14.4f}{_latency(module, x):14.2f}')
+        del module
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Time to get the EMA generator out of a full training checkpoint, torch.load vs. the lazy layout of utils.checkpoint.
+
+    python -m benchmarks.lazy_checkpoint [cfg overrides, e.g. --latent_proj factorized]
+
+The checkpoint holds G, D, the EMA generator and both AdamW states, like the
+epoch checkpoints of train_derived.py. Run it twice to compare warm page caches.
+"""
+import os
+import tempfile
+import time
+
+import torch
+
+from adamw import AdamW
+from benchmarks import example_args, build_nets
+from functions import GeneratorEMA
+from utils import checkpoint as checkpoint_io
+
+
+def full_checkpoint(args):
+    gen_net, dis_net = build_nets(args)
+    states = {'epoch': 1, 'gen_model': args.gen_model, 'dis_model': args.dis_model}
+    for name, net in (('gen', gen_net), ('dis', dis_net)):
+        optimizer = AdamW(net.parameters(), 1e-4)
+        for p in net.parameters():
+            p.grad = torch.randn_like(p)
+        optimizer.step()
+        states[f'{name}_state_dict'] = net.state_dict()
+        states[f'{name}_optimizer'] = optimizer.state_dict()
+    states['avg_gen_state_dict'] = GeneratorEMA(gen_net).state_dict()
+    return states, gen_net
+
+
+def timed(fn):
+    start = time.time()
+    fn()
+    return (time.time() - start) * 1000
+
+
+def main():
+    args = example_args()
+    states, gen_net = full_checkpoint(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        torch_path, lazy_path = os.path.join(tmp, 'torch.pth'), os.path.join(tmp, 'lazy.pth')
+        save_torch = timed(lambda: torch.save(states, torch_path))
+        save_lazy = timed(lambda: checkpoint_io.save(states, lazy_path))
+        load_torch = timed(lambda: gen_net.load_state_dict(torch.load(torch_path)['avg_gen_state_dict']))
+        load_lazy = timed(lambda: gen_net.load_state_dict(checkpoint_io.load(lazy_path)['avg_gen_state_dict']))
+        gen_mb = sum(t.numel() * t.element_size() for t in states['avg_gen_state_dict'].values()) / 2 ** 20
+        print(f'checkpoint {os.path.getsize(torch_path) / 2 ** 20:.1f} MiB, EMA generator {gen_mb:.1f} MiB')
+        print(f'{"format":<8}{"save (ms)":>12}{"load EMA G (ms)":>18}')
+        print(f'{"torch":<8}{save_torch:12.1f}{load_torch:18.1f}')
+        print(f'{"lazy":<8}{save_lazy:12.1f}{load_lazy:18.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Time of a D step with and without the gradient penalty, and amortized per `--gp_every` k.
+
+    python -m benchmarks.lazy_regularization [cfg overrides, e.g. --dis_concat]
+
+A D step here is one batch; with --accumulated_times n an optimizer step is n
+of them and the penalty is skipped or applied on all n, so the saving is the
+same fraction per optimizer step.
+"""
+import time
+
+import torch
+
+from benchmarks import example_args, build_nets
+from functions import compute_gradient_penalty, dis_forward, input_gradient_norm
+
+
+def d_step(args, gen_net, dis_net, eeg, real_imgs, penalty):
+    with torch.no_grad():
+        fake_imgs = gen_net(eeg, 0)
+    real_imgs = real_imgs.detach().requires_grad_(penalty == 'r1')
+    real_validity, fake_validity = dis_forward(args, dis_net, real_imgs, fake_imgs)
+    d_loss = -torch.mean(real_validity) + torch.mean(fake_validity)
+    if penalty == 'r1':
+        d_loss = d_loss + (input_gradient_norm(real_validity, real_imgs) ** 2).mean() * args.r1_gamma / 2
+    elif penalty == 'wgangp':
+        d_loss = d_loss + compute_gradient_penalty(dis_net, real_imgs, fake_imgs, args.phi) * 10 / (args.phi ** 2)
+    d_loss.backward()
+
+
+def step_time(args, gen_net, dis_net, eeg, real_imgs, penalty, iters=10):
+    sync = torch.cuda.synchronize if real_imgs.is_cuda else (lambda: None)
+    d_step(args, gen_net, dis_net, eeg, real_imgs, penalty)
+    sync()
+    start = time.time()
+    for _ in range(iters):
+        d_step(args, gen_net, dis_net, eeg, real_imgs, penalty)
+    sync()
+    return (time.time() - start) / iters * 1000
+
+
+def main():
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    args = example_args()
+    gen_net, dis_net = build_nets(args, device)
+    eeg = torch.randn(args.dis_batch_size, args.latent_dim, device=device)
+    real_imgs = torch.randn(args.dis_batch_size, 3, args.img_size, args.img_size, device=device)
+
+    plain = step_time(args, gen_net, dis_net, eeg, real_imgs, None)
+    print(f'D step without penalty: {plain:.1f} ms')
+    print(f'{"penalty":<10}{"every k":>8}{"ms/step":>10}{"saved":>10}')
+    for penalty in ('wgangp', 'r1'):
+        full = step_time(args, gen_net, dis_net, eeg, real_imgs, penalty)
+        for k in (1, 4, 16):
+            amortized = plain + (full - plain) / k
+            print(f'{penalty:<10}{k:>8}{amortized:10.1f}{1 - amortized / full:10.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Throughput and memory of a D step (real, fake and gradient penalty) plus a G step per `--precision`.
+
+    python -m benchmarks.mixed_precision [cfg overrides, e.g. -gen_bs 32]
+
+Reports images/s, the CUDA peak memory and the loss of the last step, which
+must stay finite: the gradient penalty and the loss reductions run in fp32.
+"""
+import sys
+import time
+
+import torch
+
+from benchmarks import example_args, build_nets
+from functions import autocast, compute_gradient_penalty
+
+
+def step(args, gen_net, dis_net, gen_scaler, dis_scaler, eeg, real_imgs):
+    device_type = real_imgs.device.type
+    with autocast(args.precision, device_type):
+        real_validity = dis_net(real_imgs)
+        fake_imgs = gen_net(eeg, 0).detach()
+        fake_validity = dis_net(fake_imgs)
+    real_validity, fake_validity = real_validity.float(), fake_validity.float()
+    gradient_penalty = compute_gradient_penalty(dis_net, real_imgs, fake_imgs, args.phi, dis_scaler, args.precision)
+    d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + gradient_penalty * 10 / (args.phi ** 2)
+    dis_scaler.scale(d_loss).backward()
+
+    with autocast(args.precision, device_type):
+        fake_validity = dis_net(gen_net(eeg, 0))
+    g_loss = -torch.mean(fake_validity.float())
+    gen_scaler.scale(g_loss).backward()
+    return d_loss.item(), g_loss.item()
+
+
+def supported(precision, device):
+    if precision == 'fp32':
+        return True
+    if not hasattr(torch, 'autocast'):
+        return device.type == 'cuda' and precision == 'fp16'
+    if precision == 'bf16':
+        return device.type == 'cpu' or torch.cuda.is_bf16_supported()
+    return device.type == 'cuda'
+
+
+def main(iters=10):
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f'{"precision":<10}{"img/s":>10}{"peak MiB":>10}{"d_loss":>12}{"g_loss":>12}')
+    for precision in ('fp32', 'fp16', 'bf16'):
+        if not supported(precision, device):
+            print(f'{precision:<10}  not supported on {device.type} / torch {torch.__version__}')
+            continue
+        args = example_args(['--precision', precision] + sys.argv[1:])
+        gen_net, dis_net = build_nets(args, device)
+        gen_scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
+        dis_scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
+        eeg = torch.randn(args.gen_batch_size, args.latent_dim, device=device)
+        real_imgs = torch.randn(args.gen_batch_size, 3, args.img_size, args.img_size, device=device)
+        sync = torch.cuda.synchronize if device.type == 'cuda' else (lambda: None)
+
+        step(args, gen_net, dis_net, gen_scaler, dis_scaler, eeg, real_imgs)
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+        sync()
+        start = time.time()
+        for _ in range(iters):
+            losses = step(args, gen_net, dis_net, gen_scaler, dis_scaler, eeg, real_imgs)
+        sync()
+        img_s = iters * args.gen_batch_size / (time.time() - start)
+        peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == 'cuda' else float('nan')
+        print(f'{precision:<10}{img_s:10.1f}{peak:10.0f}{losses[0]:12.4f}{losses[1]:12.4f}')
+        del gen_net, dis_net
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Memory and checkpoint size of the relative position index.
+
+Compares one `relative_position_index` buffer per attention block (the former
+layout) against the index shared through
+`models_search.ViT_helper.get_relative_position_index`.
+
+    python -m benchmarks.rel_pos_index [cfg overrides, e.g. --latent_dim 128]
+"""
+import io
+
+import torch
+
+from benchmarks import example_args, build_nets
+from models_search.ViT_helper import get_relative_position_index
+
+
+def _checkpoint_bytes(state_dict):
+    buffer = io.BytesIO()
+    torch.save(state_dict, buffer)
+    return buffer.tell()
+
+
+def measure(net, device):
+    legacy_bytes = 0
+    shared = dict()
+    legacy_state_dict = dict(net.state_dict())
+    for name, m in net.named_modules():
+        if getattr(m, 'window_size', 0) and hasattr(m, 'relative_position_bias_table'):
+            index = get_relative_position_index(m.window_size, device)
+            legacy_bytes += index.numel() * index.element_size()
+            shared[m.window_size] = index.numel() * index.element_size()
+            legacy_state_dict[name + '.relative_position_index'] = index.clone()
+    shared_bytes = sum(shared.values())
+    return {
+        'per-block index (MiB)': legacy_bytes / 2 ** 20,
+        'shared index (MiB)': shared_bytes / 2 ** 20,
+        'legacy checkpoint (MiB)': _checkpoint_bytes(legacy_state_dict) / 2 ** 20,
+        'checkpoint (MiB)': _checkpoint_bytes(net.state_dict()) / 2 ** 20,
+    }
+
+
+def main():
+    args = example_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    gen_net, dis_net = build_nets(args, device)
+    for label, net in (('generator', gen_net), ('discriminator', dis_net)):
+        print(label)
+        for key, value in measure(net, device).items():
+            print(f'  {key:<26}{value:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Bytes moved per generator forward with and without the fused window attention.
+
+The reference path is the former ViT_custom_local544444_256_rp.Generator tail:
+pixel_upsample through NCHW, window_partition, per-window blocks and
+window_reverse. The fused path is the current Generator.forward. Both run on
+the same weights, so the script also reports their max abs difference.
+
+Traffic is counted per ATen op (bytes of tensor inputs read plus outputs
+written) with a TorchDispatchMode; copy ops (clone/copy_/_unsafe_view...) are
+also reported on their own.
+
+    python -m benchmarks.window_attention [cfg overrides, e.g. --latent_dim 128]
+"""
+import collections
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from benchmarks import example_args
+from models_search import ViT_custom_local544444_256_rp as local_rp
+
+COPY_OPS = ('clone', 'copy_', '_to_copy', 'contiguous', 'index', 'cat', 'pixel_shuffle')
+
+
+def _is_view(func):
+    # views alias their input without touching memory; in-place ops alias too but write
+    schema = func._schema
+    return any(r.alias_info is not None for r in schema.returns) and not schema.name.endswith('_')
+
+
+def _nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+
+class ByteCounter(TorchDispatchMode):
+    def __init__(self):
+        super().__init__()
+        self.total = 0
+        self.copies = collections.Counter()
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        if _is_view(func):
+            return out
+        name = func.overloadpacket.__name__
+        moved = _nbytes(tree_flatten((args, kwargs))[0]) + _nbytes(tree_flatten(out)[0])
+        self.total += moved
+        if name in COPY_OPS:
+            self.copies[name] += moved
+        return out
+
+
+def reference_forward(gen, eeg):
+    """Generator.forward as it was before the fused window attention."""
+    x = gen.l1(eeg.view(-1, gen.latent_dim)).view(-1, gen.bottom_width ** 2, gen.embed_dim)
+    x = x + gen.pos_embed[0]
+    H, W = gen.bottom_width, gen.bottom_width
+    x = gen.blocks_1(x)
+    x, H, W = local_rp.bicubic_upsample(x, H, W)
+    x = gen.blocks_2(x + gen.pos_embed[1])
+    x, H, W = local_rp.bicubic_upsample(x, H, W)
+    x = gen.blocks_3(x + gen.pos_embed[2])
+    x, H, W = local_rp.pixel_upsample(x, H, W)
+    x = x + gen.pos_embed[3]
+    B, _, C = x.size()
+    x = x.view(B, H, W, C)
+    x = local_rp.window_partition(x, gen.window_size)
+    x = x.view(-1, gen.window_size * gen.window_size, C)
+    x = gen.blocks_4(x)
+    x = x.view(-1, gen.window_size, gen.window_size, C)
+    x = local_rp.window_reverse(x, gen.window_size, H, W).view(B, H, W, C).permute(0, 3, 1, 2)
+    return gen.deconv(x)
+
+
+def measure(fn):
+    with torch.no_grad(), ByteCounter() as counter:
+        out = fn()
+    return out, counter
+
+
+def main():
+    args = example_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    gen = local_rp.Generator(args=args).to(device).eval()
+    eeg = torch.randn(args.gen_batch_size, args.latent_dim, device=device)
+
+    ref, ref_counter = measure(lambda: reference_forward(gen, eeg))
+    out, counter = measure(lambda: gen(eeg, 0))
+    print(f'max abs diff: {(out - ref).abs().max().item():.3e}')
+    for label, c in (('reference', ref_counter), ('fused', counter)):
+        print(f'{label:<10} total {c.total / 2 ** 20:10.1f} MiB   copies {sum(c.copies.values()) / 2 ** 20:8.1f} MiB'
+              f'   {dict((k, round(v / 2 ** 20, 1)) for k, v in c.copies.items())}')
+
+
+if __name__ == '__main__':
+    main()
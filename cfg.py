@@ -10,7 +10,7 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--world-size', default=-1, type=int,
                     help='number of nodes for distributed training')
@@ -31,6 +31,11 @@ def parse_args():
                          'N processes per node, which has N GPUs. This is the '
                          'fastest way to use PyTorch for either single node or '
                          'multi node data parallel training')
+    parser.add_argument('--cpu_procs', default=0, type=int,
+                        help='train on CPU with N processes per node (one per socket or core group), '
+                             'synchronized with gloo; 0 trains on the GPUs')
+    parser.add_argument('--intra_op_threads', default=0, type=int,
+                        help='torch threads of each CPU process, 0 uses the cores of its core group')
     parser.add_argument(
         '--max_epoch',
         type=int,
@@ -108,6 +113,22 @@ def parse_args():
         type=int,
         default=128,
         help='dimensionality of the latent space')
+    parser.add_argument(
+        '--latent_proj',
+        type=str,
+        default='dense',
+        choices=['dense', 'lowrank', 'factorized'],
+        help='generator input projection: dense linear, low-rank U*V, or factorized temporal x channel')
+    parser.add_argument(
+        '--latent_rank',
+        type=int,
+        default=256,
+        help='inner dimension of the lowrank input projection')
+    parser.add_argument(
+        '--eeg_channels',
+        type=int,
+        default=128,
+        help='EEG channels of the flattened latent, used by the factorized input projection')
     parser.add_argument(
         '--img_size',
         type=int,
@@ -273,6 +294,10 @@ def parse_args():
                         help='Discriminator Depth')
     parser.add_argument('--g_depth', type=str, default="5,4,2",
                         help='Generator Depth')
+    parser.add_argument('--g_checkpoint', type=str, default="",
+                        help='per-stage activation checkpointing of the generator, e.g. "0,1,1,1"')
+    parser.add_argument('--d_checkpoint', type=str, default="",
+                        help='per-stage activation checkpointing of the discriminator, e.g. "1,1" (not with DDP)')
     parser.add_argument('--g_norm', type=str, default="ln",
                         help='Generator Normalization')
     parser.add_argument('--d_norm', type=str, default="ln",
@@ -285,12 +310,51 @@ def parse_args():
                         help='Discriminator Depth')
     parser.add_argument('--fid_stat', type=str, default="None",
                         help='Discriminator Depth')
+    parser.add_argument('--fid_cache', type=str, default='fid_stat',
+                        help='directory of the cached reference FID statistics (utils.fid_stats)')
+    parser.add_argument('--fid_split', type=str, default='train',
+                        help='split of the real images the FID is computed against')
+    parser.add_argument('--metrics', type=str, default='is,fid',
+                        help='comma separated metrics of every epoch, of is, fid, kid and pr (precision/recall)')
+    parser.add_argument('--feature_cache', type=str, default='fid_stat/features',
+                        help='directory of the cached Inception features of real images (utils.feature_cache)')
+    parser.add_argument('--class_metrics', action='store_true',
+                        help='test.py: IS and FID of every class of the eegdataset test split')
     parser.add_argument('--diff_aug', type=str, default="None",
                         help='differentiable augmentation type')
     parser.add_argument('--accumulated_times', type=int, default=1,
                         help='gradient accumulation')
     parser.add_argument('--g_accumulated_times', type=int, default=1,
                         help='gradient accumulation')
+    parser.add_argument('--gp_every', type=int, default=1,
+                        help='lazy regularization: apply the gradient penalty every k D optimizer steps (of '
+                             '--accumulated_times micro-batches each) with k times its weight')
+    parser.add_argument('--gp_type', type=str, default='wgangp', choices=['wgangp', 'r1'],
+                        help='penalty of the wgangp losses, on interpolates (wgangp) or on real images only (r1)')
+    parser.add_argument('--r1_gamma', type=float, default=10.,
+                        help='weight of the r1 penalty')
+    parser.add_argument('--dis_concat', action='store_true',
+                        help='run the discriminator once on the concatenated real, fake (and gradient penalty) batch')
+    parser.add_argument('--static_graph', action='store_true',
+                        help='every parameter of G and D is used in each forward, skip the unused parameter search of DDP')
+    parser.add_argument('--shared_gen_forward', action='store_true',
+                        help='reuse the generator forward of the D step in the G step of the same iteration')
+    parser.add_argument('--keep_ckpt', type=int, default=0,
+                        help='keep the last k epoch checkpoints (and the best one), 0 keeps all')
+    parser.add_argument('--ckpt_format', type=str, default='torch', choices=['torch', 'lazy'],
+                        help='epoch checkpoints as torch.save pickles, or indexed for lazy mmap loading (utils.checkpoint)')
+    parser.add_argument('--ema_archive', type=str, default='', choices=['', 'fp32', 'fp16', 'int8'],
+                        help='also archive the EMA generator of every epoch as compressed deltas of this precision')
+    parser.add_argument('--ema_keyframe_every', type=int, default=0,
+                        help='full EMA snapshot in the archive every k epochs, 0 only for the first archived epoch')
+    parser.add_argument('--archive_epoch', type=int, default=-1,
+                        help='test.py: epoch to evaluate when --load_path is an EMA archive, -1 the last one')
+    parser.add_argument('--save_samples_every', type=int, default=0,
+                        help='save every k-th batch generated for the epoch evaluation as a PNG grid, 0 saves none')
+    parser.add_argument('--sample_workers', type=int, default=4,
+                        help='threads writing the sample PNGs')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'fp16', 'bf16'],
+                        help='training precision, fp16 uses dynamic loss scaling')
     parser.add_argument('--num_landmarks', type=int, default=64,
                         help='number of landmarks')
     parser.add_argument('--d_heads', type=int, default=4,
@@ -303,6 +367,8 @@ def parse_args():
                         help='ema warm up')
     parser.add_argument('--ema_kimg', type=int, default=500,
                         help='ema thousand images')
+    parser.add_argument('--ema_every', type=int, default=1,
+                        help='update the ema of the generator every n generator steps')
     parser.add_argument('--latent_norm',action='store_true',
         help='latent vector normalization')
     parser.add_argument('--ministd',action='store_true',
@@ -322,6 +388,6 @@ def parse_args():
     parser.add_argument('--use_torch', action='store_true',
                         help='using pytorch as the matrix operations backend')
 
-    opt = parser.parse_args()
+    opt = parser.parse_args(args)
 
     return opt
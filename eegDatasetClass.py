@@ -21,8 +21,8 @@ class EEGDataset:
                          loaded['dataset'][i]['subject'] == args.subject]
         else:
             self.data = loaded['dataset']
-            self.labels = loaded["labels"]
-            self.images = loaded["images"]
+        self.labels = loaded["labels"]
+        self.images = loaded["images"]
 
         # Load split
         loadedSp = torch.load(split_path)
@@ -40,15 +40,23 @@ class EEGDataset:
 
     # Get item
     def __getitem__(self, i):
-        from PIL import Image
         # Process EEG
         eeg = self.trSet[i]["eeg"].float().t()
         eeg = eeg[args.time_low:args.time_high, :]
         # Get label
         label = self.trSet[i]["label"]
         # Get image                                         **MODIFICA2: RETURN IMMAGINE DAL DATASET IMAGENET**
-        img_idx = self.trSet[i]['image']
-        image = self.images[img_idx]
+        img = self.get_image(self.image_id(i))
+        # Return
+        return eeg, label, img
+
+    # ImageNet name of the image of sample i, its key in utils.feature_cache
+    def image_id(self, i):
+        return self.images[self.trSet[i]['image']]
+
+    # Transformed image of an ImageNet name
+    def get_image(self, image):
+        from PIL import Image
         # Get complete path
         dirName = image[:9]
         imgPath = "/projects/data/classification/ImageNet2012/train/" + dirName + "/" + image + ".JPEG"
@@ -66,5 +74,4 @@ class EEGDataset:
         #apply the transforms on the image
         if self.transform is not None:
             img = self.transform(img)
-        # Return
-        return eeg, label, img
+        return img
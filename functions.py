@@ -1,4 +1,6 @@
+import contextlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import operator
 import os
 from copy import deepcopy
@@ -13,7 +15,8 @@ from utils.utils import make_grid, save_image
 from tqdm import tqdm
 import cv2
 
-from pytorch_gan_metrics.utils import get_inception_score
+from utils.torch_inception_score import InceptionExtractor, InceptionScore
+from utils.feature_metrics import EvaluationMetrics
 
 # from utils.fid_score import calculate_fid_given_paths
 from utils.torch_fid_score import get_fid
@@ -21,6 +24,10 @@ from utils.torch_fid_score import get_fid
 from torch.utils.data import DataLoader
 
 from eegDatasetClass import EEGDataset
+from models_search.ViT_helper import any_checkpointed, no_checkpoint
+from models_search.diff_aug import independent_splits
+from torch_utils import training_stats
+from torch_utils.misc import ddp_sync
 
 from torchvision import transforms
 
@@ -56,62 +63,225 @@ def cur_stages(iter, args):
     return idx
 
 
-def compute_gradient_penalty(D, real_samples, fake_samples, phi):
-    """Calculates the gradient penalty loss for WGAN GP"""
+def setup_cpu_worker(local_rank, procs_per_node, num_threads=0):
+    """Pin CPU process `local_rank` of `procs_per_node` to its group of cores and size its torch thread pool.
+
+    The available cores are split in contiguous groups, which on most machines
+    follows the socket layout. Returns the number of intra-op threads.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        group = cores[local_rank * len(cores) // procs_per_node:(local_rank + 1) * len(cores) // procs_per_node]
+        if group:
+            os.sched_setaffinity(0, group)
+    else:
+        group = range(max(1, (os.cpu_count() or 1) // procs_per_node))
+    num_threads = num_threads or max(1, len(group))
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+WGANGP_LOSSES = ('wgangp', 'wgangp-mode', 'wgangp-eps')
+
+
+def autocast(precision, device_type='cuda'):
+    """Autocast context of --precision for the forward passes of gen_net / dis_net.
+
+    Losses and the gradient penalty are reduced outside of it, in fp32.
+    """
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    dtype = torch.bfloat16 if precision == 'bf16' else torch.float16
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type, dtype=dtype)
+    # torch < 1.10 only autocasts to fp16 on CUDA
+    assert device_type == 'cuda' and precision == 'fp16', f'{precision} autocast on {device_type} needs torch >= 1.10'
+    return torch.cuda.amp.autocast()
+
+
+def random_interpolates(real_samples, fake_samples):
+    """Random interpolation between real and fake samples, the inputs of the WGAN GP"""
     # Random weight term for interpolation between real and fake samples
-    alpha = torch.Tensor(np.random.random((real_samples.size(0), 1, 1, 1))).to(real_samples.get_device())
-    # Get random interpolation between real and fake samples
-    interpolates = (alpha * real_samples + ((1 - alpha) * fake_samples)).requires_grad_(True)
-    d_interpolates = D(interpolates)
-    fake = torch.ones([real_samples.shape[0], 1], requires_grad=False).to(real_samples.get_device())
-    # Get gradient w.r.t. interpolates
+    alpha = torch.Tensor(np.random.random((real_samples.size(0), 1, 1, 1))).to(real_samples.device)
+    return (alpha * real_samples + ((1 - alpha) * fake_samples.float())).requires_grad_(True)
+
+
+def input_gradient_norm(d_out, inputs, scaler=None):
+    """Per-sample L2 norm of the gradient of the discriminator output `d_out` w.r.t. its `inputs`
+
+    With a (fp16) GradScaler the gradient is taken of the scaled output, so small
+    values do not flush to zero, and unscaled before the norm is computed in fp32.
+    """
+    d_out = d_out.float()
+    if scaler is not None:
+        d_out = scaler.scale(d_out)
+    fake = torch.ones([inputs.shape[0], 1], requires_grad=False).to(inputs.device)
+    # Get gradient w.r.t. inputs
     gradients = torch.autograd.grad(
-        outputs=d_interpolates,
-        inputs=interpolates,
+        outputs=d_out,
+        inputs=inputs,
         grad_outputs=fake,
         create_graph=True,
         retain_graph=True,
         only_inputs=True,
     )[0]
-    gradients = gradients.reshape(gradients.size(0), -1)
-    gradient_penalty = ((gradients.norm(2, dim=1) - phi) ** 2).mean()
-    return gradient_penalty
+    if scaler is not None:
+        gradients = gradients / scaler.get_scale()
+    gradients = gradients.float().reshape(gradients.size(0), -1)
+    return gradients.norm(2, dim=1)
+
+
+def interpolates_penalty(d_interpolates, interpolates, phi, scaler=None):
+    """WGAN GP of the discriminator output `d_interpolates` w.r.t. its input `interpolates`"""
+    return ((input_gradient_norm(d_interpolates, interpolates, scaler) - phi) ** 2).mean()
+
+
+def compute_gradient_penalty(D, real_samples, fake_samples, phi, scaler=None, precision='fp32'):
+    """Calculates the gradient penalty loss for WGAN GP"""
+    interpolates = random_interpolates(real_samples, fake_samples)
+    with no_checkpoint(), autocast(precision, interpolates.device.type):
+        d_interpolates = D(interpolates)
+    return interpolates_penalty(d_interpolates, interpolates, phi, scaler)
+
+
+def compute_r1_penalty(D, real_samples, scaler=None, precision='fp32'):
+    """R1 regularization, the squared gradient norm of D on real samples"""
+    real_samples = real_samples.detach().requires_grad_(True)
+    with no_checkpoint(), autocast(precision, real_samples.device.type):
+        d_real = D(real_samples)
+    return (input_gradient_norm(d_real, real_samples, scaler) ** 2).mean()
+
+
+def dis_forward(args, dis_net, *batches):
+    """dis_net(x) of every batch, as a single pass over their concatenation with --dis_concat.
+
+    The discriminator treats the samples independently, except for batch norm
+    (d_norm bn), which is always run per batch.
+    """
+    if not args.dis_concat or args.d_norm == 'bn' or len(batches) == 1:
+        return [dis_net(x) for x in batches]
+    assert not isinstance(dis_net, nn.DataParallel), \
+        '--dis_concat needs the whole batch in one discriminator pass, it does not work with nn.DataParallel'
+    sizes = [x.size(0) for x in batches]
+    with independent_splits(sizes):
+        validity = dis_net(torch.cat([x.to(batches[0].dtype) for x in batches], dim=0))
+    return validity.split(sizes)
+
+
+def unused_parameters(net, *inputs):
+    """Names of the trainable parameters of `net` that get no gradient from net(*inputs), on a scratch copy"""
+    net = deepcopy(getattr(net, 'module', net))
+    for p in net.parameters():
+        p.grad = None
+    out = net(*inputs)
+    outs = out if isinstance(out, (list, tuple)) else [out]
+    sum(o.float().sum() for o in outs if torch.is_tensor(o)).backward()
+    return [name for name, p in net.named_parameters() if p.requires_grad and p.grad is None]
+
+
+def write_stats(collector, writer, global_steps):
+    """Writes the averages of the statistics reported since the last call to TensorBoard.
+
+    `collector.update()` is the only device sync (and all-reduce) of the
+    training metrics, every process has to call it at the same steps.
+    """
+    collector.update()
+    if writer is not None:
+        for name, value in collector.as_dict().items():
+            if value.num:
+                writer.add_scalar(name, value.mean, global_steps)
 
 
-def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optimizer, gen_avg_param, train_loader, epoch, writer_dict, schedulers=None):
+def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optimizer, gen_avg_param, train_loader, epoch, writer_dict, schedulers=None, scalers=None):
     writer = writer_dict['writer']
     gen_step = 0
+    # loss scaling of --precision fp16, disabled scalers just pass through
+    if scalers:
+        gen_scaler, dis_scaler = scalers
+    else:
+        gen_scaler = torch.cuda.amp.GradScaler(enabled=False)
+        dis_scaler = torch.cuda.amp.GradScaler(enabled=False)
     # train mode
     gen_net.train()
     dis_net.train()
 
     dis_optimizer.zero_grad()
     gen_optimizer.zero_grad()
+    # the GPU of the process, or the CPU with --cpu_procs
+    device = next(dis_net.parameters()).device
+    # losses are reported as device tensors and only read back every print_freq iterations
+    stats_collector = training_stats.Collector()
 
     # **MODIFICA3: PASSAGGIO DEEL'EEG COME PARAMETRO ALLA CLASSE gen_net (GENERATORE) E DI IMAGE ALLA CLASSE dis_net (DISRCIMINATORE), RITORNATI DALLA CLASSE EEGDataset **
     for iter_idx, (eeg, label, imgs) in enumerate(tqdm(train_loader)):
         global_steps = writer_dict['train_global_steps']
 
         # Adversarial ground truths
-        real_imgs = imgs.type(torch.cuda.FloatTensor).cuda(args.gpu, non_blocking=True)
+        real_imgs = imgs.to(device, torch.float, non_blocking=True)
+        eeg = eeg.to(device, non_blocking=True)
 
         # ---------------------
         #  Train Discriminator
         # ---------------------
-
-        real_validity = dis_net(real_imgs)
-        fake_imgs = gen_net(eeg, epoch).detach()
-        assert fake_imgs.size() == real_imgs.size(), f"fake_imgs.size(): {fake_imgs.size()} real_imgs.size(): {real_imgs.size()}"
-        fake_validity = dis_net(fake_imgs)
+        gen_step_due = global_steps % (args.n_critic * args.accumulated_times) == 0
+        # under DDP the gradients are only all-reduced on the last micro-step of an optimizer step
+        d_sync = (iter_idx + 1) % args.accumulated_times == 0
+        gen_imgs = None
+        # lazy regularization: the penalty of the wgangp losses every gp_every D optimizer steps, gp_every
+        # times heavier, on all the accumulated micro-batches of those steps (counted from the first one, the
+        # optimizer steps follow iter_idx like d_sync)
+        d_step = (global_steps - iter_idx % args.accumulated_times) // args.accumulated_times
+        apply_gp = args.loss in WGANGP_LOSSES and d_step % args.gp_every == 0
+        # without checkpointing the penalty can share the pass over real (and with --dis_concat fake) samples
+        shared_gp = apply_gp and not any_checkpointed(args.d_checkpoint)
+        if shared_gp and args.gp_type == 'r1':
+            real_imgs.requires_grad_(True)
+        interpolates = d_interpolates = None
+
+        with ddp_sync(dis_net, d_sync), autocast(args.precision, real_imgs.device.type):
+            if args.shared_gen_forward and gen_step_due:
+                # same eeg and generator weights as the G step below: keep the graph for it
+                with ddp_sync(gen_net, args.g_accumulated_times == 1):
+                    gen_imgs = gen_net(eeg, epoch)
+                fake_imgs = gen_imgs.detach()
+            else:
+                with torch.no_grad():
+                    fake_imgs = gen_net(eeg, epoch)
+            assert fake_imgs.size() == real_imgs.size(), f"fake_imgs.size(): {fake_imgs.size()} real_imgs.size(): {real_imgs.size()}"
+            if shared_gp and args.gp_type == 'wgangp' and args.dis_concat:
+                # the gradient penalty samples join the same pass, their gradient does
+                # not depend on the other samples
+                interpolates = random_interpolates(real_imgs, fake_imgs)
+                real_validity, fake_validity, d_interpolates = dis_forward(
+                    args, dis_net, real_imgs, fake_imgs, interpolates)
+            else:
+                real_validity, fake_validity = dis_forward(args, dis_net, real_imgs, fake_imgs)
+        real_validity, fake_validity = real_validity.float(), fake_validity.float()
 
         # cal loss
+        d_reg = 0
+        if apply_gp and args.gp_type == 'r1':
+            if shared_gp:
+                r1_penalty = (input_gradient_norm(real_validity, real_imgs, dis_scaler) ** 2).mean()
+            else:
+                with ddp_sync(dis_net, d_sync):
+                    r1_penalty = compute_r1_penalty(dis_net, real_imgs, dis_scaler, args.precision)
+            d_reg = r1_penalty * args.r1_gamma / 2 * args.gp_every
+        elif apply_gp:
+            if d_interpolates is not None:
+                gradient_penalty = interpolates_penalty(d_interpolates, interpolates, args.phi, dis_scaler)
+            else:
+                with ddp_sync(dis_net, d_sync):
+                    gradient_penalty = compute_gradient_penalty(dis_net, real_imgs, fake_imgs.detach(), args.phi,
+                                                                dis_scaler, args.precision)
+            d_reg = gradient_penalty * 10 / (args.phi ** 2) * args.gp_every
         if args.loss == 'hinge':
             d_loss = 0
             d_loss = torch.mean(nn.ReLU(inplace=True)(1.0 - real_validity)) + \
                      torch.mean(nn.ReLU(inplace=True)(1 + fake_validity))
         elif args.loss == 'standard':
-            real_label = torch.full((imgs.shape[0],), 1., dtype=torch.float, device=real_imgs.get_device())
-            fake_label = torch.full((imgs.shape[0],), 0., dtype=torch.float, device=real_imgs.get_device())
+            real_label = torch.full((imgs.shape[0],), 1., dtype=torch.float, device=real_imgs.device)
+            fake_label = torch.full((imgs.shape[0],), 0., dtype=torch.float, device=real_imgs.device)
             real_validity = nn.Sigmoid()(real_validity.view(-1))
             fake_validity = nn.Sigmoid()(fake_validity.view(-1))
             d_real_loss = nn.BCELoss()(real_validity, real_label)
@@ -121,59 +291,66 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
                 d_loss = 0
                 for real_validity_item, fake_validity_item in zip(real_validity, fake_validity):
                     real_label = torch.full((real_validity_item.shape[0], real_validity_item.shape[1]), 1.,
-                                            dtype=torch.float, device=real_imgs.get_device())
+                                            dtype=torch.float, device=real_imgs.device)
                     fake_label = torch.full((real_validity_item.shape[0], real_validity_item.shape[1]), 0.,
-                                            dtype=torch.float, device=real_imgs.get_device())
+                                            dtype=torch.float, device=real_imgs.device)
                     d_real_loss = nn.MSELoss()(real_validity_item, real_label)
                     d_fake_loss = nn.MSELoss()(fake_validity_item, fake_label)
                     d_loss += d_real_loss + d_fake_loss
             else:
                 real_label = torch.full((real_validity.shape[0], real_validity.shape[1]), 1., dtype=torch.float,
-                                        device=real_imgs.get_device())
+                                        device=real_imgs.device)
                 fake_label = torch.full((real_validity.shape[0], real_validity.shape[1]), 0., dtype=torch.float,
-                                        device=real_imgs.get_device())
+                                        device=real_imgs.device)
                 d_real_loss = nn.MSELoss()(real_validity, real_label)
                 d_fake_loss = nn.MSELoss()(fake_validity, fake_label)
                 d_loss = d_real_loss + d_fake_loss
         elif args.loss == 'wgangp':
-            gradient_penalty = compute_gradient_penalty(dis_net, real_imgs, fake_imgs.detach(), args.phi)
-            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + gradient_penalty * 10 / (
-                    args.phi ** 2)
+            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + d_reg
         elif args.loss == 'wgangp-mode':
-            gradient_penalty = compute_gradient_penalty(dis_net, real_imgs, fake_imgs.detach(), args.phi)
-            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + gradient_penalty * 10 / (
-                    args.phi ** 2)
+            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + d_reg
         elif args.loss == 'wgangp-eps':
-            gradient_penalty = compute_gradient_penalty(dis_net, real_imgs, fake_imgs.detach(), args.phi)
-            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + gradient_penalty * 10 / (
-                    args.phi ** 2)
+            d_loss = -torch.mean(real_validity) + torch.mean(fake_validity) + d_reg
             d_loss += (torch.mean(real_validity) ** 2) * 1e-3
         else:
             raise NotImplementedError(args.loss)
         d_loss = d_loss / float(args.accumulated_times)
-        d_loss.backward()
+        dis_scaler.scale(d_loss).backward()
 
-        if (iter_idx + 1) % args.accumulated_times == 0:
+        if d_sync:
+            dis_scaler.unscale_(dis_optimizer)
             torch.nn.utils.clip_grad_norm_(dis_net.parameters(), 5.)
-            dis_optimizer.step()
+            dis_scaler.step(dis_optimizer)
+            dis_scaler.update()
             dis_optimizer.zero_grad()
 
-            writer.add_scalar('d_loss', d_loss.item(), global_steps) if args.rank == 0 else 0
+            training_stats.report('d_loss', d_loss)
 
         # -----------------
         #  Train Generator
         # -----------------
-        if global_steps % (args.n_critic * args.accumulated_times) == 0:
+        if gen_step_due:
+            # D is frozen for the G step: its gradients there would add to the (possibly unfinished) D
+            # accumulation, which is only zeroed after the next D optimizer step. Without any D gradient
+            # there is nothing for DDP to reduce either, hence ddp_sync(dis_net, False) below.
+            dis_net.requires_grad_(False)
 
             for accumulated_idx in range(args.g_accumulated_times):
-                gen_eeg = gen_net(eeg, epoch)
-                fake_validity = dis_net(gen_eeg)
+                g_sync = accumulated_idx == args.g_accumulated_times - 1
+                with ddp_sync(gen_net, g_sync), ddp_sync(dis_net, False), \
+                        autocast(args.precision, real_imgs.device.type):
+                    if gen_imgs is not None:
+                        gen_eeg, gen_imgs = gen_imgs, None
+                    else:
+                        gen_eeg = gen_net(eeg, epoch)
+                    fake_validity = dis_net(gen_eeg)
+                gen_eeg, fake_validity = gen_eeg.float(), fake_validity.float()
 
                 # cal loss
                 loss_lz = torch.tensor(0)
                 if args.loss == "standard":
                     real_label = torch.full((args.gen_batch_size,), 1., dtype=torch.float,
-                                            device=real_imgs.get_device())
+                                            device=real_imgs.device)
                     fake_validity = nn.Sigmoid()(fake_validity.view(-1))
                     g_loss = nn.BCELoss()(fake_validity.view(-1), real_label)
                 if args.loss == "lsgan":
@@ -181,11 +358,11 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
                         g_loss = 0
                         for fake_validity_item in fake_validity:
                             real_label = torch.full((fake_validity_item.shape[0], fake_validity_item.shape[1]), 1.,
-                                                    dtype=torch.float, device=real_imgs.get_device())
+                                                    dtype=torch.float, device=real_imgs.device)
                             g_loss += nn.MSELoss()(fake_validity_item, real_label)
                     else:
                         real_label = torch.full((fake_validity.shape[0], fake_validity.shape[1]), 1., dtype=torch.float,
-                                                device=real_imgs.get_device())
+                                                device=real_imgs.device)
                         # fake_validity = nn.Sigmoid()(fake_validity.view(-1))
                         g_loss = nn.MSELoss()(fake_validity, real_label)
                 elif args.loss == 'wgangp-mode':
@@ -200,10 +377,13 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
                 else:
                     g_loss = -torch.mean(fake_validity)
                 g_loss = g_loss / float(args.g_accumulated_times)
-                g_loss.backward()                  
+                gen_scaler.scale(g_loss).backward()
+            dis_net.requires_grad_(True)
 
+            gen_scaler.unscale_(gen_optimizer)
             torch.nn.utils.clip_grad_norm_(gen_net.parameters(), 5.)
-            gen_optimizer.step()
+            gen_scaler.step(gen_optimizer)
+            gen_scaler.update()
             gen_optimizer.zero_grad()
 
             # adjust learning rate
@@ -211,8 +391,8 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
                 gen_scheduler, dis_scheduler = schedulers
                 g_lr = gen_scheduler.step(global_steps)
                 d_lr = dis_scheduler.step(global_steps)
-                writer.add_scalar('LR/g_lr', g_lr, global_steps)
-                writer.add_scalar('LR/d_lr', d_lr, global_steps)
+                training_stats.report0('LR/g_lr', g_lr)
+                training_stats.report0('LR/d_lr', d_lr)
 
             # moving average weight
             ema_nimg = args.ema_kimg * 1000
@@ -224,22 +404,20 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
                 ema_beta = args.ema
 
             # moving average weight
-            for p, avg_p in zip(gen_net.parameters(), gen_avg_param):
-                cpu_p = deepcopy(p)
-                avg_p.mul_(ema_beta).add_(1. - ema_beta, cpu_p.cpu().data)     #MODIFICA: IMPOSTAZIONE DA USARE QUANDO SI AVVIA DA 0 L'EXP
-                #avg_p.mul_(ema_beta).add_(1. - ema_beta, cpu_p.cuda().data)     #MODIFICA: IMPOSTAZIONE DA USARE QUANDO SI EFFETTUA IL RESUME
-                del cpu_p
+            gen_avg_param.update(gen_net, ema_beta)
 
-            writer.add_scalar('g_loss', g_loss.item(), global_steps) if args.rank == 0 else 0
+            training_stats.report('g_loss', g_loss)
             gen_step += 1
 
+        if iter_idx % args.print_freq == 0:
+            write_stats(stats_collector, writer, global_steps)
+
         # verbose
         if gen_step and iter_idx % args.print_freq == 0 and args.rank == 0:
-            sample_imgs = torch.cat((gen_eeg[:16], real_imgs[:16]), dim=0)
             tqdm.write(
                 "[Epoch %d/%d] [Batch %d/%d] [D loss: %f] [G loss: %f] [ema: %f] " %
-                (epoch, args.max_epoch, iter_idx % len(train_loader), len(train_loader), d_loss.item(), g_loss.item(),
-                 ema_beta))
+                (epoch, args.max_epoch, iter_idx % len(train_loader), len(train_loader), stats_collector['d_loss'],
+                 stats_collector['g_loss'], ema_beta))
             del gen_eeg
             del real_imgs
             del fake_validity
@@ -249,6 +427,8 @@ def train(args, gen_net: nn.Module, dis_net: nn.Module, gen_optimizer, dis_optim
 
         writer_dict['train_global_steps'] = global_steps + 1
 
+    write_stats(stats_collector, writer, writer_dict['train_global_steps'] - 1)
+
 
 def get_is(args, gen_net: nn.Module, train_loader, epoch):
     """
@@ -261,12 +441,14 @@ def get_is(args, gen_net: nn.Module, train_loader, epoch):
 
     # eval mode
     gen_net = gen_net.eval()
+    device = next(gen_net.parameters()).device
+    # the generated batches are scored as they come, on the device of gen_net
+    inception_score = InceptionScore(device=device)
 
     with torch.no_grad():
         #eval_iter = num_img // args.eval_batch_size
         eval_iter = args.num_eval_imgs // args.eval_batch_size
         print("Eval Iter", eval_iter)
-        img_list = list()
         dataloader_iterator = iter(train_loader)
         for _ in tqdm(range(eval_iter)):
             #z = torch.cuda.FloatTensor(np.random.normal(0, 1, (args.eval_batch_size, args.latent_dim)))
@@ -281,11 +463,11 @@ def get_is(args, gen_net: nn.Module, train_loader, epoch):
                 dataloader_iterator = iter(train_loader)
                 eeg, label, img = next(dataloader_iterator)
 
-            gen_imgs = gen_net(eeg, epoch)
-            img_list.extend(list(gen_imgs))
+            gen_imgs = gen_net(eeg.to(device), epoch)
+            inception_score.update(gen_imgs)
         
         # get inception score
-        IS, IS_std = get_inception_score(img_list)
+        IS, IS_std = inception_score.score()
     
     """
     with torch.no_grad():
@@ -339,22 +521,25 @@ def validate(args, fixed_z, fid_stat, epoch, gen_net: nn.Module, writer_dict, cl
         os.makedirs(fid_buffer_dir, exist_ok=True) if args.gpu == 0 else 0
 
     eval_iter = args.num_eval_imgs // args.eval_batch_size
-    img_list = list()
+    # only rank 0 scores, batch by batch on the device of gen_net
+    inception_score = InceptionScore(device=fixed_z.device) if args.rank == 0 else None
     for iter_idx in tqdm(range(eval_iter), desc='sample images'):
     #   z = torch.cuda.FloatTensor(np.random.normal(0, 1, (args.eval_batch_size, args.latent_dim)))
 
-        # Generate a batch of images
-        gen_imgs = gen_net(fixed_z, epoch).mul_(127.5).add_(127.5).clamp_(0.0, 255.0).permute(0, 2, 3, 1).to('cpu', torch.uint8).numpy()
+        # Generate a batch of images, on every rank as a DDP gen_net may sync its buffers
+        with torch.no_grad():
+            gen_imgs = gen_net(fixed_z, epoch)
+        if inception_score is not None:
+            inception_score.update(gen_imgs)
     #   gen_imgs = gen_net(z, epoch).mul_(127.5).add_(127.5).clamp_(0.0, 255.0).permute(0, 2, 3, 1).to('cpu', torch.uint8).numpy()
     #   for img_idx, img in enumerate(gen_imgs):
     #       file_name = os.path.join(fid_buffer_dir, f'iter{iter_idx}_b{img_idx}.png')
     #       imsave(file_name, img)
-        img_list.extend(list(gen_imgs))
 
     #     get inception score
     logger.info('=> calculate inception score') if args.rank == 0 else 0
     if args.rank == 0:
-        mean, std = get_inception_score(img_list)
+        mean, std = inception_score.score()
     else:
         mean, std = 0, 0
     print(f"Inception score: {mean}") if args.rank == 0 else 0
@@ -384,15 +569,40 @@ def validate(args, fixed_z, fid_stat, epoch, gen_net: nn.Module, writer_dict, cl
 
     return mean, -9999
 
-def save_samples(args, train_loader, fid_stat, epoch, gen_net: nn.Module, lstm: nn.Module, writer_dict, clean_dir=True):
-    # eval mode
+def generate_and_score(args, gen_net: nn.Module, loader, epoch, sample_dir=None, fid_ref=None, real_features=None):
+    """Metrics of `args.metrics` for the generator on the eeg of `loader`, streamed from gen_net into Inception.
+
+    All metrics come from one Inception pass (utils.feature_metrics). The FID
+    is computed against the reference (mu, sigma) `fid_ref`, KID and
+    precision/recall against the features of distinct real images
+    `real_features`; a metric without its reference is skipped. With
+    `sample_dir`, every `args.save_samples_every`-th batch is also saved as a
+    PNG grid by a thread pool. Under DDP the statistics of all ranks are
+    combined, so each rank only generates its share of the loader.
+    Returns the dict of EvaluationMetrics.results.
+    """
     gen_net.eval()
-    with torch.no_grad():
-        os.makedirs(f"./training_output_lstm/outputEpoch{epoch}", exist_ok=True)
-        for i, (eeg, label, imgs) in enumerate(train_loader):
-            sample_img = gen_net(eeg, epoch)
-            save_image(sample_img, f'./training_output/outputEpoch{epoch}/sampled_image_{i}_{epoch}.png', nrow=10, normalize=True, scale_each=True)
-    return 0
+    device = next(gen_net.parameters()).device
+    metrics = EvaluationMetrics(InceptionExtractor(device=device), args.metrics.split(','), fid_ref, real_features)
+    save_every = args.save_samples_every if sample_dir else 0
+    if save_every:
+        os.makedirs(sample_dir, exist_ok=True)
+    saved = []
+    with ThreadPoolExecutor(max(1, args.sample_workers)) as pool, torch.no_grad():
+        for i, (eeg, label, imgs) in enumerate(tqdm(loader, desc='generate and score')):
+            gen_imgs = gen_net(eeg.to(device, non_blocking=True), epoch)
+            metrics.update(gen_imgs)
+            if save_every and i % save_every == 0:
+                saved.append(pool.submit(save_image, gen_imgs.float().cpu(),
+                                         os.path.join(sample_dir, f'sampled_image_{i}_{epoch}.png'),
+                                         nrow=10, normalize=True, scale_each=True))
+        # re-raises the first failed write (disk full, bad path, ...)
+        for future in saved:
+            future.result()
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        metrics.all_reduce()
+    return metrics.results()
+
 
 def get_topk_arch_hidden(args, controller, gen_net, prev_archs, prev_hiddens):
     """
@@ -477,3 +687,62 @@ def copy_params(model, mode='cpu'):
     else:
         flatten = deepcopy(list(p.data for p in model.parameters()))
     return flatten
+
+
+class GeneratorEMA(object):
+    """Shadow generator holding the exponential moving average of the generator weights.
+
+    `module` is a second instance of the generator, on the training device,
+    that is sampled and saved directly. Its parameters are views of one flat
+    buffer and an update is a single multi-tensor lerp. With `every` > 1 only
+    every `every`-th update is applied, with beta ** every.
+    """
+    def __init__(self, gen_net, every=1):
+        gen_net = getattr(gen_net, 'module', gen_net)  # DistributedDataParallel / DataParallel
+        self.module = deepcopy(gen_net).eval().requires_grad_(False)
+        self.params = list(self.module.parameters())
+        self.flat = torch.cat([p.detach().reshape(-1) for p in self.params])
+        for p, flat_p in zip(self.params, self._unflatten(self.flat)):
+            p.data = flat_p
+        self.every = every
+        self.num_updates = 0
+
+    def __iter__(self):
+        return iter(self.params)
+
+    def __len__(self):
+        return len(self.params)
+
+    @torch.no_grad()
+    def update(self, gen_net, beta):
+        self.num_updates += 1
+        if self.num_updates % self.every:
+            return
+        beta = beta ** self.every
+        params = [p.detach() for p in gen_net.parameters()]
+        if hasattr(torch, '_foreach_lerp_'):
+            torch._foreach_lerp_(self.params, params, 1. - beta)
+        elif hasattr(torch, '_foreach_mul_'):
+            torch._foreach_mul_(self.params, beta)
+            torch._foreach_add_(self.params, params, alpha=1. - beta)
+        else:
+            for avg_p, p in zip(self.params, params):
+                avg_p.mul_(beta).add_(p, alpha=1. - beta)
+        for avg_b, b in zip(self.module.buffers(), gen_net.buffers()):
+            avg_b.copy_(b)
+
+    def state_dict(self):
+        return self.module.state_dict()
+
+    @torch.no_grad()
+    def load_state_dict(self, state_dict):
+        """Loads a generator state_dict, or the list of averaged parameters of older checkpoints."""
+        if isinstance(state_dict, dict):
+            self.module.load_state_dict(state_dict)
+        else:
+            for avg_p, p in zip(self.params, state_dict):
+                avg_p.copy_(p)
+
+    def _unflatten(self, flat):
+        numels = [p.numel() for p in self.params]
+        return [t.view_as(p) for t, p in zip(flat.split(numels), self.params)]
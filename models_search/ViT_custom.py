@@ -4,7 +4,7 @@ import math
 import numpy as np
 
 
-from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_
+from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_, latent_projection, checkpoint_stages, run_blocks
 from models_search.diff_aug import DiffAugment
 
 class matmul(nn.Module):
@@ -144,6 +144,7 @@ class StageBlock(nn.Module):
     def __init__(self, depth, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm):
         super().__init__()
         self.depth = depth
+        self.use_checkpoint = False
         self.block = nn.ModuleList([
                         Block(
                         dim=dim, 
@@ -159,9 +160,7 @@ class StageBlock(nn.Module):
                         ) for i in range(depth)])
 
     def forward(self, x):
-        for blk in self.block:
-            x = blk(x)
-        return x
+        return run_blocks(self.block, x, self.use_checkpoint)
 
 def pixel_upsample(x, H, W):
     B, N, C = x.size()
@@ -188,7 +187,7 @@ class Generator(nn.Module):
         depth = [int(i) for i in args.g_depth.split(",")]
         act_layer = args.g_act
         
-        self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
+        self.l1 = latent_projection(args, self.bottom_width ** 2, self.embed_dim)
         self.pos_embed_1 = nn.Parameter(torch.zeros(1, self.bottom_width**2, embed_dim))
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
@@ -239,6 +238,9 @@ class Generator(nn.Module):
                         norm_layer=norm_layer
                         )
                     ])
+        stages = [self.blocks, *self.upsample_blocks]
+        for stage, use_checkpoint in zip(stages, checkpoint_stages(args.g_checkpoint, len(stages))):
+            stage.use_checkpoint = use_checkpoint
         for i in range(len(self.pos_embed)):
             trunc_normal_(self.pos_embed[i], std=.02)
 
@@ -269,7 +271,7 @@ class Generator(nn.Module):
     def set_arch(self, x, cur_stage):
         pass
 
-        def forward(self, eeg, epoch):
+    def forward(self, eeg, epoch):
         if self.args.latent_norm:
             latent_size = eeg.size(-1)
             eeg = (eeg/eeg.norm(dim=-1, keepdim=True) * (latent_size ** 0.5))
@@ -360,6 +362,7 @@ class Discriminator(nn.Module):
             for i in range(depth)])
         
         self.norm = CustomNorm(norm_layer, embed_dim)
+        self.use_checkpoint = checkpoint_stages(args.d_checkpoint, 1)
         self.head = nn.Linear(embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
         trunc_normal_(self.pos_embed, std=.02)
@@ -390,8 +393,7 @@ class Discriminator(nn.Module):
         x = torch.cat((cls_tokens, x), dim=1)
         x = x + self.pos_embed
         x = self.pos_drop(x)
-        for blk in self.blocks:
-            x = blk(x)
+        x = run_blocks(self.blocks, x, self.use_checkpoint[0])
 
         x = self.norm(x)
         return x[:,0]
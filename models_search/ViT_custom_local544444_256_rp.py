@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import math
 import numpy as np
-from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_
+from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_, RelativePosition, latent_projection, checkpoint_stages, run_blocks
 from models_search.diff_aug import DiffAugment
 import torch.utils.checkpoint as checkpoint
 
@@ -63,7 +63,7 @@ class Mlp(nn.Module):
     
     
     
-class Attention(nn.Module):
+class Attention(RelativePosition, nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., window_size=16):
         super().__init__()
         self.num_heads = num_heads
@@ -80,30 +80,23 @@ class Attention(nn.Module):
         self.relative_position_bias_table = nn.Parameter(
             torch.zeros((2 * window_size - 1) * (2 * window_size - 1), num_heads))  # 2*Wh-1 * 2*Ww-1, nH
 
-        # get pair-wise relative position index for each token inside the window
-        coords_h = torch.arange(window_size)
-        coords_w = torch.arange(window_size)
-        coords = torch.stack(torch.meshgrid([coords_h, coords_w]))  # 2, Wh, Ww
-        coords_flatten = torch.flatten(coords, 1)  # 2, Wh*Ww
-        relative_coords = coords_flatten[:, :, None] - coords_flatten[:, None, :]  # 2, Wh*Ww, Wh*Ww
-        relative_coords = relative_coords.permute(1, 2, 0).contiguous()  # Wh*Ww, Wh*Ww, 2
-        relative_coords[:, :, 0] += window_size - 1  # shift to start from 0
-        relative_coords[:, :, 1] += window_size - 1
-        relative_coords[:, :, 0] *= 2 * window_size - 1
-        relative_position_index = relative_coords.sum(-1)  # Wh*Ww, Wh*Ww
-        self.register_buffer("relative_position_index", relative_position_index)
 
         trunc_normal_(self.relative_position_bias_table, std=.02)
         
-    def forward(self, x):
+    def forward(self, x, H=None, W=None):
+        """
+        Args:
+            x: (B, N, C) tokens of one window, or, when H and W are given, of a
+                whole (B, H, W, C) row-major feature map that is split into
+                window_size x window_size windows on the fly.
+        """
         B, N, C = x.shape
+        if H is not None and N != self.window_size * self.window_size:
+            return self.forward_windows(x, H, W)
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
         attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size * self.window_size, self.window_size * self.window_size, -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+        attn = attn + self.relative_position_bias().unsqueeze(0)
         
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -111,6 +104,26 @@ class Attention(nn.Module):
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
+
+    def forward_windows(self, x, H, W):
+        # window partition is folded into the head split of qkv and window reverse
+        # into the head merge, so no (num_windows*B, ws, ws, C) copy is materialized
+        B, N, C = x.shape
+        ws = self.window_size
+        nH, nW = H // ws, W // ws
+        qkv = self.qkv(x).view(B, nH, ws, nW, ws, 3, self.num_heads, C // self.num_heads)
+        qkv = qkv.permute(5, 0, 1, 3, 6, 2, 4, 7).reshape(3, B * nH * nW, self.num_heads, ws * ws, C // self.num_heads)
+        q, k, v = qkv[0], qkv[1], qkv[2]
+        attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
+        attn = attn + self.relative_position_bias().unsqueeze(0)
+
+        attn = attn.softmax(dim=-1)
+        attn = self.attn_drop(attn)
+        x = self.mat(attn, v).view(B, nH, nW, self.num_heads, ws, ws, C // self.num_heads)
+        x = x.permute(0, 1, 4, 2, 5, 3, 6).reshape(B, N, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
     
     
     
@@ -148,8 +161,8 @@ class Block(nn.Module):
         self.norm2 = CustomNorm(norm_layer, dim)
         mlp_hidden_dim = int(dim * mlp_ratio)
         self.mlp = Mlp(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, drop=drop)
-    def forward(self, x):
-        x = x + self.drop_path(self.attn(self.norm1(x)))
+    def forward(self, x, H=None, W=None):
+        x = x + self.drop_path(self.attn(self.norm1(x), H, W))
         x = x + self.drop_path(self.mlp(self.norm2(x)))
         return x
     
@@ -157,6 +170,7 @@ class StageBlock(nn.Module):
     def __init__(self, depth, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, window_size=16):
         super().__init__()
         self.depth = depth
+        self.use_checkpoint = False
         models = [Block(
                         dim=dim, 
                         num_heads=num_heads, 
@@ -171,13 +185,8 @@ class StageBlock(nn.Module):
                         window_size=window_size
                         ) for i in range(depth)]
         self.block = nn.Sequential(*models)
-    def forward(self, x):
-#         for blk in self.block:
-#             # x = blk(x)
-#             checkpoint.checkpoint(blk, x)
-#         x = checkpoint.checkpoint(self.block, x)
-        x = self.block(x)
-        return x
+    def forward(self, x, H=None, W=None):
+        return run_blocks(self.block, x, self.use_checkpoint, H, W)
 def pixel_upsample(x, H, W):
     B, N, C = x.size()
     assert N == H*W
@@ -200,6 +209,16 @@ def bicubic_upsample(x, H, W):
     x = x.permute(0,2,1)
     return x, H, W
 
+def pixel_upsample_tokens(x, H, W):
+    """Same as pixel_upsample, but shuffles the (B, H*W, C) tokens directly into
+    the row-major (B, 2H*2W, C//4) layout instead of round-tripping through NCHW."""
+    B, N, C = x.size()
+    assert N == H*W
+    x = x.reshape(B, H, W, C // 4, 2, 2).permute(0, 1, 4, 2, 5, 3)
+    H, W = H * 2, W * 2
+    x = x.reshape(B, H*W, C // 4)
+    return x, H, W
+
 def window_partition(x, window_size):
     """
     Args:
@@ -244,7 +263,7 @@ class Generator(nn.Module):
         self.l2_size = 0
         
         if self.l2_size == 0:
-            self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
+            self.l1 = latent_projection(args, self.bottom_width ** 2, self.embed_dim)
         elif self.l2_size > 1000:
             self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.l2_size//16)
             self.l2 = nn.Sequential(
@@ -355,6 +374,9 @@ class Generator(nn.Module):
         #                window_size=self.window_size
         #                )
                                         
+        stages = [self.blocks_1, self.blocks_2, self.blocks_3, self.blocks_4]
+        for stage, use_checkpoint in zip(stages, checkpoint_stages(args.g_checkpoint, len(stages))):
+            stage.use_checkpoint = use_checkpoint
         for i in range(len(self.pos_embed)):
             trunc_normal_(self.pos_embed[i], std=.02)
         self.deconv = nn.Sequential(
@@ -411,15 +433,11 @@ class Generator(nn.Module):
         B, _, C = x.size()
         x = self.blocks_3(x)
         
-        x, H, W = pixel_upsample(x, H, W)
+        x, H, W = pixel_upsample_tokens(x, H, W)
         x = x + self.pos_embed[3]
         B, _, C = x.size()
-        x = x.view(B, H, W, C)
-        x = window_partition(x, self.window_size)
-        x = x.view(-1, self.window_size*self.window_size, C)
-        x = self.blocks_4(x)
-        x = x.view(-1, self.window_size, self.window_size, C)
-        x = window_reverse(x, self.window_size, H, W).view(B,H,W,C).permute(0,3,1,2)
+        x = self.blocks_4(x, H, W)
+        x = x.permute(0, 2, 1).reshape(B, C, H, W)
 
         #MODIFICATO: ABBIAMO COMMENTATO PER self.blocks_5 e self.blocks_6
         """    
@@ -534,6 +552,7 @@ class Discriminator(nn.Module):
             )
         
         self.norm = CustomNorm(norm_layer, embed_dim)
+        self.use_checkpoint = checkpoint_stages(args.d_checkpoint, 4)
         self.head = nn.Linear(embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
         trunc_normal_(self.pos_embed_1, std=.02)
@@ -570,8 +589,7 @@ class Discriminator(nn.Module):
         x = x.view(B, H, W, C)
         x = window_partition(x, self.window_size)
         x = x.view(-1, self.window_size*self.window_size, C)
-        for blk in self.blocks_1:
-            x = blk(x)
+        x = run_blocks(self.blocks_1, x, self.use_checkpoint[0])
         x = x.view(-1, self.window_size, self.window_size, C)
         x = window_reverse(x, self.window_size, H, W).view(B,H*W,C)
             
@@ -584,8 +602,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_2], dim=-1)
         x = x + self.pos_embed_2
         
-        for blk in self.blocks_2:
-            x = blk(x)
+        x = run_blocks(self.blocks_2, x, self.use_checkpoint[1])
         
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
@@ -596,8 +613,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_3], dim=-1)
         x = x + self.pos_embed_3
         
-        for blk in self.blocks_3:
-            x = blk(x)
+        x = run_blocks(self.blocks_3, x, self.use_checkpoint[2])
             
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
@@ -608,8 +624,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_4], dim=-1)
         x = x + self.pos_embed_4
         
-        for blk in self.blocks_4:
-            x = blk(x)
+        x = run_blocks(self.blocks_4, x, self.use_checkpoint[3])
             
         cls_tokens = self.cls_token.expand(B, -1, -1)
         x = torch.cat((cls_tokens, x), dim=1)
@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import math
 import numpy as np
-from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_
+from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_, RelativePosition, latent_projection, checkpoint_stages, run_blocks
 from models_search.diff_aug import DiffAugment
 import torch.utils.checkpoint as checkpoint
 
@@ -67,7 +67,7 @@ class Mlp(nn.Module):
     
     
     
-class Attention(nn.Module):
+class Attention(RelativePosition, nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., window_size=16):
         super().__init__()
         self.num_heads = num_heads
@@ -84,18 +84,6 @@ class Attention(nn.Module):
         self.relative_position_bias_table = nn.Parameter(
             torch.zeros((2 * window_size - 1) * (2 * window_size - 1), num_heads))  # 2*Wh-1 * 2*Ww-1, nH
 
-        # get pair-wise relative position index for each token inside the window
-        coords_h = torch.arange(window_size)
-        coords_w = torch.arange(window_size)
-        coords = torch.stack(torch.meshgrid([coords_h, coords_w]))  # 2, Wh, Ww
-        coords_flatten = torch.flatten(coords, 1)  # 2, Wh*Ww
-        relative_coords = coords_flatten[:, :, None] - coords_flatten[:, None, :]  # 2, Wh*Ww, Wh*Ww
-        relative_coords = relative_coords.permute(1, 2, 0).contiguous()  # Wh*Ww, Wh*Ww, 2
-        relative_coords[:, :, 0] += window_size - 1  # shift to start from 0
-        relative_coords[:, :, 1] += window_size - 1
-        relative_coords[:, :, 0] *= 2 * window_size - 1
-        relative_position_index = relative_coords.sum(-1)  # Wh*Ww, Wh*Ww
-        self.register_buffer("relative_position_index", relative_position_index)
         
         self.noise_strength_1 = torch.nn.Parameter(torch.zeros([]))
 
@@ -107,10 +95,7 @@ class Attention(nn.Module):
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
         attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size * self.window_size, self.window_size * self.window_size, -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+        attn = attn + self.relative_position_bias().unsqueeze(0)
         
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -164,6 +149,7 @@ class StageBlock(nn.Module):
     def __init__(self, depth, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, window_size=16):
         super().__init__()
         self.depth = depth
+        self.use_checkpoint = False
         models = [Block(
                         dim=dim, 
                         num_heads=num_heads, 
@@ -179,12 +165,7 @@ class StageBlock(nn.Module):
                         ) for i in range(depth)]
         self.block = nn.Sequential(*models)
     def forward(self, x):
-#         for blk in self.block:
-#             # x = blk(x)
-#             checkpoint.checkpoint(blk, x)
-#         x = checkpoint.checkpoint(self.block, x)
-        x = self.block(x)
-        return x
+        return run_blocks(self.block, x, self.use_checkpoint)
 def pixel_upsample(x, H, W):
     B, N, C = x.size()
     assert N == H*W
@@ -250,7 +231,7 @@ class Generator(nn.Module):
         self.l2_size = 0
         
         if self.l2_size == 0:
-            self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
+            self.l1 = latent_projection(args, self.bottom_width ** 2, self.embed_dim)
         elif self.l2_size > 1000:
             self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.l2_size//16)
             self.l2 = nn.Sequential(
@@ -361,6 +342,9 @@ class Generator(nn.Module):
                         window_size=self.window_size
                         )
                                         
+        stages = [self.blocks_1, self.blocks_2, self.blocks_3, self.blocks_4, self.blocks_5, self.blocks_6]
+        for stage, use_checkpoint in zip(stages, checkpoint_stages(args.g_checkpoint, len(stages))):
+            stage.use_checkpoint = use_checkpoint
         for i in range(len(self.pos_embed)):
             trunc_normal_(self.pos_embed[i], std=.02)
         self.deconv = nn.Sequential(
@@ -539,6 +523,7 @@ class Discriminator(nn.Module):
             )
         
         self.norm = CustomNorm(norm_layer, embed_dim)
+        self.use_checkpoint = checkpoint_stages(args.d_checkpoint, 4)
         self.head = nn.Linear(embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
         trunc_normal_(self.pos_embed_1, std=.02)
@@ -575,8 +560,7 @@ class Discriminator(nn.Module):
         x = x.view(B, H, W, C)
         x = window_partition(x, self.window_size)
         x = x.view(-1, self.window_size*self.window_size, C)
-        for blk in self.blocks_1:
-            x = blk(x)
+        x = run_blocks(self.blocks_1, x, self.use_checkpoint[0])
         x = x.view(-1, self.window_size, self.window_size, C)
         x = window_reverse(x, self.window_size, H, W).view(B,H*W,C)
             
@@ -589,8 +573,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_2], dim=-1)
         x = x + self.pos_embed_2
         
-        for blk in self.blocks_2:
-            x = blk(x)
+        x = run_blocks(self.blocks_2, x, self.use_checkpoint[1])
         
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
@@ -601,8 +584,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_3], dim=-1)
         x = x + self.pos_embed_3
         
-        for blk in self.blocks_3:
-            x = blk(x)
+        x = run_blocks(self.blocks_3, x, self.use_checkpoint[2])
             
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
@@ -613,8 +595,7 @@ class Discriminator(nn.Module):
         x = torch.cat([x, x_4], dim=-1)
         x = x + self.pos_embed_4
         
-        for blk in self.blocks_4:
-            x = blk(x)
+        x = run_blocks(self.blocks_4, x, self.use_checkpoint[3])
             
         cls_tokens = self.cls_token.expand(B, -1, -1)
         x = torch.cat((cls_tokens, x), dim=1)
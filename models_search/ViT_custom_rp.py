@@ -4,7 +4,7 @@ import math
 import numpy as np
 
 
-from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_
+from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_, RelativePosition, latent_projection, checkpoint_stages, run_blocks
 from models_search.diff_aug import DiffAugment
 
 class matmul(nn.Module):
@@ -68,7 +68,7 @@ class Mlp(nn.Module):
         return x
 
 
-class Attention(nn.Module):
+class Attention(RelativePosition, nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., window_size=16):
         super().__init__()
         self.num_heads = num_heads
@@ -85,18 +85,6 @@ class Attention(nn.Module):
             self.relative_position_bias_table = nn.Parameter(
                 torch.zeros((2 * window_size - 1) * (2 * window_size - 1), num_heads))  # 2*Wh-1 * 2*Ww-1, nH
 
-            # get pair-wise relative position index for each token inside the window
-            coords_h = torch.arange(window_size)
-            coords_w = torch.arange(window_size)
-            coords = torch.stack(torch.meshgrid([coords_h, coords_w]))  # 2, Wh, Ww
-            coords_flatten = torch.flatten(coords, 1)  # 2, Wh*Ww
-            relative_coords = coords_flatten[:, :, None] - coords_flatten[:, None, :]  # 2, Wh*Ww, Wh*Ww
-            relative_coords = relative_coords.permute(1, 2, 0).contiguous()  # Wh*Ww, Wh*Ww, 2
-            relative_coords[:, :, 0] += window_size - 1  # shift to start from 0
-            relative_coords[:, :, 1] += window_size - 1
-            relative_coords[:, :, 0] *= 2 * window_size - 1
-            relative_position_index = relative_coords.sum(-1)  # Wh*Ww, Wh*Ww
-            self.register_buffer("relative_position_index", relative_position_index)
 
             trunc_normal_(self.relative_position_bias_table, std=.02)
         
@@ -106,10 +94,7 @@ class Attention(nn.Module):
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
         attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
         if self.window_size != 0:
-            relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1).clone()].view(
-                self.window_size * self.window_size, self.window_size * self.window_size, -1)  # Wh*Ww,Wh*Ww,nH
-            relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-            attn = attn + relative_position_bias.unsqueeze(0)
+            attn = attn + self.relative_position_bias().unsqueeze(0)
         
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -164,6 +149,7 @@ class StageBlock(nn.Module):
     def __init__(self, depth, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, window_size=8):
         super().__init__()
         self.depth = depth
+        self.use_checkpoint = False
         self.block = nn.ModuleList([
                         Block(
                         dim=dim, 
@@ -180,9 +166,7 @@ class StageBlock(nn.Module):
                         ) for i in range(depth)])
 
     def forward(self, x):
-        for blk in self.block:
-            x = blk(x)
-        return x
+        return run_blocks(self.block, x, self.use_checkpoint)
 
 def pixel_upsample(x, H, W):
     B, N, C = x.size()
@@ -209,7 +193,7 @@ class Generator(nn.Module):
         depth = [int(i) for i in args.g_depth.split(",")]
         act_layer = args.g_act
         
-        self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
+        self.l1 = latent_projection(args, self.bottom_width ** 2, self.embed_dim)
         self.pos_embed_1 = nn.Parameter(torch.zeros(1, self.bottom_width**2, embed_dim))
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
@@ -263,6 +247,9 @@ class Generator(nn.Module):
                         window_size=args.bottom_width*4,
                         )
                     ])
+        stages = [self.blocks, *self.upsample_blocks]
+        for stage, use_checkpoint in zip(stages, checkpoint_stages(args.g_checkpoint, len(stages))):
+            stage.use_checkpoint = use_checkpoint
         for i in range(len(self.pos_embed)):
             trunc_normal_(self.pos_embed[i], std=.02)
 
@@ -384,6 +371,7 @@ class Discriminator(nn.Module):
             for i in range(depth)])
         
         self.norm = CustomNorm(norm_layer, embed_dim)
+        self.use_checkpoint = checkpoint_stages(args.d_checkpoint, 1)
         self.head = nn.Linear(embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
         trunc_normal_(self.pos_embed, std=.02)
@@ -414,8 +402,7 @@ class Discriminator(nn.Module):
         x = torch.cat((cls_tokens, x), dim=1)
         x = x + self.pos_embed
         x = self.pos_drop(x)
-        for blk in self.blocks:
-            x = blk(x)
+        x = run_blocks(self.blocks, x, self.use_checkpoint[0])
 
         x = self.norm(x)
         return x[:,0]
@@ -1,4 +1,7 @@
+import contextlib
+
 import torch
+import torch.utils.checkpoint as checkpoint
 from torch import nn
 
 def drop_path(x, drop_prob: float = 0., training: bool = False):
@@ -109,3 +112,170 @@ def trunc_normal_(tensor, mean=0., std=1., a=-2., b=2.):
         >>> nn.init.trunc_normal_(w)
     """
     return _no_grad_trunc_normal_(tensor, mean, std, a, b)
+
+
+_relative_position_index_cache = dict()
+
+def get_relative_position_index(window_size, device):
+    """Pair-wise relative position index (Wh*Ww, Wh*Ww) of the tokens inside a window.
+
+    The index only depends on the window size, so a single copy per
+    (window_size, device) is built lazily and shared by every attention block,
+    instead of each block registering (and checkpointing) its own buffer.
+    """
+    key = (window_size, torch.device(device))
+    index = _relative_position_index_cache.get(key, None)
+    if index is None:
+        coords_h = torch.arange(window_size)
+        coords_w = torch.arange(window_size)
+        coords = torch.stack(torch.meshgrid([coords_h, coords_w]))  # 2, Wh, Ww
+        coords_flatten = torch.flatten(coords, 1)  # 2, Wh*Ww
+        relative_coords = coords_flatten[:, :, None] - coords_flatten[:, None, :]  # 2, Wh*Ww, Wh*Ww
+        relative_coords = relative_coords.permute(1, 2, 0).contiguous()  # Wh*Ww, Wh*Ww, 2
+        relative_coords[:, :, 0] += window_size - 1  # shift to start from 0
+        relative_coords[:, :, 1] += window_size - 1
+        relative_coords[:, :, 0] *= 2 * window_size - 1
+        index = relative_coords.sum(-1).to(key[1])  # Wh*Ww, Wh*Ww
+        _relative_position_index_cache[key] = index
+    return index
+
+
+class RelativePosition(object):
+    """Mixin for attention modules owning a `relative_position_bias_table`.
+
+    `relative_position_index` resolves to the shared index of
+    `get_relative_position_index` on the device of the bias table; it is not a
+    buffer, so it is neither moved by `.to()` nor saved in the `state_dict`.
+
+    `relative_position_bias()` gathers the (nH, Wh*Ww, Wh*Ww) bias from the
+    table. Outside of training it is materialized once and reused until the
+    table changes: optimizer steps and `load_state_dict` update the table in
+    place, which bumps its version counter and invalidates the cache.
+    """
+    @property
+    def relative_position_index(self):
+        return get_relative_position_index(self.window_size, self.relative_position_bias_table.device)
+
+    def _gather_relative_position_bias(self):
+        N = self.window_size * self.window_size
+        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            N, N, -1)  # Wh*Ww,Wh*Ww,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+    def relative_position_bias(self):
+        table = self.relative_position_bias_table
+        if self.training or (torch.is_grad_enabled() and table.requires_grad):
+            self._bias_cache = None
+            return self._gather_relative_position_bias()
+        key = (table._version, table.data_ptr(), table.dtype)
+        cache = getattr(self, '_bias_cache', None)
+        if cache is None or cache[0] != key:
+            with torch.no_grad():
+                cache = (key, self._gather_relative_position_bias())
+            self._bias_cache = cache
+        return cache[1]
+
+    def train(self, mode=True):
+        self._bias_cache = None
+        return super().train(mode)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints written before the index was shared still carry it as a buffer
+        state_dict.pop(prefix + 'relative_position_index', None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
+class LowRankLinear(nn.Module):
+    """nn.Linear(in_features, out_features) factorized as U @ V with inner dimension `rank`."""
+    def __init__(self, in_features, out_features, rank):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.v = nn.Linear(in_features, rank, bias=False)
+        self.u = nn.Linear(rank, out_features)
+
+    def forward(self, x):
+        return self.u(self.v(x.reshape(-1, self.in_features)))
+
+
+class FactorizedLatentProjection(nn.Module):
+    """Separable temporal x channel projection of a flattened (B, T*C) EEG.
+
+    The T time steps are mixed into `num_tokens` tokens and the C electrodes
+    into `dim` features, W_t @ X @ W_c, which is exactly the (B, num_tokens, dim)
+    token layout the generators reshape the output of `l1` into.
+    """
+    def __init__(self, time_steps, channels, num_tokens, dim):
+        super().__init__()
+        self.time_steps = time_steps
+        self.channels = channels
+        self.time = nn.Linear(time_steps, num_tokens, bias=False)
+        self.channel = nn.Linear(channels, dim)
+
+    def forward(self, x):
+        x = x.reshape(-1, self.time_steps, self.channels)
+        x = self.time(x.transpose(1, 2))  # B, C, num_tokens
+        x = self.channel(x.transpose(1, 2))  # B, num_tokens, dim
+        return x.flatten(1)
+
+
+def latent_projection(args, num_tokens, dim):
+    """Input projection `l1` of the generators, latent_dim -> num_tokens*dim, per `args.latent_proj`."""
+    latent_proj = getattr(args, 'latent_proj', 'dense')
+    if latent_proj == 'dense':
+        return nn.Linear(args.latent_dim, num_tokens * dim)
+    elif latent_proj == 'lowrank':
+        return LowRankLinear(args.latent_dim, num_tokens * dim, args.latent_rank)
+    elif latent_proj == 'factorized':
+        assert args.latent_dim % args.eeg_channels == 0, \
+            f'latent_dim {args.latent_dim} is not a multiple of eeg_channels {args.eeg_channels}'
+        return FactorizedLatentProjection(args.latent_dim // args.eeg_channels, args.eeg_channels, num_tokens, dim)
+    else:
+        raise NotImplementedError(latent_proj)
+
+
+_checkpoint_enabled = True
+
+@contextlib.contextmanager
+def no_checkpoint():
+    """Run every block list without activation checkpointing inside the context.
+
+    torch.utils.checkpoint recomputes its segment in a nested backward, which
+    does not support torch.autograd.grad(create_graph=True), so the gradient
+    penalty forward of the discriminator has to keep its activations.
+    """
+    global _checkpoint_enabled
+    enabled, _checkpoint_enabled = _checkpoint_enabled, False
+    try:
+        yield
+    finally:
+        _checkpoint_enabled = enabled
+
+
+def checkpoint_stages(spec, num_stages):
+    """Per-stage checkpoint flags from a comma separated string, e.g. "0,1,1" (same layout as --g_depth).
+
+    Missing trailing stages are not checkpointed.
+    """
+    flags = [bool(int(i)) for i in spec.split(",")] if spec else []
+    assert len(flags) <= num_stages, f'{spec} has more than {num_stages} stages'
+    return flags + [False] * (num_stages - len(flags))
+
+
+def any_checkpointed(spec):
+    """Whether the checkpoint_stages `spec` checkpoints any stage, parsed the same way"""
+    return any(bool(int(i)) for i in spec.split(",")) if spec else False
+
+
+def run_blocks(blocks, x, use_checkpoint=False, *args):
+    """x = blk(x, *args) for every block; with `use_checkpoint` the block activations
+    are dropped after the forward and recomputed in the backward.
+    """
+    use_checkpoint = use_checkpoint and _checkpoint_enabled and torch.is_grad_enabled() and x.requires_grad
+    for blk in blocks:
+        if use_checkpoint:
+            # non-tensor arguments (H, W) are bound here, checkpoint only takes tensors
+            x = checkpoint.checkpoint(lambda inp, blk=blk: blk(inp, *args), x)
+        else:
+            x = blk(x, *args)
+    return x
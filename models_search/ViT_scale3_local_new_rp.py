@@ -4,7 +4,7 @@ import torch.nn.functional as F
 import math
 import numpy as np
 
-from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_
+from models_search.ViT_helper import DropPath, to_2tuple, trunc_normal_, RelativePosition, latent_projection, checkpoint_stages, run_blocks
 from models_search.diff_aug import DiffAugment
 from utils.utils import make_grid, save_image
 
@@ -92,7 +92,7 @@ class Mlp(nn.Module):
         return x
 
 
-class Attention(nn.Module):
+class Attention(RelativePosition, nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., window_size=16):
         super().__init__()
         self.num_heads = num_heads
@@ -109,18 +109,6 @@ class Attention(nn.Module):
             self.relative_position_bias_table = nn.Parameter(
                 torch.zeros((2 * window_size - 1) * (2 * window_size - 1), num_heads))  # 2*Wh-1 * 2*Ww-1, nH
 
-            # get pair-wise relative position index for each token inside the window
-            coords_h = torch.arange(window_size)
-            coords_w = torch.arange(window_size)
-            coords = torch.stack(torch.meshgrid([coords_h, coords_w]))  # 2, Wh, Ww
-            coords_flatten = torch.flatten(coords, 1)  # 2, Wh*Ww
-            relative_coords = coords_flatten[:, :, None] - coords_flatten[:, None, :]  # 2, Wh*Ww, Wh*Ww
-            relative_coords = relative_coords.permute(1, 2, 0).contiguous()  # Wh*Ww, Wh*Ww, 2
-            relative_coords[:, :, 0] += window_size - 1  # shift to start from 0
-            relative_coords[:, :, 1] += window_size - 1
-            relative_coords[:, :, 0] *= 2 * window_size - 1
-            relative_position_index = relative_coords.sum(-1)  # Wh*Ww, Wh*Ww
-            self.register_buffer("relative_position_index", relative_position_index)
 
             trunc_normal_(self.relative_position_bias_table, std=.02)
         
@@ -130,10 +118,7 @@ class Attention(nn.Module):
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
         attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
         if self.window_size != 0:
-            relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1).clone()].view(
-                self.window_size * self.window_size, self.window_size * self.window_size, -1)  # Wh*Ww,Wh*Ww,nH
-            relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-            attn = attn + relative_position_bias.unsqueeze(0)
+            attn = attn + self.relative_position_bias().unsqueeze(0)
         
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
@@ -220,6 +205,7 @@ class StageBlock(nn.Module):
     def __init__(self, depth, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm):
         super().__init__()
         self.depth = depth
+        self.use_checkpoint = False
         self.block = nn.ModuleList([
                         Block(
                         dim=dim, 
@@ -235,9 +221,7 @@ class StageBlock(nn.Module):
                         ) for i in range(depth)])
 
     def forward(self, x):
-        for blk in self.block:
-            x = blk(x)
-        return x
+        return run_blocks(self.block, x, self.use_checkpoint)
 
 def pixel_upsample(x, H, W):
     B, N, C = x.size()
@@ -263,7 +247,7 @@ class Generator(nn.Module):
         depth = [int(i) for i in args.g_depth.split(",")]
         act_layer = args.g_act
         
-        self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
+        self.l1 = latent_projection(args, self.bottom_width ** 2, self.embed_dim)
         self.pos_embed_1 = nn.Parameter(torch.zeros(1, self.bottom_width**2, embed_dim))
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
@@ -314,6 +298,9 @@ class Generator(nn.Module):
                         norm_layer=norm_layer
                         )
                     ])
+        stages = [self.blocks, *self.upsample_blocks]
+        for stage, use_checkpoint in zip(stages, checkpoint_stages(args.g_checkpoint, len(stages))):
+            stage.use_checkpoint = use_checkpoint
         for i in range(len(self.pos_embed)):
             trunc_normal_(self.pos_embed[i], std=.02)
 
@@ -475,6 +462,7 @@ class Discriminator(nn.Module):
             )
         
         self.norm = CustomNorm(norm_layer, embed_dim)
+        self.use_checkpoint = checkpoint_stages(args.d_checkpoint, 4)
         self.head = nn.Linear(embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
         trunc_normal_(self.pos_embed_1, std=.02)
@@ -543,15 +531,13 @@ class Discriminator(nn.Module):
         x = window_partition(x, self.window_size)
         x = x.view(-1, self.window_size*self.window_size, C)
         print("X in forward_features", x.size())
-        for blk in self.blocks_1:
-            x = blk(x)
-            print("1) blk(x) in forward_features", x.size())
+        x = run_blocks(self.blocks_1, x, self.use_checkpoint[0])
+        print("1) blk(x) in forward_features", x.size())
         x = x.view(-1, self.window_size, self.window_size, C)
         x = window_reverse(x, self.window_size, H, W).view(B,H*W,C)
         print("X in forward_features", x.size())
-        for blk in self.blocks_11:
-            x = blk(x)
-            print("2) blk(x) in forward_features", x.size())
+        x = run_blocks(self.blocks_11, x, self.use_checkpoint[1])
+        print("2) blk(x) in forward_features", x.size())
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
 #         x = SpaceToDepth(2)(x)
@@ -562,8 +548,7 @@ class Discriminator(nn.Module):
         x = x + self.pos_embed_2
         print("3) X in forward_features", x.size())
         
-        for blk in self.blocks_2:
-            x = blk(x)
+        x = run_blocks(self.blocks_2, x, self.use_checkpoint[2])
         
         _, _, C = x.shape
         x = x.permute(0, 2, 1).view(B, C, H, W)
@@ -575,8 +560,7 @@ class Discriminator(nn.Module):
         x = x + self.pos_embed_3
         print("4) X in forward_features", x.size())
         
-        for blk in self.blocks_3:
-            x = blk(x)
+        x = run_blocks(self.blocks_3, x, self.use_checkpoint[3])
             
 #         _, _, C = x.shape
 #         x = x.permute(0, 2, 1).view(B, C, H, W)
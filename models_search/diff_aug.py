@@ -1,5 +1,7 @@
 # Code Heavily borrowed from Differentiable Augmentation and StyleGAN-ADA
 
+import contextlib
+
 import torch
 import torch.nn.functional as F
 import numpy as np
@@ -45,7 +47,38 @@ wavelets = {
 # Hz_fbank = torch.as_tensor(Hz_fbank, dtype=torch.float32)
 
 
+_batch_splits = None
+
+@contextlib.contextmanager
+def independent_splits(sizes):
+    """Augment each of the `sizes` consecutive parts of the batch independently.
+
+    Besides the per-sample draws, some augmentations draw one choice for the
+    whole batch (crop offset, erase size, ...). A discriminator pass over
+    cat([real, fake]) draws those separately for each part, as two separate
+    passes would. The sizes are module state of the calling thread's pass, so
+    the discriminator must get the whole batch: not under nn.DataParallel,
+    which scatters it over replica threads.
+    """
+    global _batch_splits
+    splits, _batch_splits = _batch_splits, list(sizes)
+    try:
+        yield
+    finally:
+        _batch_splits = splits
+
+
 def DiffAugment(x, policy='', channels_first=True, affine=None):
+    global _batch_splits
+    if policy and _batch_splits is not None and len(_batch_splits) > 1:
+        assert sum(_batch_splits) == x.size(0), \
+            f'batch of {x.size(0)} is not the concatenation of {_batch_splits}, was it scattered by DataParallel?'
+        splits, _batch_splits = _batch_splits, None
+        try:
+            return torch.cat([DiffAugment(part, policy, channels_first, affine)
+                              for part in x.split(splits)], dim=0)
+        finally:
+            _batch_splits = splits
     if policy:
         if not channels_first:
             x = x.permute(0, 3, 1, 2)
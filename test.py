@@ -25,6 +25,12 @@ import cfg
 import models_search
 from functions import validate
 from utils.utils import set_log_dir, create_logger
+from utils import checkpoint as checkpoint_io
+from utils.ema_archive import EMAArchive
+from utils.class_metrics import ClassMetrics
+from utils.feature_cache import FeatureCache
+from utils.torch_inception_score import InceptionExtractor
+from utils.cal_fid_stat import reference_dataset
 from utils.inception_score import _init_inception
 from utils.fid_score import create_inception_graph, check_or_download_inception
 
@@ -80,6 +86,35 @@ def validate(args, fixed_z, fid_stat, epoch, gen_net: nn.Module, writer_dict, cl
 
     return 0, fid_score
 
+def validate_by_class(args, epoch, gen_net: nn.Module, writer_dict):
+    """IS and FID of every class of the test split, from one Inception pass over the generated images (utils.class_metrics)"""
+    dataset = reference_dataset(args, 'test')
+    loader = torch.utils.data.DataLoader(dataset, batch_size=args.eval_batch_size,
+                                         shuffle=False, num_workers=args.num_workers)
+    # the real side is a slice of the cached features of the test images
+    extractor = InceptionExtractor(batch_size=args.eval_batch_size)
+    features = FeatureCache(args.feature_cache, extractor, args.img_size)
+    ids_by_class = {}
+    for i in range(len(dataset)):
+        ids_by_class.setdefault(int(dataset.trSet[i]['label']), []).append(dataset.image_id(i))
+    features.fill([i for ids in ids_by_class.values() for i in ids], dataset.get_image,
+                  batch_size=args.eval_batch_size, num_workers=args.num_workers)
+    real_stats = {label: features.stats(ids) for label, ids in ids_by_class.items() if len(ids) > 1}
+
+    gen_net.eval()
+    class_metrics = ClassMetrics(num_classes=40, extractor=extractor, real_stats=real_stats)
+    with torch.no_grad():
+        for eeg, label, imgs in tqdm(loader, desc='IS and FID by class'):
+            class_metrics.update(label, gen_net(eeg.cuda(), epoch))
+    writer = writer_dict['writer']
+    for label, (IS, IS_std, fid) in class_metrics.results().items():
+        logger.info(f'class {label}: Inception score {IS} +- {IS_std}, FID score {fid}')
+        writer.add_scalar('Inception_score_by_class', IS, label)
+        if fid is not None:
+            writer.add_scalar('FID_score_by_class', fid, label)
+    return class_metrics.summary()
+
+
 def main():
     args = cfg.parse_args()
     torch.cuda.manual_seed(args.random_seed)
@@ -109,7 +144,7 @@ def main():
         fid_stat = args.fid_stat
     else:
         raise NotImplementedError(f'no fid stat for {args.dataset.lower()}')
-    assert os.path.exists(fid_stat)
+    assert args.class_metrics or os.path.exists(fid_stat)
 
     # initial
     fixed_z = torch.cuda.FloatTensor(np.random.normal(0, 1, (4, args.latent_dim)))
@@ -118,10 +153,18 @@ def main():
     logger.info(f'=> resuming from {args.load_path}')
     checkpoint_file = args.load_path
     assert os.path.exists(checkpoint_file)
-    checkpoint = torch.load(checkpoint_file)
+    if os.path.isdir(checkpoint_file):
+        # EMA archive of train_derived.py --ema_archive
+        archive = EMAArchive(checkpoint_file)
+        epoch = archive.epochs()[-1] if args.archive_epoch < 0 else args.archive_epoch
+        checkpoint = {'avg_gen_state_dict': archive.load(epoch), 'epoch': epoch}
+    else:
+        # of a lazy checkpoint only the generator weights are read
+        checkpoint = checkpoint_io.load(checkpoint_file)
 
     if 'avg_gen_state_dict' in checkpoint:
-        gen_net.load_state_dict(checkpoint['avg_gen_state_dict'])
+        # the EMA generator is saved without the DataParallel wrapper
+        gen_net.module.load_state_dict(checkpoint['avg_gen_state_dict'])
         epoch = checkpoint['epoch']
         logger.info(f'=> loaded checkpoint {checkpoint_file} (epoch {epoch})')
     else:
@@ -133,7 +176,10 @@ def main():
         'writer': SummaryWriter(args.path_helper['log_path']),
         'valid_global_steps': 0,
     }
-    inception_score, fid_score = validate(args, fixed_z, fid_stat, epoch, gen_net, writer_dict, clean_dir=False)
+    if args.class_metrics:
+        inception_score, fid_score = validate_by_class(args, epoch, gen_net, writer_dict)
+    else:
+        inception_score, fid_score = validate(args, fixed_z, fid_stat, epoch, gen_net, writer_dict, clean_dir=False)
     logger.info(f'Inception score: {inception_score}, FID score: {fid_score}.')
 
 
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the tests import the modules of the repository root, like the training scripts run from it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# eegDatasetClass (imported by functions) parses the cfg arguments at import, they must not be the pytest ones
+sys.argv = sys.argv[:1]
@@ -0,0 +1,70 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from adamw import AdamW  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(torch, '_foreach_addcdiv_'), reason='no torch._foreach_* kernels')
+
+
+def make_params():
+    g = torch.Generator().manual_seed(0)
+    return [torch.randn(*shape, generator=g, dtype=torch.double).requires_grad_()
+            for shape in [(16, 8), (16,), (3, 3, 4, 4), (1,)]]
+
+
+def run(foreach, amsgrad, steps=6):
+    params = make_params()
+    optimizer = AdamW([{'params': params[:2]}, {'params': params[2:], 'weight_decay': 0.}],
+                      lr=1e-2, betas=(0.5, 0.9), weight_decay=0.1, amsgrad=amsgrad, foreach=foreach)
+    g = torch.Generator().manual_seed(1)
+    for step in range(steps):
+        for i, p in enumerate(params):
+            # the last parameter gets no gradient in the first steps, so the step counts differ
+            p.grad = None if i == len(params) - 1 and step < 2 else torch.randn(p.shape, generator=g, dtype=p.dtype)
+        optimizer.step()
+    return params, optimizer
+
+
+@pytest.mark.parametrize('amsgrad', [False, True])
+def test_foreach_matches_loop(amsgrad):
+    params, optimizer = run(True, amsgrad)
+    ref_params, ref_optimizer = run(False, amsgrad)
+    for p, ref_p in zip(params, ref_params):
+        assert torch.allclose(p, ref_p, rtol=1e-12, atol=1e-12)
+        state, ref_state = optimizer.state[p], ref_optimizer.state[ref_p]
+        assert state.keys() == ref_state.keys()
+        for k, v in ref_state.items():
+            if torch.is_tensor(v):
+                assert torch.allclose(state[k], v, rtol=1e-12, atol=1e-12)
+            else:
+                assert state[k] == v
+    assert optimizer.state[params[-1]]['step'] == optimizer.state[params[0]]['step'] - 2
+
+
+def test_state_dict_loads_across_paths():
+    params, optimizer = run(True, False)
+    ref_params, ref_optimizer = run(False, False)
+    ref_optimizer.load_state_dict(optimizer.state_dict())
+    for p, ref_p in zip(params, ref_params):
+        for k, v in optimizer.state[p].items():
+            assert torch.equal(ref_optimizer.state[ref_p][k], v) if torch.is_tensor(v) else ref_optimizer.state[ref_p][k] == v
+
+
+@pytest.mark.parametrize('foreach', [False, True])
+def test_deepcopy_keeps_foreach(foreach):
+    params, optimizer = run(foreach, False, steps=2)
+    copied = copy.deepcopy(optimizer)
+    assert all(group['foreach'] == foreach for group in copied.param_groups)
+    for p in params:
+        p.grad = torch.ones_like(p)
+    optimizer.step()
+    # the copy steps on its own parameters, the same way as the original
+    for p in copied.param_groups[0]['params'] + copied.param_groups[1]['params']:
+        p.grad = torch.ones_like(p)
+    copied.step()
+    copied_params = copied.param_groups[0]['params'] + copied.param_groups[1]['params']
+    for p, copied_p in zip(params, copied_params):
+        assert torch.allclose(p, copied_p, rtol=1e-12, atol=1e-12)
@@ -0,0 +1,106 @@
+import collections
+import io
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils import checkpoint  # noqa: E402
+
+
+def make_checkpoint():
+    g = torch.Generator().manual_seed(0)
+    state_dict = collections.OrderedDict([
+        ('conv.weight', torch.randn(4, 3, 3, 3, generator=g)),
+        ('conv.bias', torch.randn(4, generator=g).half()),
+        ('bn.num_batches_tracked', torch.tensor(7)),
+    ])
+    state_dict._metadata = collections.OrderedDict([('', {'version': 1}), ('bn', {'version': 2})])
+    tensors = [
+        torch.randn(5, 6, generator=g).t(),  # not contiguous
+        torch.randn(8, generator=g)[::2],
+        torch.arange(10, dtype=torch.int64),
+        torch.rand(3, 3, generator=g) > 0.5,
+        torch.empty(0, 4),
+        torch.tensor(1.5),
+    ]
+    if hasattr(torch, 'bfloat16'):
+        tensors.append(torch.randn(3, 2, generator=g).bfloat16())
+    return {
+        'epoch': 12,
+        'path_helper': {'prefix': 'logs/run', 'ckpt_path': 'logs/run/Model'},
+        'gen_state_dict': state_dict,
+        'tensors': tensors,
+        'pair': (torch.ones(2), 'fixed', [torch.zeros(1, dtype=torch.float16), 3]),
+    }
+
+
+def assert_same(loaded, obj):
+    if torch.is_tensor(obj):
+        assert torch.is_tensor(loaded)
+        assert loaded.dtype == obj.dtype and loaded.shape == obj.shape
+        # half and bfloat16 comparisons are not implemented on the cpu in every torch version
+        assert torch.equal(loaded.float(), obj.float()) if obj.is_floating_point() else torch.equal(loaded, obj)
+    elif isinstance(obj, dict):
+        assert type(loaded) is type(obj) and list(loaded) == list(obj)
+        assert getattr(loaded, '_metadata', None) == getattr(obj, '_metadata', None)
+        for k, v in obj.items():
+            assert_same(loaded[k], v)
+    elif isinstance(obj, (list, tuple)):
+        assert type(loaded) is type(obj) and len(loaded) == len(obj)
+        for a, b in zip(loaded, obj):
+            assert_same(a, b)
+    else:
+        assert loaded == obj
+
+
+def test_round_trip(tmp_path):
+    obj = make_checkpoint()
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.save(obj, path)
+    assert checkpoint.is_lazy_checkpoint(path)
+    loaded = checkpoint.load(path)
+    assert isinstance(loaded, checkpoint.LazyCheckpoint)
+    assert set(loaded) == set(obj) and len(loaded) == len(obj)
+    for k, v in obj.items():
+        assert_same(loaded[k], v)
+    assert_same(loaded.materialize(), obj)
+
+
+def test_save_to_file_object(tmp_path):
+    obj = make_checkpoint()
+    buffer = io.BytesIO()
+    checkpoint.save(obj, buffer)
+    path = tmp_path / 'checkpoint'
+    path.write_bytes(buffer.getvalue())
+    assert_same(checkpoint.load(str(path)).materialize(), obj)
+
+
+def test_tensors_are_writable_and_do_not_touch_the_file(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.save({'w': torch.zeros(4)}, path)
+    checkpoint.load(path)['w'].add_(1)
+    assert torch.equal(checkpoint.load(path)['w'], torch.zeros(4))
+
+
+def test_load_state_dict(tmp_path):
+    net = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.BatchNorm1d(4))
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.save({'gen_state_dict': net.state_dict()}, path)
+    restored = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.BatchNorm1d(4))
+    restored.load_state_dict(checkpoint.load(path)['gen_state_dict'])
+    assert_same(restored.state_dict(), net.state_dict())
+
+
+def test_non_dict_checkpoint_is_materialized(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    checkpoint.save([torch.ones(2), 3], path)
+    assert_same(checkpoint.load(path), [torch.ones(2), 3])
+
+
+def test_load_falls_back_to_torch_load(tmp_path):
+    obj = make_checkpoint()
+    path = str(tmp_path / 'checkpoint.pth')
+    torch.save(obj, path)
+    assert not checkpoint.is_lazy_checkpoint(path)
+    assert_same(checkpoint.load(path), obj)
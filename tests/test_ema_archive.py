@@ -0,0 +1,95 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils.ema_archive import EMAArchive, PRECISIONS  # noqa: E402
+
+TOLERANCE = {'fp32': 1e-6, 'fp16': 1e-3, 'int8': 5e-2}
+
+
+class FlatViews(object):
+    """State dict whose tensors are views of one flat buffer, updated in place like GeneratorEMA on the cpu"""
+    def __init__(self, seed=0):
+        g = torch.Generator().manual_seed(seed)
+        self.shapes = {'a.weight': (16, 8), 'a.bias': (16,), 'b.weight': (4, 16)}
+        self.flat = torch.randn(sum(torch.Size(s).numel() for s in self.shapes.values()), generator=g)
+        self.generator = g
+
+    def state_dict(self):
+        views, start = {}, 0
+        for k, shape in self.shapes.items():
+            n = torch.Size(shape).numel()
+            views[k] = self.flat[start:start + n].view(shape)
+            start += n
+        views['step'] = torch.tensor(0)
+        return views
+
+    def update(self):
+        self.flat.lerp_(torch.randn(self.flat.shape, generator=self.generator), 0.01)
+
+
+def archive_live(tmp_path, precision, epochs=6, keyframe_every=0):
+    ema = FlatViews()
+    archive = EMAArchive(str(tmp_path), precision, keyframe_every)
+    truth = []
+    for epoch in range(1, epochs + 1):
+        for _ in range(5):
+            ema.update()
+        live = ema.state_dict()
+        archive.append(epoch, live)
+        truth.append({k: v.clone() for k, v in live.items()})
+    return archive, truth
+
+
+def max_error(rebuilt, true):
+    return max((rebuilt[k] - v).abs().max().item() for k, v in true.items() if v.is_floating_point())
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+@pytest.mark.parametrize('keyframe_every', [0, 3])
+def test_reconstructs_live_ema(tmp_path, precision, keyframe_every):
+    _, truth = archive_live(tmp_path, precision, keyframe_every=keyframe_every)
+    reader = EMAArchive(str(tmp_path))
+    for epoch, true in enumerate(truth, 1):
+        assert max_error(reader.load(epoch), true) < TOLERANCE[precision]
+    # random access, without the cache of the previous epoch
+    assert max_error(EMAArchive(str(tmp_path)).load(3), truth[2]) < TOLERANCE[precision]
+
+
+def test_deltas_are_not_taken_against_the_updated_weights(tmp_path):
+    # the deltas of a live EMA must not come out as 0
+    _, truth = archive_live(tmp_path, 'fp32')
+    last = EMAArchive(str(tmp_path)).load()
+    assert max_error(last, truth[-1]) < 1e-6
+    assert max_error(truth[0], truth[-1]) > 1e-3
+
+
+def test_append_after_resume_truncates(tmp_path):
+    archive, truth = archive_live(tmp_path, 'fp16', epochs=5)
+    replacement = {k: v + 1 if v.is_floating_point() else v for k, v in truth[2].items()}
+    archive.append(3, replacement)
+    assert archive.epochs() == [1, 2, 3]
+    reader = EMAArchive(str(tmp_path))
+    assert reader.epochs() == [1, 2, 3]
+    assert max_error(reader.load(3), replacement) < 1e-2
+    assert max_error(reader.load(2), truth[1]) < 1e-3
+
+
+def test_generator_ema(tmp_path):
+    GeneratorEMA = pytest.importorskip('functions').GeneratorEMA
+
+    gen_net = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.BatchNorm1d(16), torch.nn.Linear(16, 4))
+    ema = GeneratorEMA(gen_net)
+    archive = EMAArchive(str(tmp_path), 'fp32')
+    truth = []
+    for epoch in range(1, 5):
+        for _ in range(3):
+            with torch.no_grad():
+                for p in gen_net.parameters():
+                    p.add_(torch.randn_like(p))
+            ema.update(gen_net, 0.9)
+        archive.append(epoch, ema.state_dict())
+        truth.append({k: v.clone() for k, v in ema.state_dict().items()})
+    reader = EMAArchive(str(tmp_path))
+    for epoch, true in enumerate(truth, 1):
+        assert max_error(reader.load(epoch), true) < 1e-5
@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+linalg = pytest.importorskip('scipy.linalg')
+
+from utils.fid_stats import FeatureStats, frechet_distance, trace_sqrt_product  # noqa: E402
+
+
+def scipy_frechet_distance(mu1, sigma1, mu2, sigma2):
+    # utils.fid_score.calculate_frechet_distance, without its tensorflow import
+    diff = mu1 - mu2
+    covmean = linalg.sqrtm(sigma1.dot(sigma2), disp=False)[0].real
+    return float(diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * np.trace(covmean))
+
+
+def random_stats(dim, num_images, seed):
+    # non-negative, correlated features like Inception pool features; num_images <= dim gives a singular covariance
+    g = np.random.RandomState(seed)
+    features = np.maximum(g.randn(num_images, dim).dot(g.randn(dim, dim) / np.sqrt(dim)) + g.rand(dim), 0)
+    return features.mean(0), np.cov(features, rowvar=False)
+
+
+@pytest.mark.parametrize('num_images, rtol', [(2000, 1e-6), (40, 1e-4)])
+def test_matches_scipy_sqrtm(num_images, rtol):
+    # sqrtm itself loses accuracy on the singular product, hence the looser tolerance of the rank-deficient case
+    mu1, sigma1 = random_stats(64, num_images, 0)
+    mu2, sigma2 = random_stats(64, num_images, 1)
+    expected = scipy_frechet_distance(mu1, sigma1, mu2, sigma2)
+    assert frechet_distance(mu1, sigma1, mu2, sigma2) == pytest.approx(expected, rel=rtol)
+
+
+def test_identical_statistics():
+    mu, sigma = random_stats(32, 500, 0)
+    assert abs(frechet_distance(mu, sigma, mu, sigma)) < 1e-8
+
+
+def test_trace_sqrt_product_is_symmetric():
+    sigma1 = torch.as_tensor(random_stats(32, 500, 0)[1])
+    sigma2 = torch.as_tensor(random_stats(32, 20, 1)[1])
+    assert float(trace_sqrt_product(sigma1, sigma2)) == pytest.approx(float(trace_sqrt_product(sigma2, sigma1)),
+                                                                     rel=1e-8)
+
+
+def test_tensor_and_float32_inputs():
+    stats = random_stats(64, 2000, 0) + random_stats(64, 2000, 1)
+    expected = frechet_distance(*stats)
+    tensors = [torch.as_tensor(s) for s in stats]
+    assert frechet_distance(*tensors) == pytest.approx(expected, rel=1e-12)
+    assert frechet_distance(*[t.float() for t in tensors]) == pytest.approx(expected, rel=1e-6)
+    assert frechet_distance(*stats, dtype=torch.float32) == pytest.approx(expected, rel=1e-3)
+
+
+def test_feature_stats_match_numpy():
+    g = np.random.RandomState(0)
+    features = g.rand(300, 16)
+    stats = FeatureStats(dim=16)
+    for f in np.array_split(features, 7):
+        stats.update(torch.as_tensor(f, dtype=torch.float32))
+    mu, sigma = stats.mean_cov()
+    assert np.allclose(mu, features.mean(0), atol=1e-6)
+    assert np.allclose(sigma, np.cov(features, rowvar=False), atol=1e-5)
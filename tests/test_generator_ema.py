@@ -0,0 +1,67 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+GeneratorEMA = pytest.importorskip('functions').GeneratorEMA
+
+
+def make_gen_net():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.BatchNorm1d(16), torch.nn.Linear(16, 4))
+
+
+def train_step(gen_net):
+    with torch.no_grad():
+        for p in gen_net.parameters():
+            p.add_(torch.randn_like(p))
+    gen_net.train()(torch.randn(4, 8))  # moves the BatchNorm running statistics
+
+
+@pytest.mark.parametrize('every', [1, 3])
+def test_update_matches_per_parameter_ema(every):
+    gen_net = make_gen_net()
+    ema = GeneratorEMA(gen_net, every=every)
+    avg_params = [p.detach().clone() for p in gen_net.parameters()]
+    beta = 0.9
+    for step in range(1, 8):
+        train_step(gen_net)
+        ema.update(gen_net, beta)
+        if step % every == 0:
+            for avg_p, p in zip(avg_params, gen_net.parameters()):
+                avg_p.mul_(beta ** every).add_(p.detach(), alpha=1. - beta ** every)
+        for avg_p, p in zip(avg_params, ema):
+            assert torch.allclose(p, avg_p, atol=1e-6)
+    if every == 1:
+        for avg_b, b in zip(ema.module.buffers(), gen_net.buffers()):
+            assert torch.equal(avg_b, b)
+
+
+def test_params_stay_views_of_the_flat_buffer():
+    gen_net = make_gen_net()
+    ema = GeneratorEMA(gen_net)
+    train_step(gen_net)
+    ema.update(gen_net, 0.5)
+    flat = torch.cat([p.reshape(-1) for p in ema])
+    assert torch.equal(flat, ema.flat)
+    assert all(not p.requires_grad for p in ema)
+
+
+def test_state_dict_round_trip():
+    gen_net = make_gen_net()
+    ema = GeneratorEMA(gen_net)
+    train_step(gen_net)
+    ema.update(gen_net, 0.9)
+    state = {k: v.clone() for k, v in ema.state_dict().items()}
+    assert state.keys() == gen_net.state_dict().keys()
+
+    restored = GeneratorEMA(make_gen_net())
+    restored.load_state_dict(state)
+    for k, v in restored.state_dict().items():
+        assert torch.equal(v, state[k])
+    # loading must write through the flat buffer, not replace the views
+    assert torch.equal(torch.cat([p.reshape(-1) for p in restored]), restored.flat)
+
+    # older checkpoints hold the list of averaged parameters
+    older = GeneratorEMA(make_gen_net())
+    older.load_state_dict([p.clone() for p in ema])
+    for p, q in zip(older, ema):
+        assert torch.equal(p, q)
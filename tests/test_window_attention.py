@@ -0,0 +1,42 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+vit = pytest.importorskip('models_search.ViT_custom_local544444_256_rp')
+
+
+def partitioned_attention(attn, x, H, W):
+    # the window_partition -> attention -> window_reverse path the local stages used before forward_windows
+    B, N, C = x.shape
+    ws = attn.window_size
+    windows = vit.window_partition(x.view(B, H, W, C), ws).view(-1, ws * ws, C)
+    out = attn(windows)
+    return vit.window_reverse(out.view(-1, ws, ws, C), ws, H, W).view(B, N, C)
+
+
+@pytest.mark.parametrize('H, W', [(8, 8), (8, 16), (4, 4)])
+def test_forward_windows_matches_partition(H, W):
+    torch.manual_seed(0)
+    attn = vit.Attention(32, num_heads=4, window_size=4).double()
+    with torch.no_grad():
+        attn.relative_position_bias_table.normal_()
+    x = torch.randn(2, H * W, 32, dtype=torch.double, requires_grad=True)
+    x_ref = x.detach().clone().requires_grad_(True)
+
+    out = attn(x, H, W)
+    ref = partitioned_attention(attn, x_ref, H, W)
+    assert torch.allclose(out, ref, atol=1e-10)
+
+    grad = torch.randn_like(out)
+    params = list(attn.parameters())
+    grads = torch.autograd.grad(out, [x] + params, grad)
+    ref_grads = torch.autograd.grad(ref, [x_ref] + params, grad)
+    for g, ref_g in zip(grads, ref_grads):
+        assert torch.allclose(g, ref_g, atol=1e-10)
+
+
+def test_window_sized_input_takes_the_window_path():
+    torch.manual_seed(0)
+    attn = vit.Attention(16, num_heads=2, window_size=4).eval()
+    x = torch.randn(3, 16, 16)
+    with torch.no_grad():
+        assert torch.equal(attn(x, 4, 4), attn(x))
@@ -5,11 +5,18 @@ from __future__ import print_function
 import cfg
 import models_search
 import datasets
-from functions import train, validate, get_is, save_samples, LinearLrDecay, load_params, copy_params, cur_stages
-from utils.utils import set_log_dir, save_checkpoint, create_logger
+from functions import train, LinearLrDecay, cur_stages, GeneratorEMA, setup_cpu_worker, generate_and_score, \
+    unused_parameters
+from utils.utils import set_log_dir, create_logger, CheckpointWriter
+from utils import checkpoint as checkpoint_io
+from utils.ema_archive import EMAArchive
+from utils.fid_stats import ReferenceStats
+from utils.torch_inception_score import InceptionExtractor
+from utils.feature_cache import FeatureCache
+from utils.cal_fid_stat import reference_dataset
+from models_search.ViT_helper import any_checkpointed
 from utils.inception_score import _init_inception
 from utils.fid_score import create_inception_graph, check_or_download_inception
-from pytorch_gan_metrics.utils import get_inception_score_from_directory
 
 import torch
 import torch.multiprocessing as mp
@@ -22,10 +29,22 @@ from tensorboardX import SummaryWriter
 from tqdm import tqdm
 from copy import deepcopy
 from adamw import AdamW
+from torch_utils import training_stats
 import random
 
 import lstm
 
+# tensorboard tags of the results of generate_and_score
+METRIC_TAGS = {
+    'IS': 'Inception_score/mean',
+    'IS_std': 'Inception_score/std',
+    'FID': 'FID_score',
+    'KID': 'KID_score/mean',
+    'KID_std': 'KID_score/std',
+    'precision': 'Precision_recall/precision',
+    'recall': 'Precision_recall/recall',
+}
+
 # torch.backends.cudnn.enabled = True
 # torch.backends.cudnn.benchmark = True
 
@@ -54,8 +73,21 @@ def main():
         args.world_size = int(os.environ["WORLD_SIZE"])
 
     args.distributed = args.world_size > 1 or args.multiprocessing_distributed
-
-    ngpus_per_node = torch.cuda.device_count()
+    if args.distributed and any_checkpointed(args.d_checkpoint):
+        # torch 1.7 only has reentrant checkpointing: every checkpointed segment runs its own backward and
+        # fires the gradient hooks of its parameters, once per D pass (real, fake, penalty) of one backward
+        raise ValueError('--d_checkpoint is not supported with DistributedDataParallel: the D step runs '
+                         'several discriminator passes into one backward, which would mark the checkpointed '
+                         'parameters ready more than once. Use --g_checkpoint or train D without it.')
+
+    if args.cpu_procs:
+        # one process per socket or core group, NCCL needs GPUs
+        assert args.precision != 'fp16', 'fp16 training needs CUDA, use --precision bf16 on CPU'
+        args.dist_backend = 'gloo'
+        args.gpu = None
+        ngpus_per_node = args.cpu_procs
+    else:
+        ngpus_per_node = torch.cuda.device_count()
     if args.multiprocessing_distributed:
         # Since we have ngpus_per_node processes per node, the total world_size
         # needs to be adjusted accordingly
@@ -68,11 +100,43 @@ def main():
         main_worker(args.gpu, ngpus_per_node, args)
 
 
+def example_inputs(args, device):
+    """Random (G inputs, D inputs) of two samples, for the parameter check of find_unused_parameters"""
+    return ((torch.randn(2, args.latent_dim, device=device), 0),
+            (torch.randn(2, 3, args.img_size, args.img_size, device=device),))
+
+
+def find_unused_parameters(args, net, checkpoint_spec, *inputs):
+    """find_unused_parameters of the DistributedDataParallel wrapper of `net`.
+
+    The search for unused parameters walks the autograd graph of the forward
+    output, which does not contain the parameters of a reentrant checkpoint
+    segment: they would be marked ready as unused and then again when the
+    segment is recomputed in backward. With checkpointing (or --static_graph)
+    the search is off, so every parameter has to get a gradient, which is
+    checked once on net(*inputs).
+    """
+    if not args.static_graph and not any_checkpointed(checkpoint_spec):
+        return True
+    unused = unused_parameters(net, *inputs)
+    if unused:
+        raise ValueError(f'{len(unused)} parameters of {type(net).__name__} get no gradient ({", ".join(unused[:5])}'
+                         f'{", ..." if len(unused) > 5 else ""}), DistributedDataParallel needs '
+                         f'find_unused_parameters: drop --static_graph and the checkpointing of this network')
+    return False
+
+
 def main_worker(gpu, ngpus_per_node, args):
-    args.gpu = gpu
+    # with --cpu_procs, `gpu` is the index of the process on its node
+    local_rank = gpu
+    args.gpu = None if args.cpu_procs else gpu
 
     if args.gpu is not None:
         print("Use GPU: {} for training".format(args.gpu))
+    elif args.cpu_procs:
+        threads = setup_cpu_worker(local_rank or 0, ngpus_per_node if args.multiprocessing_distributed else 1,
+                                   args.intra_op_threads)
+        print("Use CPU process {} with {} threads for training".format(local_rank or 0, threads))
 
     if args.distributed:
         if args.dist_url == "env://" and args.rank == -1:
@@ -80,9 +144,15 @@ def main_worker(gpu, ngpus_per_node, args):
         if args.multiprocessing_distributed:
             # For multiprocessing distributed training, rank needs to be the
             # global rank among all the processes
-            args.rank = args.rank * ngpus_per_node + gpu
+            args.rank = args.rank * ngpus_per_node + local_rank
         dist.init_process_group(backend=args.dist_backend, init_method=args.dist_url,
                                 world_size=args.world_size, rank=args.rank)
+        # training_stats all-reduces the reported metrics on the device of the backend
+        if args.dist_backend == 'gloo':
+            sync_device = torch.device('cpu')
+        else:
+            sync_device = torch.device('cuda', args.gpu) if args.gpu is not None else torch.device('cuda')
+        training_stats.init_multiprocessing(rank=args.rank, sync_device=sync_device)
 
     # weight init
     def weights_init(m):
@@ -115,7 +185,20 @@ def main_worker(gpu, ngpus_per_node, args):
     gen_net.apply(weights_init)
     dis_net.apply(weights_init)
 
-    if not torch.cuda.is_available():
+    if args.cpu_procs:
+        if args.distributed:
+            # every process trains on its share of the batch, gradients are all-reduced with gloo
+            args.dis_batch_size = int(args.dis_batch_size / ngpus_per_node)
+            args.gen_batch_size = int(args.gen_batch_size / ngpus_per_node)
+            args.batch_size = args.dis_batch_size
+
+            args.num_workers = int((args.num_workers + ngpus_per_node - 1) / ngpus_per_node)
+            gen_inputs, dis_inputs = example_inputs(args, 'cpu')
+            gen_net = torch.nn.parallel.DistributedDataParallel(gen_net,
+                find_unused_parameters=find_unused_parameters(args, gen_net, args.g_checkpoint, *gen_inputs))
+            dis_net = torch.nn.parallel.DistributedDataParallel(dis_net,
+                find_unused_parameters=find_unused_parameters(args, dis_net, args.d_checkpoint, *dis_inputs))
+    elif not torch.cuda.is_available():
         print('using CPU, this will be slow')
     elif args.distributed:
         # For multiprocessing distributed, DistributedDataParallel constructor
@@ -139,8 +222,11 @@ def main_worker(gpu, ngpus_per_node, args):
             args.batch_size = args.dis_batch_size
 
             args.num_workers = int((args.num_workers + ngpus_per_node - 1) / ngpus_per_node)
-            gen_net = torch.nn.parallel.DistributedDataParallel(gen_net, device_ids=[args.gpu], find_unused_parameters=True)
-            dis_net = torch.nn.parallel.DistributedDataParallel(dis_net, device_ids=[args.gpu], find_unused_parameters=True)
+            gen_inputs, dis_inputs = example_inputs(args, f'cuda:{args.gpu}')
+            gen_net = torch.nn.parallel.DistributedDataParallel(gen_net, device_ids=[args.gpu],
+                find_unused_parameters=find_unused_parameters(args, gen_net, args.g_checkpoint, *gen_inputs))
+            dis_net = torch.nn.parallel.DistributedDataParallel(dis_net, device_ids=[args.gpu],
+                find_unused_parameters=find_unused_parameters(args, dis_net, args.d_checkpoint, *dis_inputs))
         else:
             gen_net.cuda()
             dis_net.cuda()
@@ -153,6 +239,8 @@ def main_worker(gpu, ngpus_per_node, args):
         gen_net.cuda(args.gpu)
         dis_net.cuda(args.gpu)
     else:
+        # the replicas would each see a chunk of the concatenated batch, not the split sizes of diff_aug
+        assert not args.dis_concat, '--dis_concat does not work with nn.DataParallel, use DDP or a single GPU'
         gen_net = torch.nn.DataParallel(gen_net).cuda()
         dis_net = torch.nn.DataParallel(dis_net).cuda()
     print(dis_net) if args.rank == 0 else 0
@@ -168,6 +256,8 @@ def main_worker(gpu, ngpus_per_node, args):
                               args.g_lr, weight_decay=args.wd)
         dis_optimizer = AdamW(filter(lambda p: p.requires_grad, dis_net.parameters()),
                               args.g_lr, weight_decay=args.wd)
+    gen_scaler = torch.cuda.amp.GradScaler(enabled=args.precision == 'fp16')
+    dis_scaler = torch.cuda.amp.GradScaler(enabled=args.precision == 'fp16')
     gen_scheduler = LinearLrDecay(gen_optimizer, args.g_lr, 0.0, 0, args.max_iter * args.n_critic)
     dis_scheduler = LinearLrDecay(dis_optimizer, args.d_lr, 0.0, 0, args.max_iter * args.n_critic)
 
@@ -182,7 +272,7 @@ def main_worker(gpu, ngpus_per_node, args):
         args.max_epoch = np.ceil(args.max_iter * args.n_critic / len(train_loader))
 
     # initial
-    gen_avg_param = copy_params(gen_net, mode="gpu")
+    gen_avg_param = GeneratorEMA(gen_net, every=args.ema_every)
     start_epoch = 0
     best_fid = 1e4
     
@@ -193,20 +283,21 @@ def main_worker(gpu, ngpus_per_node, args):
         assert os.path.exists(args.load_path)
         checkpoint_file = os.path.join(args.load_path)
         assert os.path.exists(checkpoint_file)
-        loc = 'cuda:{}'.format(args.gpu)
-        checkpoint = torch.load(checkpoint_file, map_location=loc)
+        loc = 'cpu' if args.gpu is None else 'cuda:{}'.format(args.gpu)
+        # lazy checkpoints only read each entry when it is loaded below
+        checkpoint = checkpoint_io.load(checkpoint_file, map_location=loc)
         start_epoch = checkpoint['epoch']
         best_fid = checkpoint['best_fid']
 
         dis_net.load_state_dict(checkpoint['dis_state_dict'])
         gen_optimizer.load_state_dict(checkpoint['gen_optimizer'])
         dis_optimizer.load_state_dict(checkpoint['dis_optimizer'])
+        if 'gen_scaler' in checkpoint:
+            gen_scaler.load_state_dict(checkpoint['gen_scaler'])
+            dis_scaler.load_state_dict(checkpoint['dis_scaler'])
 
-        #         avg_gen_net = deepcopy(gen_net)
-        gen_avg_param = checkpoint['avg_gen_state_dict']
+        gen_avg_param.load_state_dict(checkpoint['avg_gen_state_dict'])
         gen_net.load_state_dict(checkpoint['gen_state_dict'])
-        #         del avg_gen_net
-        #         gen_avg_param = list(p.cuda().to(f"cuda:{args.gpu}") for p in gen_avg_param)
 
         args.path_helper = checkpoint['path_helper']
         logger = create_logger(args.path_helper['log_path']) if args.rank == 0 else None
@@ -230,6 +321,34 @@ def main_worker(gpu, ngpus_per_node, args):
         'valid_global_steps': start_epoch // args.val_freq,
     }
 
+    is_writer = not args.multiprocessing_distributed or (args.multiprocessing_distributed and args.rank == 0)
+    if is_writer:
+        checkpoint_writer = CheckpointWriter(args.path_helper['ckpt_path'], keep=args.keep_ckpt,
+                                             lazy=args.ckpt_format == 'lazy')
+        if args.ema_archive:
+            ema_archive = EMAArchive(os.path.join(args.path_helper['ckpt_path'], 'ema_archive'),
+                                     args.ema_archive, args.ema_keyframe_every)
+            # epochs archived after the resumed checkpoint belong to the abandoned run
+            ema_archive.truncate(int(start_epoch))
+
+    # reference statistics of the real images, written by utils/cal_fid_stat.py
+    extractor = InceptionExtractor(device='cpu' if args.gpu is None else f'cuda:{args.gpu}')
+    fid_ref = ReferenceStats(args.fid_cache).load(args.dataset, args.fid_split, args.img_size, extractor.id)
+    if fid_ref is None and args.rank == 0:
+        logger.info(f'=> no reference FID statistics of {args.dataset} {args.fid_split} in {args.fid_cache}, '
+                    f'the FID is not computed')
+    # KID and precision/recall compare with the features of the distinct real images, from the feature cache
+    real_features = None
+    if {'kid', 'pr'} & set(args.metrics.split(',')):
+        real_dataset = reference_dataset(args)
+        real_ids = sorted({real_dataset.image_id(i) for i in range(len(real_dataset))})
+        if args.rank == 0:
+            FeatureCache(args.feature_cache, extractor, args.img_size).fill(
+                real_ids, real_dataset.get_image, batch_size=args.eval_batch_size, num_workers=args.num_workers)
+        if dist.is_initialized():
+            dist.barrier()
+        real_features = torch.from_numpy(FeatureCache(args.feature_cache, extractor, args.img_size).features(real_ids))
+
     # train loop
     for epoch in range(int(start_epoch), int(args.max_epoch)):
         train_sampler.set_epoch(epoch)
@@ -237,30 +356,43 @@ def main_worker(gpu, ngpus_per_node, args):
         cur_stage = cur_stages(epoch, args)
         print("cur_stage " + str(cur_stage)) if args.rank == 0 else 0
         print(f"path: {args.path_helper['prefix']}") if args.rank == 0 else 0
-        train(args, gen_net, dis_net, gen_optimizer, dis_optimizer, gen_avg_param, train_loader, epoch, writer_dict, lr_schedulers)
+        train(args, gen_net, dis_net, gen_optimizer, dis_optimizer, gen_avg_param, train_loader, epoch, writer_dict, lr_schedulers,
+              (gen_scaler, dis_scaler))
         
-        backup_param = copy_params(gen_net, mode="gpu")
-        load_params(gen_net, gen_avg_param, args, mode="cpu")
-        save_samples(args, save_image_loader, None, epoch, gen_net, lstm_net, writer_dict)
-        IS, IS_std = get_inception_score_from_directory(f'/home/d.sorge/eeg_visual_classification/training_output/outputEpoch{epoch}')
-        print("Inception Score Epoch", epoch, ":", IS)
-        load_params(gen_net, backup_param, args, mode="cpu")
+        # the EMA generator output goes straight to Inception, PNGs only with --save_samples_every
+        sample_dir = os.path.join(args.path_helper['sample_path'], f'outputEpoch{epoch}') if args.rank == 0 else None
+        results = generate_and_score(args, gen_avg_param.module, save_image_loader, epoch, sample_dir,
+                                     fid_ref, real_features)
+        print(f"Metrics Epoch {epoch}:", results)
+        if args.rank == 0:
+            for name, value in results.items():
+                writer.add_scalar(METRIC_TAGS.get(name, name), value, epoch)
         is_best = False
+        if 'FID' in results:
+            is_best = results['FID'] < best_fid
+            best_fid = min(best_fid, results['FID'])
 
-        if not args.multiprocessing_distributed or (args.multiprocessing_distributed
-                                                    and args.rank == 0):
-            save_checkpoint({
+        if is_writer:
+            # written in the background, training only waits for the copy to host memory
+            checkpoint_writer.save({
                 'epoch': epoch + 1,
                 'gen_model': args.gen_model,
                 'dis_model': args.dis_model,
                 'gen_state_dict': gen_net.state_dict(),
                 'dis_state_dict': dis_net.state_dict(),
-                'avg_gen_state_dict': gen_avg_param,
+                'avg_gen_state_dict': gen_avg_param.state_dict(),
                 'gen_optimizer': gen_optimizer.state_dict(),
                 'dis_optimizer': dis_optimizer.state_dict(),
+                'gen_scaler': gen_scaler.state_dict(),
+                'dis_scaler': dis_scaler.state_dict(),
                 'best_fid': best_fid,
                 'path_helper': args.path_helper
-            }, is_best, args.path_helper['ckpt_path'], filename=f'checkpointForEpoch{epoch + 1}')
+            }, is_best, filename=f'checkpointForEpoch{epoch + 1}')
+            if args.ema_archive:
+                ema_archive.append(epoch + 1, gen_avg_param.state_dict())
+
+    if is_writer:
+        checkpoint_writer.close()
 
 
 if __name__ == '__main__':
@@ -4,70 +4,84 @@
 # @Link    : None
 # @Version : 0.0
 
+"""Reference FID statistics of the real images, into the utils.fid_stats cache.
+
+    python -m utils.cal_fid_stat --dataset eegdataset --img_size 64 --eeg_dataset ... --splits_path ... [--fid_split train]
+    python -m utils.cal_fid_stat --dataset <name> --data_path <dir of jpg images> --img_size 32
+
+Every distinct image is passed through the PyTorch Inception network once and
+its features are kept in the utils.feature_cache store under --feature_cache,
+so other splits or subsets of the same images need no forward pass. With
+--fid_stat the statistics are also written to that file.
+"""
 
-import os
 import glob
-import argparse
-import numpy as np
-from imageio import imread
-import tensorflow as tf
+import os
+import shutil
+
+import torch
+from PIL import Image
+from torchvision import transforms
+
+import cfg
+from utils.feature_cache import FeatureCache
+from utils.fid_stats import ReferenceStats
+from utils.torch_inception_score import InceptionExtractor
+
+
+class ImageFiles(torch.utils.data.Dataset):
+    """The jpg images of a directory, as the (eeg, label, img) samples of the training datasets"""
+    def __init__(self, data_path, transform):
+        self.data_path = data_path
+        self.files = sorted(glob.glob(os.path.join(data_path, '*.jpg')))
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        return 0, 0, self.get_image(self.image_id(i))
 
-import utils.fid_score as fid
+    def image_id(self, i):
+        return os.path.basename(self.files[i])
 
+    def get_image(self, image):
+        return self.transform(Image.open(os.path.join(self.data_path, image)).convert('RGB'))
 
-def parse_args():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '--data_path',
-        type=str,
-        required=True,
-        help='set path to training set jpg images dir')
-    parser.add_argument(
-        '--output_file',
-        type=str,
-        default='fid_stat/fid_stats_cifar10_train.npz',
-        help='path for where to store the statistics')
 
-    opt = parser.parse_args()
-    print(opt)
-    return opt
+def reference_dataset(args, split=None):
+    """Real images of `split` (default --fid_split), deterministically resized like the generator output"""
+    # the transforms of datasets.ImageDataset, without the random flip
+    to_tensor = [
+        transforms.Resize(size=(args.img_size, args.img_size)),
+        transforms.ToTensor(),
+        transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+    ]
+    if args.dataset.lower() == 'eegdataset':
+        # the ImageNet images paired with the EEG trials of the 40 classes, as often as they are trained on
+        from eegDatasetClass import EEGDataset
+        return EEGDataset(eeg_signals_path=args.eeg_dataset, split_path=args.splits_path, split_num=args.split_num,
+                          transform=transforms.Compose([transforms.ToPILImage()] + to_tensor),
+                          split_name=split or args.fid_split)
+    return ImageFiles(args.data_path, transforms.Compose(to_tensor))
 
 
 def main():
-    args = parse_args()
-
-    ########
-    # PATHS
-    ########
-    data_path = args.data_path
-    output_path = args.output_file
-    # if you have downloaded and extracted
-    #   http://download.tensorflow.org/models/image/imagenet/inception-2015-12-05.tgz
-    # set this path to the directory where the extracted files are, otherwise
-    # just set it to None and the script will later download the files for you
-    inception_path = None
-    print("check for inception model..", end=" ", flush=True)
-    inception_path = fid.check_or_download_inception(inception_path)  # download inception if necessary
-    print("ok")
-
-    # loads all images into memory (this might require a lot of RAM!)
-    print("load images..", end=" ", flush=True)
-    image_list = glob.glob(os.path.join(data_path, '*.jpg'))
-    images = np.array([imread(str(fn)).astype(np.float32) for fn in image_list])
-    print("%d images found and loaded" % len(images))
-
-    print("create inception graph..", end=" ", flush=True)
-    fid.create_inception_graph(inception_path)  # load the graph into the current TF graph
-    print("ok")
-
-    print("calculte FID stats..", end=" ", flush=True)
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True
-    with tf.Session(config=config) as sess:
-        sess.run(tf.global_variables_initializer())
-        mu, sigma = fid.calculate_activation_statistics(images, sess, batch_size=100)
-        np.savez_compressed(output_path, mu=mu, sigma=sigma)
-    print("finished")
+    args = cfg.parse_args()
+    dataset = reference_dataset(args)
+    print(f'{len(dataset)} images of {args.dataset} {args.fid_split}')
+    extractor = InceptionExtractor(batch_size=args.eval_batch_size)
+    # each distinct image is extracted once into the feature cache, the samples are a slice of it
+    ids = [dataset.image_id(i) for i in range(len(dataset))]
+    features = FeatureCache(args.feature_cache, extractor, args.img_size)
+    features.fill(ids, dataset.get_image, batch_size=args.eval_batch_size, num_workers=args.num_workers)
+    mu, sigma = features.stats(ids)
+    path = ReferenceStats(args.fid_cache).save(args.dataset, args.fid_split, args.img_size, extractor.id,
+                                               mu, sigma, num_images=len(ids))
+    print(f'statistics in {path}')
+    if args.fid_stat != 'None':
+        shutil.copyfile(path, args.fid_stat)
+        print(f'statistics in {args.fid_stat}')
 
 
 if __name__ == '__main__':
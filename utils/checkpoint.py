@@ -0,0 +1,150 @@
+"""Checkpoint file with a tensor index, loaded lazily through mmap.
+
+Layout: MAGIC, the little-endian uint64 length of the header, the pickled
+header and the raw bytes of the tensors, each aligned to ALIGN bytes. The
+header holds the checkpoint with every tensor replaced by a `TensorRef` and,
+per tensor, its dtype, shape and offset in the data section. Indexing a
+`LazyCheckpoint` only reads the tensors below that key, e.g. the generator
+weights of 'avg_gen_state_dict' without the optimizer states.
+"""
+import collections.abc
+import pickle
+import struct
+
+import numpy as np
+import torch
+
+MAGIC = b'TGCKPT01'
+ALIGN = 64
+
+# dtypes without a numpy equivalent are stored as a same sized integer view
+_VIEW_DTYPES = {torch.bfloat16: torch.int16}
+
+
+class TensorRef(object):
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getstate__(self):
+        return self.index
+
+    def __setstate__(self, index):
+        self.index = index
+
+
+def map_tensors(fn, obj, is_leaf=torch.is_tensor):
+    """`obj` with every tensor (every `is_leaf`) of its nested dicts, lists and tuples replaced by fn(leaf)"""
+    if is_leaf(obj):
+        return fn(obj)
+    if isinstance(obj, dict):
+        mapped = type(obj)((k, map_tensors(fn, v, is_leaf)) for k, v in obj.items())
+        if hasattr(obj, '_metadata'):
+            # versions of the modules of a state_dict, used by load_state_dict
+            mapped._metadata = obj._metadata
+        return mapped
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(fn, v, is_leaf) for v in obj)
+    return obj
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save(obj, f):
+    """Writes `obj` (typically a dict of state dicts) to the path or binary file `f` in the lazy layout."""
+    tensors, index = [], []
+
+    def ref(t):
+        t = t.detach().cpu().contiguous()
+        dtype = str(t.dtype).replace('torch.', '')
+        if t.dtype in _VIEW_DTYPES:
+            t = t.view(_VIEW_DTYPES[t.dtype])
+        offset = _align(index[-1][2] + index[-1][3]) if index else 0
+        index.append((dtype, tuple(t.shape), offset, t.numel() * t.element_size()))
+        tensors.append(t)
+        return TensorRef(len(tensors) - 1)
+
+    header = pickle.dumps({'skeleton': map_tensors(ref, obj), 'tensors': index}, protocol=pickle.HIGHEST_PROTOCOL)
+    if hasattr(f, 'write'):
+        _write(f, header, tensors, index)
+    else:
+        with open(f, 'wb') as fp:
+            _write(fp, header, tensors, index)
+
+
+def _write(f, header, tensors, index):
+    start = _align(len(MAGIC) + 8 + len(header))
+    f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+    f.write(b'\0' * (start - len(MAGIC) - 8 - len(header)))
+    pos = 0
+    for t, (_, _, offset, nbytes) in zip(tensors, index):
+        f.write(b'\0' * (offset - pos))
+        f.write(t.numpy().reshape(-1).view(np.uint8))
+        pos = offset + nbytes
+
+
+def is_lazy_checkpoint(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class LazyCheckpoint(collections.abc.Mapping):
+    """Read-only mapping over the top-level keys of a checkpoint written by `save`.
+
+    Only the header is read when it is opened; `checkpoint[key]` creates the
+    tensors of that entry on top of a copy-on-write mmap of the file, so the
+    pages of the other entries are never read. With a `map_location` device
+    they are moved there right away.
+    """
+    def __init__(self, path, map_location=None):
+        with open(path, 'rb') as f:
+            assert f.read(len(MAGIC)) == MAGIC, f'{path} is not a lazy checkpoint'
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = pickle.loads(f.read(header_len))
+        self.path = path
+        self.map_location = map_location
+        self._skeleton = header['skeleton']
+        self._index = header['tensors']
+        self._offset = _align(len(MAGIC) + 8 + header_len)
+        self._data = None
+
+    def _tensor(self, i):
+        dtype, shape, offset, nbytes = self._index[i]
+        torch_dtype = getattr(torch, dtype)
+        stored_dtype = _VIEW_DTYPES.get(torch_dtype, torch_dtype)
+        if nbytes == 0:
+            t = torch.empty(shape, dtype=stored_dtype)
+        else:
+            if self._data is None:
+                self._data = np.memmap(self.path, dtype=np.uint8, mode='c', offset=self._offset)
+            np_dtype = torch.empty(0, dtype=stored_dtype).numpy().dtype
+            t = torch.from_numpy(self._data[offset:offset + nbytes].view(np_dtype).reshape(shape))
+        if stored_dtype != torch_dtype:
+            t = t.view(torch_dtype)
+        return t if self.map_location is None else t.to(self.map_location)
+
+    def _load(self, obj):
+        return map_tensors(lambda ref: self._tensor(ref.index), obj, lambda x: isinstance(x, TensorRef))
+
+    def __getitem__(self, key):
+        return self._load(self._skeleton[key])
+
+    def __iter__(self):
+        return iter(self._skeleton)
+
+    def __len__(self):
+        return len(self._skeleton)
+
+    def materialize(self):
+        return self._load(self._skeleton)
+
+
+def load(path, map_location=None):
+    """Checkpoint at `path`: a LazyCheckpoint in the lazy layout, otherwise torch.load"""
+    if is_lazy_checkpoint(path):
+        checkpoint = LazyCheckpoint(path, map_location)
+        return checkpoint if isinstance(checkpoint._skeleton, dict) else checkpoint.materialize()
+    return torch.load(path, map_location=map_location)
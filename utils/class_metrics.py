@@ -0,0 +1,77 @@
+"""Inception Score and FID of every class of a labelled test set, from one Inception pass.
+
+The generated images of each batch (and, for FID, the real images the loader
+pairs them with) go through the shared InceptionExtractor once. The logits
+are accumulated by an InceptionScore per class, the pool features are kept
+on the host grouped by label, 8 KiB per image, and the per-class covariances
+are only formed at the end. This replaces saving every sample into an
+outputLabel{k} directory and scoring the directories one by one.
+"""
+import numpy as np
+import torch
+
+from utils.fid_stats import FeatureStats, frechet_distance
+from utils.torch_inception_score import InceptionExtractor, InceptionScore
+
+
+class ClassMetrics(object):
+    """Per-class IS (and FID against the real images of the same class) of the batches passed to `update`"""
+    def __init__(self, num_classes=40, extractor=None, device=None, splits=10, fid=True, real_stats=None):
+        self.extractor = extractor or InceptionExtractor(device=device)
+        self.num_classes = num_classes
+        self.inception_scores = [InceptionScore(self.extractor, splits=splits) for _ in range(num_classes)]
+        self.fid = fid
+        # {label: (mu, sigma)} of the real images, e.g. from utils.feature_cache, instead of extracting them here
+        self.real_stats = real_stats
+        self.gen_features = [[] for _ in range(num_classes)]
+        self.real_features = [[] for _ in range(num_classes)]
+
+    @torch.no_grad()
+    def update(self, labels, gen_imgs, real_imgs=None):
+        """Images in [-1, 1] with their class `labels`; `real_imgs` is required for the FID without real_stats"""
+        labels = torch.as_tensor(labels).cpu()
+        features, logits = self.extractor(gen_imgs)
+        self._group(labels, features, self.gen_features, logits)
+        if self.fid and self.real_stats is None:
+            assert real_imgs is not None, 'the FID needs the real images of the batch'
+            self._group(labels, self.extractor(real_imgs)[0], self.real_features)
+
+    def _group(self, labels, features, grouped, logits=None):
+        features = features.float().cpu()
+        for k in labels.unique().tolist():
+            idx = (labels == k).nonzero().flatten()
+            grouped[k].append(features[idx])
+            if logits is not None:
+                self.inception_scores[k].update_logits(logits[idx.to(logits.device)])
+
+    @staticmethod
+    def _mean_cov(features):
+        stats = FeatureStats(dim=features[0].size(1))
+        for f in features:
+            stats.update(f)
+        return stats.mean_cov()
+
+    def results(self):
+        """{label: (IS, IS_std, FID)} of the classes with images; FID is None without fid or with < 2 images"""
+        results = {}
+        for k in range(self.num_classes):
+            if not self.gen_features[k]:
+                continue
+            IS, IS_std = self.inception_scores[k].score()
+            fid = None
+            if self.real_stats is not None:
+                real = self.real_stats.get(k)
+            elif sum(len(f) for f in self.real_features[k]) > 1:
+                real = self._mean_cov(self.real_features[k])
+            else:
+                real = None
+            if self.fid and real is not None and sum(len(f) for f in self.gen_features[k]) > 1:
+                fid = frechet_distance(*self._mean_cov(self.gen_features[k]), *real)
+            results[k] = (IS, IS_std, fid)
+        return results
+
+    def summary(self):
+        """Mean over the classes of IS and FID, the FID NaN if no class has one"""
+        results = self.results()
+        fids = [fid for _, _, fid in results.values() if fid is not None]
+        return float(np.mean([IS for IS, _, _ in results.values()])), float(np.mean(fids)) if fids else float('nan')
@@ -0,0 +1,139 @@
+"""Archive of the per-epoch EMA generators as keyframes plus compressed deltas.
+
+Epoch e is stored as the difference to the generator reconstructed for the
+previous archived epoch, so the quantization error does not accumulate over
+the chain: every epoch is off by the rounding of its own delta only. Deltas
+are kept in fp32, fp16 or int8 (per-tensor absmax scale), byte-plane shuffled
+and zlib compressed. A full fp32 keyframe is written for the first epoch and
+then every `keyframe_every` epochs, which bounds the deltas to apply on load.
+"""
+import os
+import re
+import zlib
+
+import numpy as np
+import torch
+
+PRECISIONS = ('fp32', 'fp16', 'int8')
+_FILE = re.compile(r'ema_(key|delta)_(\d+)\.pth$')
+
+
+def _shuffle(arr):
+    """Bytes of `arr` grouped by their position in the element, which zlib compresses much better for floats"""
+    return arr.reshape(-1).view(np.uint8).reshape(-1, arr.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+def encode_delta(delta, precision):
+    """(precision, scale, zlib bytes) of the fp32 tensor `delta`"""
+    delta = delta.detach().float().cpu().numpy()
+    scale = 1.
+    if precision == 'int8':
+        scale = float(np.abs(delta).max()) / 127 if delta.size else 0.
+        data = np.round(delta / scale).astype(np.int8) if scale > 0 else np.zeros(delta.shape, np.int8)
+    elif precision == 'fp16':
+        data = delta.astype(np.float16)
+    else:
+        data = delta
+    return precision, scale, zlib.compress(_shuffle(data), 6)
+
+
+def decode_delta(encoded, shape):
+    precision, scale, data = encoded
+    dtype = {'fp32': np.float32, 'fp16': np.float16, 'int8': np.int8}[precision]
+    delta = _unshuffle(zlib.decompress(data), dtype, shape).astype(np.float32)
+    return torch.from_numpy(delta * scale if precision == 'int8' else delta)
+
+
+class EMAArchive(object):
+    """Directory of EMA generator state dicts by epoch, see the module docstring.
+
+    `append(epoch, state_dict)` archives an epoch and `load(epoch)`
+    reconstructs its state dict, in fp32 on the CPU. Appending an epoch that
+    is not after the last archived one (training resumed from an older
+    checkpoint) first drops the archived epochs from it on. The last
+    reconstruction is cached, so scoring the epochs in order applies each
+    delta once.
+    """
+    def __init__(self, directory, precision='fp16', keyframe_every=0):
+        assert precision in PRECISIONS, precision
+        self.directory = directory
+        self.precision = precision
+        self.keyframe_every = keyframe_every
+        os.makedirs(directory, exist_ok=True)
+        self.files = dict()
+        for name in os.listdir(directory):
+            match = _FILE.match(name)
+            if match:
+                self.files[int(match.group(2))] = (match.group(1), os.path.join(directory, name))
+        self._cache = None
+
+    def epochs(self):
+        return sorted(self.files)
+
+    def append(self, epoch, state_dict):
+        self.truncate(epoch - 1)
+        epochs = self.epochs()
+        # a real copy: the weights of a CPU GeneratorEMA are views of its flat buffer, which keeps being updated
+        state_dict = {k: v.detach().to('cpu', dtype=torch.float32 if v.is_floating_point() else v.dtype, copy=True)
+                      for k, v in state_dict.items()}
+        keyframe = not epochs or (self.keyframe_every and epoch - self._keyframe_before(epoch) >= self.keyframe_every)
+        if keyframe:
+            entry = state_dict
+            self._save('key', epoch, entry)
+            self._cache = (epoch, entry)
+            return
+        previous = self.load(epochs[-1])
+        entry, current = dict(), dict()
+        for k, v in state_dict.items():
+            if v.is_floating_point():
+                entry[k] = encode_delta(v - previous[k], self.precision)
+                # the next delta is taken against what a reader will reconstruct
+                current[k] = previous[k] + decode_delta(entry[k], v.shape)
+            else:
+                entry[k] = current[k] = v
+        self._save('delta', epoch, entry)
+        self._cache = (epoch, current)
+
+    def truncate(self, epoch):
+        """Removes the archived epochs after `epoch`"""
+        for e in [e for e in self.epochs() if e > epoch]:
+            os.remove(self.files.pop(e)[1])
+        if self._cache is not None and self._cache[0] > epoch:
+            self._cache = None
+
+    def load(self, epoch=None):
+        """State dict of `epoch`, default the last archived one"""
+        epoch = self.epochs()[-1] if epoch is None else epoch
+        assert epoch in self.files, f'epoch {epoch} is not archived in {self.directory}'
+        if self._cache is not None and self._cache[0] == epoch:
+            return self._cache[1]
+        start = self._keyframe_before(epoch)
+        if self._cache is not None and start <= self._cache[0] < epoch:
+            start, state_dict = self._cache
+        else:
+            state_dict = torch.load(self.files[start][1])
+        for e in self.epochs():
+            if start < e <= epoch:
+                entry = torch.load(self.files[e][1])
+                state_dict = {k: state_dict[k] + decode_delta(v, state_dict[k].shape) if isinstance(v, tuple) else v
+                              for k, v in entry.items()}
+        self._cache = (epoch, state_dict)
+        return state_dict
+
+    def nbytes(self):
+        return sum(os.path.getsize(path) for _, path in self.files.values())
+
+    def _keyframe_before(self, epoch):
+        return max(e for e, (kind, _) in self.files.items() if kind == 'key' and e <= epoch)
+
+    def _save(self, kind, epoch, entry):
+        path = os.path.join(self.directory, f'ema_{kind}_{epoch:04d}.pth')
+        torch.save(entry, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.files[epoch] = (kind, path)
@@ -0,0 +1,142 @@
+"""On-disk cache of the Inception pool features and logits of real images, by image id.
+
+Layout: <root>/<resolution>px_<extractor id>/ holds features.npy [capacity, 2048]
+and logits.npy [capacity, 1008] (float32, read through np.load(mmap_mode='r'))
+and index.json, the ids of the rows that are written. Rows are appended, the
+arrays double their capacity when full, and the index is only replaced after
+the rows it lists are flushed. `fill` does that every `flush_every` batches, so
+an interrupted `fill` keeps the rows of earlier calls and all but the last
+flush_every batches of its own.
+
+Every image goes through Inception once per resolution and extractor. The
+statistics of any list of ids (a split, a class, the trials of one subject,
+with repetitions weighting the images like the samples of the dataset) are
+then a row gather and a reduction:
+
+    cache = FeatureCache('fid_stat/features', InceptionExtractor(), 64)
+    cache.fill(ids, dataset.get_image)
+    mu, sigma = cache.stats([i for i, label in zip(ids, labels) if label == k])
+"""
+import json
+import os
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from utils.fid_stats import FeatureStats
+
+
+class ImagesById(torch.utils.data.Dataset):
+    """(id, get_image(id)) of every id, for a DataLoader over the images missing from the cache"""
+    def __init__(self, ids, get_image):
+        self.ids = list(ids)
+        self.get_image = get_image
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.ids[i], self.get_image(self.ids[i])
+
+
+class FeatureCache(object):
+    """Pool features and logits of `extractor` for images of `resolution` pixels, see the module docstring"""
+    def __init__(self, root, extractor, resolution):
+        self.extractor = extractor
+        self.dir = os.path.join(root, f'{resolution}px_{extractor.id}')
+        self.index = {}
+        index_path = os.path.join(self.dir, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = {image_id: row for row, image_id in enumerate(json.load(f))}
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_id):
+        return image_id in self.index
+
+    def missing(self, ids):
+        """Ids without cached features, once each in order of appearance"""
+        return [i for i in dict.fromkeys(ids) if i not in self.index]
+
+    def _array(self, name, mode='r'):
+        path = os.path.join(self.dir, f'{name}.npy')
+        array = self._arrays.get(name)
+        if array is None or (mode == 'r+' and array.mode != 'r+'):
+            array = self._arrays[name] = np.load(path, mmap_mode=mode)
+        return array
+
+    def _reserve(self, rows):
+        # grows features.npy and logits.npy to at least `rows` rows, doubling the capacity
+        dims = {'features': self.extractor.model.fc.in_features, 'logits': self.extractor.model.fc.out_features}
+        for name, dim in dims.items():
+            path = os.path.join(self.dir, f'{name}.npy')
+            old = self._array(name) if os.path.exists(path) else None
+            capacity = 0 if old is None else old.shape[0]
+            if capacity >= rows:
+                continue
+            tmp_path = os.path.join(self.dir, f'{name}.tmp.npy')
+            new = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                            shape=(max(rows, 2 * capacity, 1024), dim))
+            if old is not None:
+                new[:len(self.index)] = old[:len(self.index)]
+            new.flush()
+            del new
+            self._arrays.pop(name, None)
+            os.replace(tmp_path, path)
+
+    def _write_index(self):
+        ids = sorted(self.index, key=self.index.get)
+        tmp_path = os.path.join(self.dir, 'index.tmp.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(ids, f)
+        os.replace(tmp_path, os.path.join(self.dir, 'index.json'))
+
+    def _flush(self, features, logits):
+        # rows first, then the index that lists them
+        features.flush()
+        logits.flush()
+        self._write_index()
+
+    def fill(self, ids, get_image, batch_size=100, num_workers=0, flush_every=5):
+        """Extracts the features of the ids that are not cached yet, get_image(id) is a [-1, 1] CHW tensor"""
+        missing = self.missing(ids)
+        if not missing:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        self._reserve(len(self.index) + len(missing))
+        features, logits = self._array('features', 'r+'), self._array('logits', 'r+')
+        loader = torch.utils.data.DataLoader(ImagesById(missing, get_image), batch_size=batch_size,
+                                             num_workers=num_workers)
+        for i, (batch_ids, imgs) in enumerate(tqdm(loader, desc=f'features of {len(missing)} images')):
+            batch_features, batch_logits = self.extractor(imgs)
+            start = len(self.index)
+            features[start:start + len(batch_ids)] = batch_features.cpu().numpy()
+            logits[start:start + len(batch_ids)] = batch_logits.cpu().numpy()
+            self.index.update((image_id, start + j) for j, image_id in enumerate(batch_ids))
+            if (i + 1) % flush_every == 0:
+                self._flush(features, logits)
+        self._flush(features, logits)
+
+    def rows(self, ids):
+        return np.fromiter((self.index[i] for i in ids), dtype=np.int64)
+
+    def features(self, ids):
+        """[len(ids), 2048] pool features of the ids, which have to be cached"""
+        return self._array('features')[self.rows(ids)]
+
+    def logits(self, ids):
+        """[len(ids), 1008] classifier logits of the ids, which have to be cached"""
+        return self._array('logits')[self.rows(ids)]
+
+    def stats(self, ids, chunk_size=4096):
+        """FID (mu, sigma) of the images of `ids`, an image counted as often as its id appears"""
+        rows = self.rows(ids)
+        features = self._array('features')
+        feature_stats = FeatureStats(dim=features.shape[1])
+        for start in range(0, len(rows), chunk_size):
+            feature_stats.update(torch.from_numpy(features[rows[start:start + chunk_size]]))
+        return feature_stats.mean_cov()
@@ -0,0 +1,149 @@
+"""KID and k-NN precision/recall on Inception pool features, and one accumulator for all metrics.
+
+EvaluationMetrics sends each batch of generated images through the shared
+InceptionExtractor once and hands the logits to the Inception Score, the
+features to the streaming FID statistics and, for KID and precision/recall,
+keeps them on the host. Adding a metric adds no feature extraction pass.
+
+Both feature metrics work in blocks, so memory is bounded by the block sizes
+and not by the number of images: KID (Binkowski et al. 2018) averages the
+unbiased MMD^2 with the kernel k(x, y) = (x.y / d + 1)^3 over random subsets
+of at most `max_subset_size` images, and precision/recall (Kynkaanniemi et
+al. 2019) estimate each manifold by the balls around its points reaching the
+k-th nearest neighbour, found with a running top-k over distance blocks.
+Real features for them should be of distinct images (utils.feature_cache),
+as repeated images have a nearest neighbour at distance 0.
+"""
+import numpy as np
+import torch
+
+from utils.fid_stats import FeatureStats, frechet_distance
+from utils.torch_inception_score import InceptionScore
+
+METRICS = ('is', 'fid', 'kid', 'pr')
+
+
+def _as_tensor(features, device):
+    return torch.as_tensor(features).to(device, torch.float32)
+
+
+@torch.no_grad()
+def kernel_inception_distance(gen_features, real_features, num_subsets=100, max_subset_size=1000, device='cpu',
+                              seed=0):
+    """(mean, std) of the KID over `num_subsets` random subsets of both feature sets"""
+    gen_features, real_features = _as_tensor(gen_features, device), _as_tensor(real_features, device)
+    d = real_features.size(1)
+    m = min(gen_features.size(0), real_features.size(0), max_subset_size)
+    assert m > 1, 'the KID needs at least two generated and two real images'
+    generator = torch.Generator().manual_seed(seed)
+    kids = []
+    for _ in range(num_subsets):
+        x = gen_features[torch.randperm(gen_features.size(0), generator=generator)[:m].to(device)].double()
+        y = real_features[torch.randperm(real_features.size(0), generator=generator)[:m].to(device)].double()
+        a = (x.mm(x.t()) / d + 1) ** 3 + (y.mm(y.t()) / d + 1) ** 3
+        b = (x.mm(y.t()) / d + 1) ** 3
+        kids.append(((a.sum() - a.diag().sum()) / (m - 1) - b.sum() * 2 / m).item() / m)
+    return float(np.mean(kids)), float(np.std(kids))
+
+
+def _kth_neighbour_radii(features, k, batch_size):
+    # distance of every point to its k-th nearest neighbour (itself excluded), a running top-k over column blocks
+    radii = []
+    for rows in features.split(batch_size):
+        nearest = None
+        for cols in features.split(batch_size):
+            dist = torch.cdist(rows, cols)
+            if nearest is not None:
+                dist = torch.cat([nearest, dist], 1)
+            nearest = dist.topk(min(k + 1, dist.size(1)), dim=1, largest=False).values
+        radii.append(nearest[:, -1])
+    return torch.cat(radii)
+
+
+def _coverage(manifold, radii, probes, batch_size):
+    # fraction of `probes` inside the ball of radius radii[i] around some manifold[i]
+    inside = []
+    for rows in probes.split(batch_size):
+        hit = torch.zeros(rows.size(0), dtype=torch.bool, device=rows.device)
+        for cols, cols_radii in zip(manifold.split(batch_size), radii.split(batch_size)):
+            hit |= (torch.cdist(rows, cols) <= cols_radii[None, :]).any(1)
+        inside.append(hit)
+    return torch.cat(inside).float().mean().item()
+
+
+@torch.no_grad()
+def precision_recall(gen_features, real_features, k=3, batch_size=1000, device='cpu'):
+    """(precision, recall): the fraction of generated images on the real manifold, and of real images on the generated one"""
+    gen_features, real_features = _as_tensor(gen_features, device), _as_tensor(real_features, device)
+    precision = _coverage(real_features, _kth_neighbour_radii(real_features, k, batch_size), gen_features, batch_size)
+    recall = _coverage(gen_features, _kth_neighbour_radii(gen_features, k, batch_size), real_features, batch_size)
+    return precision, recall
+
+
+def _all_gather_rows(t):
+    # concatenation of the [n_rank, ...] tensors of all processes, n_rank may differ
+    size = torch.tensor([t.size(0)], device=t.device)
+    sizes = [torch.zeros_like(size) for _ in range(torch.distributed.get_world_size())]
+    torch.distributed.all_gather(sizes, size)
+    padded = t.new_zeros((int(torch.cat(sizes).max().item()),) + t.shape[1:])
+    padded[:t.size(0)] = t
+    gathered = [torch.zeros_like(padded) for _ in sizes]
+    torch.distributed.all_gather(gathered, padded)
+    return torch.cat([g[:int(n.item())] for g, n in zip(gathered, sizes)])
+
+
+class EvaluationMetrics(object):
+    """The `metrics` (of METRICS) of the generated images passed to `update`, from one Inception pass.
+
+    'fid' needs `fid_ref`, the (mu, sigma) of the real images, 'kid' and 'pr'
+    need `real_features`, the [N, 2048] features of distinct real images. A
+    metric without its reference is skipped.
+    """
+    def __init__(self, extractor, metrics=('is', 'fid'), fid_ref=None, real_features=None):
+        assert set(metrics) <= set(METRICS), f'unknown metrics {set(metrics) - set(METRICS)}'
+        self.extractor = extractor
+        self.metrics = set(metrics)
+        self.inception_score = InceptionScore(extractor) if 'is' in self.metrics else None
+        self.fid_ref = fid_ref
+        self.feature_stats = None
+        if 'fid' in self.metrics and fid_ref is not None:
+            self.feature_stats = FeatureStats(device=extractor.device)
+        self.real_features = real_features if self.metrics & {'kid', 'pr'} else None
+        self.features = [] if self.real_features is not None else None
+
+    @torch.no_grad()
+    def update(self, imgs):
+        features, logits = self.extractor(imgs)
+        if self.inception_score is not None:
+            self.inception_score.update_logits(logits)
+        if self.feature_stats is not None:
+            self.feature_stats.update(features)
+        if self.features is not None:
+            self.features.append(features.float().cpu())
+
+    def all_reduce(self):
+        """Combines the statistics and features of all processes"""
+        if self.inception_score is not None:
+            self.inception_score.all_reduce()
+        if self.feature_stats is not None:
+            self.feature_stats.all_reduce()
+        if self.features is not None:
+            self.features = [_all_gather_rows(torch.cat(self.features).to(self.extractor.device)).cpu()]
+
+    def results(self):
+        """{'IS', 'IS_std', 'FID', 'KID', 'KID_std', 'precision', 'recall'}, the ones that were computed"""
+        results = {}
+        if self.inception_score is not None:
+            results['IS'], results['IS_std'] = self.inception_score.score()
+        if self.feature_stats is not None:
+            results['FID'] = frechet_distance(*self.feature_stats.mean_cov(), *self.fid_ref)
+        if self.features is not None:
+            features = torch.cat(self.features)
+            device = self.extractor.device
+            if 'kid' in self.metrics:
+                results['KID'], results['KID_std'] = kernel_inception_distance(features, self.real_features,
+                                                                               device=device)
+            if 'pr' in self.metrics:
+                results['precision'], results['recall'] = precision_recall(features, self.real_features,
+                                                                           device=device)
+        return results
@@ -0,0 +1,117 @@
+"""Streaming FID statistics of Inception features, and a cache of the reference statistics.
+
+FeatureStats keeps the count, the sum and the sum of outer products of the
+features in float64, so mean and covariance of any number of images take
+O(dim^2) memory. ReferenceStats stores the statistics of real images as
+<root>/<dataset>_<split>_<resolution>px_<extractor id>.npz, with the `mu` and
+`sigma` arrays of the other fid_stat files, and recomputes them only when a
+key is missing. frechet_distance needs no scipy and runs on any device.
+"""
+import os
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+
+class FeatureStats(object):
+    """Mean and covariance of the feature batches passed to `update`"""
+    def __init__(self, dim=2048, device='cpu'):
+        self.count = torch.zeros([], dtype=torch.float64, device=device)
+        self.sum = torch.zeros(dim, dtype=torch.float64, device=device)
+        self.sum_outer = torch.zeros(dim, dim, dtype=torch.float64, device=device)
+
+    @torch.no_grad()
+    def update(self, features):
+        features = features.to(self.sum.device, torch.float64)
+        self.count += features.size(0)
+        self.sum += features.sum(0)
+        self.sum_outer.addmm_(features.t(), features)
+
+    def all_reduce(self):
+        """Sums the statistics over the processes"""
+        for t in (self.count, self.sum, self.sum_outer):
+            torch.distributed.all_reduce(t)
+
+    def mean_cov(self):
+        """(mu, sigma) as float64 numpy arrays, sigma with the unbiased n - 1 normalization"""
+        n = self.count.item()
+        assert n > 1, 'the covariance needs at least two images'
+        mu = self.sum / n
+        sigma = (self.sum_outer - n * mu[:, None] * mu[None, :]) / (n - 1)
+        return mu.cpu().numpy(), sigma.cpu().numpy()
+
+
+def _eigh(a):
+    # torch.linalg.eigh is only in torch >= 1.8
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'eigh'):
+        return torch.linalg.eigh(a)
+    return torch.symeig(a, eigenvectors=True)
+
+
+def trace_sqrt_product(sigma1, sigma2):
+    """Tr(sqrt(sigma1 sigma2)) of two covariance matrices, from eigenvalues of symmetric matrices.
+
+    sigma1 sigma2 is similar to the symmetric sqrt(sigma1) sigma2 sqrt(sigma1),
+    so its square root has the trace sum_i sqrt(lambda_i) of the eigenvalues of
+    the latter. That is two symmetric eigendecompositions, O(d^3) once, where
+    sqrtm iterates on a general matrix. Eigenvalues that are negative through
+    rounding error are clamped to 0, which also covers singular covariances.
+    """
+    w, v = _eigh(sigma1)
+    sqrt_sigma1 = (v * w.clamp(min=0).sqrt()[None, :]).mm(v.t())
+    m = sqrt_sigma1.mm(sigma2).mm(sqrt_sigma1)
+    return _eigh((m + m.t()) / 2)[0].clamp(min=0).sqrt().sum()
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2, device=None, dtype=torch.float64):
+    """Frechet distance of N(mu1, sigma1) and N(mu2, sigma2), as utils.fid_score.calculate_frechet_distance
+
+    The statistics are numpy arrays or tensors. They are evaluated in `dtype` on
+    `device`, by default the device of sigma1 (the cpu for numpy arrays), so
+    float64 on the cpu is always available for tensors on a GPU as well.
+    """
+    if device is None:
+        device = sigma1.device if torch.is_tensor(sigma1) else 'cpu'
+    mu1, sigma1, mu2, sigma2 = (torch.as_tensor(t).to(device, dtype) for t in (mu1, sigma1, mu2, sigma2))
+    assert mu1.shape == mu2.shape, 'Training and test mean vectors have different lengths'
+    assert sigma1.shape == sigma2.shape, 'Training and test covariances have different dimensions'
+    diff = mu1 - mu2
+    return float(diff.dot(diff) + sigma1.trace() + sigma2.trace() - 2 * trace_sqrt_product(sigma1, sigma2))
+
+
+class ReferenceStats(object):
+    """Cache of the (mu, sigma) of real images by dataset, split, resolution and feature extractor"""
+    def __init__(self, root='fid_stat'):
+        self.root = root
+
+    def path(self, dataset, split, resolution, extractor_id):
+        return os.path.join(self.root, f'{dataset.lower()}_{split}_{resolution}px_{extractor_id}.npz')
+
+    def load(self, dataset, split, resolution, extractor_id):
+        """(mu, sigma) of the key, None if it is not cached"""
+        path = self.path(dataset, split, resolution, extractor_id)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            return f['mu'], f['sigma']
+
+    def save(self, dataset, split, resolution, extractor_id, mu, sigma, num_images):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(dataset, split, resolution, extractor_id)
+        # np.savez appends .npz to names without it
+        tmp_path = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, mu=mu, sigma=sigma, num_images=num_images)
+        os.replace(tmp_path, path)
+        return path
+
+    def get_or_compute(self, dataset, split, resolution, extractor, loader):
+        """Cached (mu, sigma), computed from the images of `loader` ((eeg, label, img) batches in [-1, 1]) if missing"""
+        stats = self.load(dataset, split, resolution, extractor.id)
+        if stats is None:
+            feature_stats = FeatureStats(device=extractor.device)
+            for _, _, imgs in tqdm(loader, desc=f'reference stats of {dataset} {split}'):
+                feature_stats.update(extractor(imgs)[0])
+            stats = feature_stats.mean_cov()
+            self.save(dataset, split, resolution, extractor.id, *stats, num_images=int(feature_stats.count.item()))
+        return stats
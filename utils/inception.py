@@ -121,6 +121,8 @@ class InceptionV3(nn.Module):
                 nn.AdaptiveAvgPool2d(output_size=(1, 1))
             ]
             self.blocks.append(nn.Sequential(*block3))
+            # classifier on the final average pooling features, for the Inception Score
+            self.fc = inception.fc
 
         for param in self.parameters():
             param.requires_grad = requires_grad
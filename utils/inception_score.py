@@ -3,18 +3,20 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
 import os
 import os.path
 import sys
 import tarfile
 
 import numpy as np
+import torch
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 from six.moves import urllib
 from tqdm import tqdm
 
+from utils.torch_inception_score import InceptionScore
+
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 MODEL_DIR = '/tmp/imagenet'
 DATA_URL = 'http://download.tensorflow.org/models/image/imagenet/inception-2015-12-05.tgz'
@@ -33,31 +35,13 @@ def get_inception_score(images, splits=10):
     assert (len(images[0].shape) == 3)
     assert (np.max(images[0]) > 10)
     assert (np.min(images[0]) >= 0.0)
-    inps = []
-    for img in images:
-        img = img.astype(np.float32)
-        inps.append(np.expand_dims(img, 0))
+    # batches of the list go straight to the PyTorch Inception network, see utils.torch_inception_score
+    engine = InceptionScore(splits=splits)
     bs = 128
-    #with tf.Session(config=config) as sess:
-    preds = []
-    n_batches = int(math.ceil(float(len(inps)) / float(bs)))
-    for i in tqdm(range(n_batches), desc="Calculate inception score"):
-        sys.stdout.flush()
-        inp = inps[(i * bs):min((i + 1) * bs, len(inps))]
-        inp = np.concatenate(inp, 0)
-        #pred = sess.run(softmax, {'ExpandDims:0': inp})
-        #preds.append(pred)
-        preds.append(inp)
-    preds = np.concatenate(preds, 0)
-    scores = []
-    for i in range(splits):
-        part = preds[(i * preds.shape[0] // splits):((i + 1) * preds.shape[0] // splits), :]
-        kl = part * (np.log(part) - np.log(np.expand_dims(np.mean(part, 0), 0)))
-        kl = np.mean(np.sum(kl, 1))
-        scores.append(np.exp(kl))
-
-        #sess.close()
-    return np.mean(scores), np.std(scores)
+    for i in tqdm(range(0, len(images), bs), desc="Calculate inception score"):
+        batch = torch.from_numpy(np.stack(images[i:i + bs])).permute(0, 3, 1, 2)
+        engine.update(batch, pixels=True)
+    return engine.score()
 
 
 # This function is called automatically.
@@ -23,12 +23,14 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import contextlib
 import os
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 import numpy as np
 import torch
 from utils.inception import InceptionV3
+from utils.fid_stats import frechet_distance
 from torch.nn.functional import adaptive_avg_pool2d
 
 try:
@@ -68,9 +70,9 @@ def sqrt_newton_schulz(A, numIters, dtype=None):
     batchSize = A.shape[0]
     dim = A.shape[1]
     normA = A.mul(A).sum(dim=1).sum(dim=1).sqrt()
-    Y = A.div(normA.view(batchSize, 1, 1).expand_as(A)).to("cuda:0")
-    I = torch.eye(dim, dim).view(1, dim, dim).repeat(batchSize, 1, 1).type(dtype).to("cuda:0")
-    Z = torch.eye(dim, dim).view(1, dim, dim).repeat(batchSize, 1, 1).type(dtype).to("cuda:0")
+    Y = A.div(normA.view(batchSize, 1, 1).expand_as(A))
+    I = torch.eye(dim, dim, device=A.device).view(1, dim, dim).repeat(batchSize, 1, 1).type(dtype)
+    Z = torch.eye(dim, dim, device=A.device).view(1, dim, dim).repeat(batchSize, 1, 1).type(dtype)
     for i in range(numIters):
         T = 0.5 * (3.0 * I - Z.bmm(Y))
         Y = Y.bmm(T)
@@ -144,12 +146,13 @@ def get_activations(args, gen_net, model, batch_size=50, dims=2048,
 #             batch_size = gen_imgs.shape[0]
 
         n_batches = args.num_eval_imgs // batch_size
+        device = next(model.parameters()).device
 
         # normalize
         
         pred_arr = []
         for i in tqdm(range(n_batches)):
-            z = torch.cuda.FloatTensor(np.random.normal(0, 1, (batch_size, args.latent_dim)))
+            z = torch.randn(batch_size, args.latent_dim, device=next(gen_net.parameters()).device)
             gen_imgs = gen_net(z, 200)
             
             if verbose:
@@ -159,8 +162,7 @@ def get_activations(args, gen_net, model, batch_size=50, dims=2048,
             end = start + batch_size
 
             images = (gen_imgs + 1.0) / 2.0
-            model.to("cuda:0")
-            pred = model(images.to("cuda:0"))[0]
+            pred = model(images.to(device))[0]
 
             # If model output is not scalar, apply global spatial average pooling.
             # This happens if you choose a dimensionality not equal 2048.
@@ -201,15 +203,11 @@ def torch_calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
     assert sigma1.shape == sigma2.shape, \
         'Training and test covariances have different dimensions'
 
-    diff = mu1 - mu2
-    # Run 50 itrs of newton-schulz to get the matrix sqrt of sigma1 dot sigma2
-    covmean = sqrt_newton_schulz(sigma1.mm(sigma2).unsqueeze(0), 50).squeeze()
-    out = (diff.dot(diff) + torch.trace(sigma1) + torch.trace(sigma2)
-           - 2 * torch.trace(covmean))
-    return out
+    # the trace of sqrt(sigma1 sigma2) from eigenvalues, in float64 on the device of sigma1
+    return frechet_distance(mu1, sigma1, mu2, sigma2)
 
 
-def calculate_activation_statistics(gen_net, model, batch_size=50,
+def calculate_activation_statistics(args, gen_net, model, batch_size=50,
                                     dims=2048, cuda=False, verbose=False):
     """Calculation of the statistics used by the FID.
     Params:
@@ -228,7 +226,7 @@ def calculate_activation_statistics(gen_net, model, batch_size=50,
     -- sigma : The covariance matrix of the activations of the pool_3 layer of
                the inception model.
     """
-    act = get_activations(gen_net, model, batch_size, dims, cuda, verbose)
+    act = get_activations(args, gen_net, model, batch_size, dims, cuda, verbose)
     mu = torch.mean(act, dim=0)
     sigma = torch_cov(act, rowvar=False)
     return mu, sigma
@@ -258,7 +256,7 @@ def calculate_fid_given_paths_torch(args, gen_net, path, require_grad=False, gen
     :param gen_imgs: The value range of gen_imgs should be (-1, 1). Just the output of tanh.
     :param path: fid file path. *.npz.
     :param batch_size:
-    :param cuda:
+    :param cuda: unused, the Inception network runs on the device of gen_net
     :param dims:
     :return:
     """
@@ -271,9 +269,7 @@ def calculate_fid_given_paths_torch(args, gen_net, path, require_grad=False, gen
 
         block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[dims]
 
-        model = InceptionV3([block_idx])
-        if cuda:
-            model.cuda()
+        model = InceptionV3([block_idx]).to(next(gen_net.parameters()).device)
 
         m1, s1 = _compute_statistics_of_path(args, gen_net, model, batch_size,
                                              dims, cuda)
@@ -281,8 +277,7 @@ def calculate_fid_given_paths_torch(args, gen_net, path, require_grad=False, gen
         m2, s2 = _compute_statistics_of_path(args, path, model, batch_size,
                                              dims, cuda)
         # print(f'GT stat: {m2}, {s2}')
-        fid_value = torch_calculate_frechet_distance(m1.to("cuda:0"), s1.to("cuda:0"), torch.tensor(m2).float().cuda().to("cuda:0"),
-                                                     torch.tensor(s2).float().cuda().to("cuda:0"))
+        fid_value = torch_calculate_frechet_distance(m1, s1, m2, s2)
         del model
 
     return fid_value
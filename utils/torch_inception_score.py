@@ -0,0 +1,132 @@
+"""Inception Score on the local PyTorch InceptionV3 (utils.inception), computed batch by batch.
+
+InceptionExtractor also returns the pool features of the same pass, for FID.
+
+Generator output is resized to 299x299 on its device and classified by the
+FID Inception network, whose 1008-way classifier is the one of the original
+TF IS graph. Per split only the number of images, the sum of the predicted
+class distributions and the sum of their negative entropies are kept, which
+is all the score needs:
+
+    IS = exp(E_x[KL(p(y|x) || p(y))])
+       = exp(sum_x sum_y p(y|x) log p(y|x) / n - sum_y p(y) log p(y))
+
+so memory does not depend on the number of images, and no list of images is
+ever built. Images are assigned to the splits round-robin.
+"""
+import functools
+import hashlib
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utils.inception import InceptionV3
+
+
+@functools.lru_cache()
+def inception_model(device='cpu'):
+    """FID InceptionV3 returning the final average pooling features, in eval mode on `device` (built once per device)"""
+    block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[2048]
+    return InceptionV3([block_idx], normalize_input=False).to(device).eval()
+
+
+class InceptionExtractor(object):
+    """Pool features and classifier logits of the FID Inception network, in one pass.
+
+    Images are NCHW tensors in [-1, 1], the range of the generator output
+    (or uint8 in [0, 255] with `pixels=True`). With `quantize` they are rounded
+    to 8 bit first, so the results match the ones of the saved images. They
+    are processed in chunks of `batch_size`.
+    """
+    def __init__(self, model=None, device=None, batch_size=100, quantize=True):
+        if model is None:
+            model = inception_model(str(device or ('cuda' if torch.cuda.is_available() else 'cpu')))
+        self.model = model
+        self.device = next(model.parameters()).device
+        self.batch_size = batch_size
+        self.quantize = quantize
+        self._id = None
+
+    @property
+    def id(self):
+        """Hash of the network weights and the preprocessing, identifies the features it extracts"""
+        if self._id is None:
+            h = hashlib.sha1(f'quantize={self.quantize}'.encode())
+            for name, t in sorted(self.model.state_dict().items()):
+                h.update(name.encode())
+                h.update(t.detach().cpu().numpy().tobytes())
+            self._id = h.hexdigest()[:12]
+        return self._id
+
+    def preprocess(self, imgs, pixels=False):
+        """[-1, 1] (or [0, 255] `pixels`) images as the float input of the Inception network"""
+        imgs = imgs.to(self.device, non_blocking=True)
+        if pixels:
+            imgs = imgs.float() / 127.5 - 1
+        elif self.quantize:
+            imgs = (imgs.float() * 127.5 + 127.5).clamp_(0, 255).round_() / 127.5 - 1
+        return imgs.float()
+
+    @torch.no_grad()
+    def __call__(self, imgs, pixels=False):
+        """(features [N, 2048], logits [N, 1008]) of the images"""
+        features, logits = [], []
+        for batch in imgs.split(self.batch_size):
+            pool = self.model(self.preprocess(batch, pixels))[0].flatten(1)
+            features.append(pool)
+            logits.append(self.model.fc(pool))
+        return torch.cat(features), torch.cat(logits)
+
+
+class InceptionScore(object):
+    """Accumulates the Inception Score of the images passed to `update`, see InceptionExtractor for their format.
+
+    `update_logits` takes the logits of an extractor that is shared with other
+    metrics instead.
+    """
+    def __init__(self, extractor=None, device=None, splits=10, batch_size=100, quantize=True):
+        self.extractor = extractor or InceptionExtractor(device=device, batch_size=batch_size, quantize=quantize)
+        self.device = self.extractor.device
+        self.splits = splits
+        self.reset()
+
+    def reset(self):
+        num_classes = self.extractor.model.fc.out_features
+        self.count = torch.zeros(self.splits, dtype=torch.float64, device=self.device)
+        self.sum_probs = torch.zeros(self.splits, num_classes, dtype=torch.float64, device=self.device)
+        self.sum_neg_entropy = torch.zeros(self.splits, dtype=torch.float64, device=self.device)
+        self.num_images = 0
+
+    @torch.no_grad()
+    def update(self, imgs, pixels=False):
+        self.update_logits(self.extractor(imgs, pixels)[1])
+
+    @torch.no_grad()
+    def update_logits(self, logits):
+        logits = logits.to(self.device).double()
+        probs = F.softmax(logits, dim=1)
+        neg_entropy = (probs * F.log_softmax(logits, dim=1)).sum(1)
+        split = (torch.arange(logits.size(0), device=self.device) + self.num_images) % self.splits
+        self.count.index_add_(0, split, torch.ones_like(neg_entropy))
+        self.sum_probs.index_add_(0, split, probs)
+        self.sum_neg_entropy.index_add_(0, split, neg_entropy)
+        self.num_images += logits.size(0)
+
+    def all_reduce(self):
+        """Sums the statistics over the processes, so that every rank scores the images of all of them"""
+        for t in (self.count, self.sum_probs, self.sum_neg_entropy):
+            torch.distributed.all_reduce(t)
+
+    def scores(self):
+        """Inception Score of every (non empty) split"""
+        used = self.count > 0
+        count = self.count[used]
+        marginal = self.sum_probs[used] / count[:, None]
+        marginal_neg_entropy = (marginal * torch.log(marginal.clamp(min=1e-30))).sum(1)
+        return torch.exp(self.sum_neg_entropy[used] / count - marginal_neg_entropy).cpu().numpy()
+
+    def score(self):
+        """(mean, std) of the split scores, like utils.inception_score.get_inception_score"""
+        scores = self.scores()
+        return float(np.mean(scores)), float(np.std(scores))
@@ -8,6 +8,9 @@ import collections
 import logging
 import math
 import os
+import queue
+import shutil
+import threading
 import time
 from datetime import datetime
 
@@ -22,6 +25,8 @@ import warnings
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 
+from utils import checkpoint
+
 @torch.no_grad()
 def make_grid(
     tensor: Union[torch.Tensor, List[torch.Tensor]],
@@ -194,10 +199,90 @@ def set_log_dir(root_dir, exp_name):
 
 
 def save_checkpoint(states, is_best, output_dir,
-                    filename='checkpoint.pth'):
-    torch.save(states, os.path.join(output_dir, filename))
+                    filename='checkpoint.pth', lazy=False):
+    path = os.path.join(output_dir, filename)
+    atomic_save(states, path, lazy)
     if is_best:
-        torch.save(states, os.path.join(output_dir, 'checkpoint_best.pth'))
+        atomic_copy(path, os.path.join(output_dir, 'checkpoint_best.pth'))
+
+
+def atomic_save(obj, path, lazy=False):
+    """torch.save (or with `lazy` utils.checkpoint.save) to a temporary file that replaces `path` once complete,
+    so a crash never leaves a truncated checkpoint"""
+    tmp_path = path + '.tmp'
+    if lazy:
+        checkpoint.save(obj, tmp_path)
+    else:
+        torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def atomic_copy(src, dst):
+    tmp_path = dst + '.tmp'
+    shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def to_host(obj):
+    """Copy of the tensors of a (nested) state dict in host memory, that training can no longer modify"""
+    return checkpoint.map_tensors(lambda t: t.detach().to('cpu', copy=True), obj)
+
+
+class CheckpointWriter(object):
+    """save_checkpoint on a background thread, keeping the last `keep` checkpoints (0: all) plus the best one.
+
+    With `lazy` the checkpoints are written in the indexed layout of utils.checkpoint.
+
+    `save` only blocks for the copy of the states to host memory, and while
+    one checkpoint is already waiting behind the one being written. Only the
+    checkpoints written by this writer are rotated.
+    """
+    def __init__(self, output_dir, keep=0, lazy=False):
+        self.output_dir = output_dir
+        self.keep = keep
+        self.lazy = lazy
+        self.written = []
+        self.error = None
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, states, is_best, filename='checkpoint.pth'):
+        self._raise()
+        self.queue.put((to_host(states), is_best, filename))
+
+    def wait(self):
+        """Blocks until every queued checkpoint is on disk"""
+        self.queue.join()
+        self._raise()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                states, is_best, filename = item
+                save_checkpoint(states, is_best, self.output_dir, filename, self.lazy)
+                if filename in self.written:
+                    self.written.remove(filename)
+                self.written.append(filename)
+                while self.keep and len(self.written) > self.keep:
+                    os.remove(os.path.join(self.output_dir, self.written.pop(0)))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
 
 
 class RunningStats: